@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import add_write_listener, load_transaction_columns
+
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "60"))
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+PLAN_FORECAST_MONTHS = int(os.getenv("PLAN_FORECAST_MONTHS", "6"))
+PLAN_FORECAST_HORIZON_MONTHS = int(os.getenv("PLAN_FORECAST_HORIZON_MONTHS", "12"))
+PLAN_FORECAST_MAX_MONTHS = float(os.getenv("PLAN_FORECAST_MAX_MONTHS", "1200"))
+PERCENTILES = (50, 75, 90, 95, 99)
+UNCATEGORIZED = "Без категории"
+OTHER = "Другое"
+SECONDS_PER_DAY = 86400
+SECONDS_PER_MONTH = 30.4375 * SECONDS_PER_DAY
+
+
+class BudgetColumns:
+    __slots__ = ("ts", "amount", "is_income", "category", "categories", "loaded_at")
+
+    def __init__(self, rows: list[tuple[str, float, str, str]]) -> None:
+        count = len(rows)
+        self.is_income = np.fromiter(
+            (row[0] == "income" for row in rows), dtype=bool, count=count
+        )
+        self.amount = np.fromiter((row[1] for row in rows), dtype=np.float64, count=count)
+        self.ts = (
+            np.array([row[2] for row in rows], dtype="datetime64[s]").astype(np.int64)
+            if count
+            else np.empty(0, dtype=np.int64)
+        )
+        categories, codes = np.unique(
+            np.array([row[3] or UNCATEGORIZED for row in rows], dtype=object),
+            return_inverse=True,
+        )
+        self.categories = [str(name) for name in categories]
+        self.category = codes.astype(np.int32).reshape(-1)
+        self.loaded_at = time.monotonic()
+
+
+_CACHE: dict[int, BudgetColumns] = {}
+_FORECASTS: dict[int, tuple[float, tuple, dict]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def invalidate(budget_id: int) -> None:
+    with _CACHE_LOCK:
+        _CACHE.pop(budget_id, None)
+        _FORECASTS.pop(budget_id, None)
+
+
+add_write_listener(invalidate)
+
+
+def budget_columns(budget_id: int) -> BudgetColumns:
+    with _CACHE_LOCK:
+        columns = _CACHE.get(budget_id)
+    if columns is not None and time.monotonic() - columns.loaded_at < ANALYTICS_CACHE_TTL:
+        return columns
+    columns = BudgetColumns(load_transaction_columns(budget_id))
+    with _CACHE_LOCK:
+        if len(_CACHE) >= ANALYTICS_CACHE_SIZE:
+            oldest = min(_CACHE, key=lambda key: _CACHE[key].loaded_at)
+            _CACHE.pop(oldest, None)
+        _CACHE[budget_id] = columns
+    return columns
+
+
+def _to_epoch(value: str | None, default: int) -> int:
+    if not value:
+        return default
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+def _day_label(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+
+def compute_analytics(
+    budget_id: int,
+    t_type: str,
+    start: str | None = None,
+    end: str | None = None,
+    top: int = 5,
+    window: int = 7,
+    tz_offset_minutes: int = 0,
+) -> dict:
+    columns = budget_columns(budget_id)
+    start_ts = _to_epoch(start, np.iinfo(np.int64).min)
+    end_ts = _to_epoch(end, np.iinfo(np.int64).max)
+    mask = (
+        (columns.is_income == (t_type == "income"))
+        & (columns.ts >= start_ts)
+        & (columns.ts <= end_ts)
+    )
+    amount = columns.amount[mask]
+    if not amount.size:
+        return {
+            "total": 0.0,
+            "count": 0,
+            "average": 0.0,
+            "percentiles": {str(p): 0.0 for p in PERCENTILES},
+            "daily": [],
+            "weekday": [0.0] * 7,
+            "hour": [0.0] * 24,
+            "months": [],
+            "categories": [],
+        }
+    local_ts = columns.ts[mask] + tz_offset_minutes * 60
+    days = local_ts // SECONDS_PER_DAY
+    return {
+        "total": float(amount.sum()),
+        "count": int(amount.size),
+        "average": float(amount.mean()),
+        "percentiles": {
+            str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(amount, PERCENTILES))
+        },
+        "daily": _daily_series(days, amount, max(1, window)),
+        "weekday": np.bincount((days + 3) % 7, weights=amount, minlength=7).tolist(),
+        "hour": np.bincount(
+            (local_ts % SECONDS_PER_DAY) // 3600, weights=amount, minlength=24
+        ).tolist(),
+        "months": _month_deltas(days, amount),
+        "categories": _top_categories(
+            columns.category[mask], amount, columns.categories, max(1, top)
+        ),
+    }
+
+
+def _daily_series(days: np.ndarray, amount: np.ndarray, window: int) -> list[dict]:
+    first = int(days.min())
+    totals = np.bincount(days - first, weights=amount)
+    cumulative = np.concatenate(([0.0], np.cumsum(totals)))
+    idx = np.arange(1, totals.size + 1)
+    lower = np.maximum(idx - window, 0)
+    moving = (cumulative[idx] - cumulative[lower]) / (idx - lower)
+    return [
+        {"date": _day_label(first + offset), "total": float(total), "average": float(avg)}
+        for offset, (total, avg) in enumerate(zip(totals, moving))
+    ]
+
+
+def _month_deltas(days: np.ndarray, amount: np.ndarray) -> list[dict]:
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    first = int(months.min())
+    totals = np.bincount(months - first, weights=amount)
+    previous = np.concatenate(([np.nan], totals[:-1]))
+    delta = totals - previous
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.where(previous > 0, delta / previous * 100, np.nan)
+    return [
+        {
+            "month": str(np.datetime64(first + offset, "M")),
+            "total": float(total),
+            "delta": None if np.isnan(d) else float(d),
+            "delta_percent": None if np.isnan(p) else float(p),
+        }
+        for offset, (total, d, p) in enumerate(zip(totals, delta, percent))
+    ]
+
+
+def _top_categories(
+    codes: np.ndarray, amount: np.ndarray, names: list[str], top: int
+) -> list[dict]:
+    totals = np.bincount(codes, weights=amount, minlength=len(names))
+    order = np.argsort(-totals, kind="stable")
+    order = order[totals[order] > 0]
+    items = [{"category": names[i], "total": float(totals[i])} for i in order[:top]]
+    rest = float(totals[order[top:]].sum())
+    if rest > 0:
+        items.append({"category": OTHER, "total": rest})
+    return items
+
+
+def _net_monthly(columns: BudgetColumns, now: int) -> float:
+    if not columns.ts.size:
+        return 0.0
+    window_start = now - PLAN_FORECAST_MONTHS * SECONDS_PER_MONTH
+    mask = columns.ts >= window_start
+    if not mask.any():
+        return 0.0
+    signed = np.where(columns.is_income[mask], columns.amount[mask], -columns.amount[mask])
+    span = now - max(window_start, int(columns.ts.min()))
+    return float(signed.sum() / max(span / SECONDS_PER_MONTH, 1.0))
+
+
+def forecast_plans(
+    budget_id: int, plans: list[tuple[int, str, str, float, float, str, str]]
+) -> dict[int, dict]:
+    key = tuple((row[0], row[3], row[4]) for row in plans)
+    with _CACHE_LOCK:
+        cached = _FORECASTS.get(budget_id)
+    if (
+        cached is not None
+        and cached[1] == key
+        and time.monotonic() - cached[0] < ANALYTICS_CACHE_TTL
+    ):
+        return cached[2]
+    result = _forecast(budget_columns(budget_id), plans, int(time.time()))
+    with _CACHE_LOCK:
+        _FORECASTS[budget_id] = (time.monotonic(), key, result)
+    return result
+
+
+def _forecast(
+    columns: BudgetColumns, plans: list[tuple[int, str, str, float, float, str, str]], now: int
+) -> dict[int, dict]:
+    if not plans:
+        return {}
+    ids = [row[0] for row in plans]
+    target = np.fromiter((row[3] for row in plans), dtype=np.float64, count=len(plans))
+    current = np.fromiter((row[4] for row in plans), dtype=np.float64, count=len(plans))
+    created = np.array([row[6] for row in plans], dtype="datetime64[s]").astype(np.int64)
+    remaining = np.maximum(target - current, 0.0)
+    open_plans = remaining > 0
+    elapsed_months = np.maximum((now - created) / SECONDS_PER_MONTH, 1.0)
+    deposit_pace = current / elapsed_months
+    net_monthly = _net_monthly(columns, now)
+    idle = open_plans & (deposit_pace <= 0)
+    share = max(net_monthly, 0.0) / max(int(idle.sum()), 1)
+    pace = np.where(deposit_pace > 0, deposit_pace, share)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        months_left = np.where(pace > 0, remaining / pace, np.inf)
+    months_left[months_left > PLAN_FORECAST_MAX_MONTHS] = np.inf
+    months_left[~open_plans] = 0.0
+    eta = np.where(
+        np.isfinite(months_left),
+        now + np.nan_to_num(months_left, posinf=0.0) * SECONDS_PER_MONTH,
+        0,
+    ).astype("int64")
+    required = remaining / max(PLAN_FORECAST_HORIZON_MONTHS, 1)
+    return {
+        plan_id: {
+            "monthly_pace": float(pace[i]),
+            "months_left": float(months_left[i]) if np.isfinite(months_left[i]) else None,
+            "eta": (
+                str(np.datetime64(int(eta[i]), "s").astype("datetime64[D]"))
+                if open_plans[i] and np.isfinite(months_left[i])
+                else None
+            ),
+            "required_monthly": float(required[i]),
+            "horizon_months": PLAN_FORECAST_HORIZON_MONTHS,
+            "net_monthly": net_monthly,
+            "done": not bool(open_plans[i]),
+        }
+        for i, plan_id in enumerate(ids)
+    }
@@ -0,0 +1,280 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from db import DB_KIND, database_files
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "").strip()
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", "86400"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.01"))
+BACKUP_COMPRESSLEVEL = int(os.getenv("BACKUP_COMPRESSLEVEL", "6"))
+MANIFEST_NAME = "manifest.json"
+STAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+_STATS_LOCK = threading.Lock()
+_STATS = {
+    "running": False,
+    "file": None,
+    "progress": 0.0,
+    "backups": 0,
+    "failures": 0,
+    "last_path": None,
+    "last_finished_at": None,
+    "last_duration_seconds": None,
+    "last_size_bytes": None,
+    "last_error": None,
+}
+
+
+def backup_stats() -> dict:
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def _update(**values) -> None:
+    with _STATS_LOCK:
+        _STATS.update(values)
+
+
+def _copy_online(source: str, target: str, pages: int, pause: float, on_progress) -> None:
+    src = sqlite3.connect(source, isolation_level=None)
+    dst = sqlite3.connect(target)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            on_progress((total - remaining) / total if total else 1.0)
+            if remaining and pause > 0:
+                time.sleep(pause)
+
+        src.backup(dst, pages=max(1, pages), progress=progress)
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _compress(source: str, target: str, level: int) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as raw, gzip.open(target, "wb", compresslevel=level) as packed:
+        while chunk := raw.read(CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            packed.write(chunk)
+    return digest.hexdigest(), size
+
+
+def _decompress(source: str, target: str) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with gzip.open(source, "rb") as packed, open(target, "wb") as raw:
+        while chunk := packed.read(CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+            raw.write(chunk)
+    return digest.hexdigest(), size
+
+
+def _check_space(path: str, directory: str) -> None:
+    needed = 2 * sum(
+        os.path.getsize(name) for name in (path, f"{path}-wal") if os.path.exists(name)
+    )
+    free = shutil.disk_usage(directory).free
+    if free < needed:
+        raise RuntimeError(
+            f"Not enough space in {directory} to back up {os.path.basename(path)}: "
+            f"{needed} bytes needed, {free} free"
+        )
+
+
+def _remove(path: str) -> None:
+    for name in (path, f"{path}-wal", f"{path}-shm", f"{path}-journal"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def list_backups(directory: str = BACKUP_DIR) -> list[str]:
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, name, MANIFEST_NAME))
+    )
+
+
+def _prune(directory: str, keep: int) -> None:
+    for name in os.listdir(directory):
+        if name.endswith(".partial"):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    if keep > 0:
+        for path in list_backups(directory)[:-keep]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _lock(directory: str):
+    handle = open(os.path.join(directory, ".lock"), "w")
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+    return handle
+
+
+def create_backup(
+    directory: str = BACKUP_DIR,
+    keep: int = BACKUP_KEEP,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    pause: float = BACKUP_STEP_PAUSE,
+) -> str | None:
+    if DB_KIND != "sqlite":
+        raise RuntimeError("Online backup is only available for SQLite; use pg_dump for Postgres")
+    if not directory:
+        raise RuntimeError("BACKUP_DIR is not set")
+    os.makedirs(directory, exist_ok=True)
+    lock = _lock(directory)
+    if lock is None:
+        return None
+    started = time.monotonic()
+    now = datetime.utcnow().replace(microsecond=0)
+    target = os.path.join(directory, now.strftime(STAMP_FORMAT))
+    if os.path.exists(target):
+        lock.close()
+        return target
+    staging = f"{target}.partial"
+    _update(running=True, file=None, progress=0.0, last_error=None)
+    try:
+        os.makedirs(staging)
+        paths = database_files()
+        files = []
+        for index, path in enumerate(paths):
+            name = os.path.basename(path)
+            raw = os.path.join(staging, name)
+            _update(file=name)
+            _check_space(path, staging)
+            _copy_online(
+                path,
+                raw,
+                pages,
+                pause,
+                lambda done: _update(progress=round((index + done) / len(paths), 4)),
+            )
+            sha256, size = _compress(raw, f"{raw}.gz", BACKUP_COMPRESSLEVEL)
+            _remove(raw)
+            files.append(
+                {
+                    "name": name,
+                    "path": os.path.abspath(path),
+                    "size": size,
+                    "compressed_size": os.path.getsize(f"{raw}.gz"),
+                    "sha256": sha256,
+                }
+            )
+        duration = round(time.monotonic() - started, 3)
+        manifest = {
+            "created_at": now.isoformat(),
+            "duration_seconds": duration,
+            "files": files,
+        }
+        with open(os.path.join(staging, MANIFEST_NAME), "w") as handle:
+            json.dump(manifest, handle, indent=2)
+        os.replace(staging, target)
+        _prune(directory, keep)
+    except Exception as exc:
+        shutil.rmtree(staging, ignore_errors=True)
+        with _STATS_LOCK:
+            _STATS["failures"] += 1
+            _STATS.update(running=False, file=None, last_error=str(exc))
+        raise
+    finally:
+        lock.close()
+    with _STATS_LOCK:
+        _STATS["backups"] += 1
+        _STATS.update(
+            running=False,
+            file=None,
+            progress=1.0,
+            last_path=target,
+            last_finished_at=datetime.utcnow().isoformat(timespec="seconds"),
+            last_duration_seconds=duration,
+            last_size_bytes=sum(entry["compressed_size"] for entry in files),
+        )
+    return target
+
+
+def restore_backup(
+    path: str, destination: str | None = None, verify_only: bool = False
+) -> list[str]:
+    with open(os.path.join(path, MANIFEST_NAME)) as handle:
+        manifest = json.load(handle)
+    staged = []
+    try:
+        for entry in manifest["files"]:
+            target = os.path.join(destination, entry["name"]) if destination else entry["path"]
+            staging = f"{target}.restore"
+            staged.append((staging, target))
+            sha256, size = _decompress(os.path.join(path, f"{entry['name']}.gz"), staging)
+            if sha256 != entry["sha256"] or size != entry["size"]:
+                raise RuntimeError(f"Checksum mismatch for {entry['name']}")
+            conn = sqlite3.connect(staging)
+            try:
+                status = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                conn.close()
+            if status != "ok":
+                raise RuntimeError(f"Integrity check failed for {entry['name']}: {status}")
+    except Exception:
+        for staging, _ in staged:
+            _remove(staging)
+        raise
+    if verify_only:
+        for staging, _ in staged:
+            _remove(staging)
+        return [target for _, target in staged]
+    for staging, target in staged:
+        for suffix in ("-wal", "-shm", "-journal"):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(staging, target)
+    return [target for _, target in staged]
+
+
+async def run_backup_job() -> None:
+    if not BACKUP_DIR or DB_KIND != "sqlite":
+        return
+    backups = list_backups(BACKUP_DIR)
+    if backups:
+        stamp = datetime.strptime(os.path.basename(backups[-1]), STAMP_FORMAT)
+        if (datetime.utcnow() - stamp).total_seconds() < BACKUP_INTERVAL_SECONDS / 2:
+            return
+    path = await asyncio.to_thread(create_backup, BACKUP_DIR)
+    if path:
+        stats = backup_stats()
+        logger.info(
+            "Backup written to %s in %ss (%s bytes)",
+            path,
+            stats["last_duration_seconds"],
+            stats["last_size_bytes"],
+        )
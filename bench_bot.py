@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+BENCH_SCRATCH_DIR = None
+if not os.getenv("DATABASE_URL", "").strip() and not os.getenv("DB_PATH"):
+    BENCH_SCRATCH_DIR = tempfile.mkdtemp(prefix="bench_bot-")
+    os.environ["DB_PATH"] = os.path.join(BENCH_SCRATCH_DIR, "bench.db")
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ExtBot
+
+from bot import register_handlers
+from db import create_invite, database_in_use, init_db
+from notify import NOTIFIER
+from profiling import ProfiledApplication
+
+BENCH_BOT_SESSIONS = int(os.getenv("BENCH_BOT_SESSIONS", "100"))
+BENCH_BOT_CONCURRENCY = int(os.getenv("BENCH_BOT_CONCURRENCY", "8"))
+BENCH_BOT_API_LATENCY_MS = float(os.getenv("BENCH_BOT_API_LATENCY_MS", "0"))
+BENCH_BOT_SEED = int(os.getenv("BENCH_BOT_SEED", "42"))
+BENCH_BOT_USER_BASE = 7_000_000_000
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+MESSAGE_ENDPOINTS = {"sendMessage", "editMessageText"}
+
+_KIND: contextvars.ContextVar = contextvars.ContextVar("bench_kind", default="background")
+
+
+class FakeBot(ExtBot):
+    def __init__(self, token: str = "0:bench", latency_ms: float = 0.0, **kwargs) -> None:
+        super().__init__(token, **kwargs)
+        with self._unfrozen():
+            self._bench_latency = latency_ms / 1000
+            self._bench_ids = itertools.count(1)
+            self.calls: Counter = Counter()
+            self.calls_by_kind: dict[str, Counter] = defaultdict(Counter)
+
+    async def _do_post(self, endpoint: str, data: dict, **kwargs):
+        if endpoint == "getMe":
+            return dict(BOT_USER)
+        self.calls[endpoint] += 1
+        self.calls_by_kind[_KIND.get()][endpoint] += 1
+        if self._bench_latency > 0:
+            await asyncio.sleep(self._bench_latency)
+        if endpoint not in MESSAGE_ENDPOINTS:
+            return True
+        return {
+            "message_id": data.get("message_id") or next(self._bench_ids),
+            "date": int(time.time()),
+            "chat": {"id": data["chat_id"], "type": "private"},
+            "from": BOT_USER,
+            "text": data.get("text", ""),
+        }
+
+
+def _user(telegram_id: int) -> dict:
+    return {
+        "id": telegram_id,
+        "is_bot": False,
+        "first_name": f"user{telegram_id}",
+        "username": f"user{telegram_id}",
+    }
+
+
+class Corpus:
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, telegram_id: int, text: str) -> dict:
+        data = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": _user(telegram_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            data["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ]
+        return {"update_id": next(self._update_ids), "message": data}
+
+    def callback(self, telegram_id: int, data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": _user(telegram_id),
+                "chat_instance": str(telegram_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": telegram_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "Расходы за неделя",
+                },
+            },
+        }
+
+    def amount(self) -> str:
+        return f"{round(self.rng.lognormvariate(6, 1), 2)}"
+
+    def join(self, telegram_id: int, owner: int):
+        return lambda: self.message(telegram_id, f"/join {create_invite(owner)}")
+
+    def session(self, owner: int) -> list[tuple[str, object]]:
+        first, second = owner + 1, owner + 2
+        amount = self.amount
+        return [
+            ("start", self.message(owner, "/start")),
+            ("start", self.message(first, "/start")),
+            ("start", self.message(second, "/start")),
+            ("join", self.join(first, owner)),
+            ("join", self.join(second, owner)),
+            ("menu", self.message(owner, "Расходы")),
+            ("quick", self.message(owner, f"-{amount()} кофе Кафе")),
+            (
+                "quick_batch",
+                self.message(
+                    first,
+                    f"-{amount()} продукты на неделю Продукты\n"
+                    f"-{amount()} такси Транспорт\n+{amount()} возврат",
+                ),
+            ),
+            ("add_flow", self.message(owner, "Добавить расход")),
+            ("add_flow", self.message(owner, "abc")),
+            ("add_flow", self.message(owner, amount().replace(".", ","))),
+            ("add_flow", self.message(owner, "обед с коллегами")),
+            ("menu", self.message(first, "Доходы")),
+            ("period", self.message(first, "Доходы: месяц")),
+            ("period_callback", self.callback(first, "period:income:год")),
+            ("add_flow", self.message(second, "Добавить доход")),
+            ("cancel", self.message(second, "/cancel")),
+            ("period", self.message(second, "Расходы: неделя")),
+            ("period_callback", self.callback(second, "period:expense:месяц")),
+            ("menu", self.message(owner, "Пригласить")),
+            ("menu", self.message(owner, "Планы")),
+            ("menu", self.message(owner, "Назад")),
+            ("kick", self.message(owner, f"/kick {second}")),
+            ("kick", self.message(owner, "/kick abc")),
+            ("leave", self.message(first, "/leave")),
+            ("unknown", self.message(second, "привет")),
+        ]
+
+
+def build_corpus(sessions: int, seed: int) -> list[list[tuple[str, object]]]:
+    corpus = Corpus(seed)
+    base = BENCH_BOT_USER_BASE + time.time_ns() // 1000 % 10**9 * 10
+    return [corpus.session(base + index * 10) for index in range(sessions)]
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _latency(samples: list[float]) -> dict:
+    return {
+        "p50_ms": round(_percentile(samples, 0.5), 3),
+        "p90_ms": round(_percentile(samples, 0.9), 3),
+        "p99_ms": round(_percentile(samples, 0.99), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+async def replay(
+    sessions: int, concurrency: int, latency_ms: float, seed: int
+) -> dict:
+    bot = FakeBot(latency_ms=latency_ms)
+    app = (
+        ApplicationBuilder()
+        .application_class(ProfiledApplication)
+        .bot(bot)
+        .updater(None)
+        .build()
+    )
+    register_handlers(app)
+    errors: Counter = Counter()
+
+    async def on_error(update, context) -> None:
+        errors[type(context.error).__name__] += 1
+
+    app.add_error_handler(on_error)
+    pending: asyncio.Queue = asyncio.Queue()
+    for script in build_corpus(sessions, seed):
+        pending.put_nowait(
+            [
+                (kind, data if callable(data) else Update.de_json(data, bot))
+                for kind, data in script
+            ]
+        )
+    samples: dict[str, list[float]] = defaultdict(list)
+
+    async def worker() -> None:
+        while not pending.empty():
+            for kind, update in pending.get_nowait():
+                if callable(update):
+                    update = Update.de_json(update(), bot)
+                token = _KIND.set(kind)
+                started = time.perf_counter()
+                try:
+                    await app.process_update(update)
+                finally:
+                    samples[kind].append((time.perf_counter() - started) * 1000)
+                    _KIND.reset(token)
+
+    async with app:
+        NOTIFIER.start(lambda chat_id, text: bot.send_message(chat_id, text))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        elapsed = time.perf_counter() - started
+        await NOTIFIER.stop()
+    updates = sum(len(values) for values in samples.values())
+    calls = sum(bot.calls.values())
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "api_latency_ms": latency_ms,
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(updates / elapsed, 1) if elapsed else None,
+        "latency": _latency([value for values in samples.values() for value in values]),
+        "api_calls": dict(bot.calls),
+        "api_calls_per_update": round(calls / updates, 3) if updates else None,
+        "errors": dict(errors),
+        "kinds": {
+            kind: {
+                "updates": len(values),
+                **_latency(values),
+                "api_calls_per_update": round(
+                    sum(bot.calls_by_kind[kind].values()) / len(values), 3
+                ),
+            }
+            for kind, values in sorted(samples.items())
+        },
+        "background_api_calls": dict(bot.calls_by_kind["background"]),
+    }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency"]
+    print(
+        f"{report['updates']} updates in {report['seconds']:.2f}s "
+        f"({report['updates_per_second']} updates/s, concurrency {report['concurrency']}, "
+        f"api latency {report['api_latency_ms']} ms)"
+    )
+    print(
+        f"latency ms: p50 {latency['p50_ms']} p90 {latency['p90_ms']} "
+        f"p99 {latency['p99_ms']} max {latency['max_ms']}"
+    )
+    print(
+        f"api calls per update: {report['api_calls_per_update']} "
+        + " ".join(f"{name}={count}" for name, count in sorted(report["api_calls"].items()))
+    )
+    if report["background_api_calls"]:
+        print(
+            "background api calls: "
+            + " ".join(
+                f"{name}={count}" for name, count in sorted(report["background_api_calls"].items())
+            )
+        )
+    if report["errors"]:
+        print("errors: " + " ".join(f"{name}={count}" for name, count in report["errors"].items()))
+    print(f"{'kind':<18}{'updates':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'calls':>8}")
+    for kind, row in report["kinds"].items():
+        print(
+            f"{kind:<18}{row['updates']:>9}{row['p50_ms']:>9.3f}{row['p90_ms']:>9.3f}"
+            f"{row['p99_ms']:>9.3f}{row['max_ms']:>9.3f}{row['api_calls_per_update']:>8.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay synthetic updates through the bot handlers on a scratch database "
+        "(a temporary SQLite file unless DB_PATH or DATABASE_URL is set)"
+    )
+    parser.add_argument("--sessions", type=int, default=BENCH_BOT_SESSIONS)
+    parser.add_argument("--concurrency", type=int, default=BENCH_BOT_CONCURRENCY)
+    parser.add_argument(
+        "--api-latency-ms",
+        type=float,
+        default=BENCH_BOT_API_LATENCY_MS,
+        help="simulated Bot API round trip",
+    )
+    parser.add_argument("--seed", type=int, default=BENCH_BOT_SEED)
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument(
+        "--allow-existing",
+        action="store_true",
+        help="run even if the database already has users",
+    )
+    args = parser.parse_args()
+    if not args.allow_existing and database_in_use():
+        parser.error(
+            "the database already has users; point DB_PATH or DATABASE_URL "
+            "at a scratch database or pass --allow-existing"
+        )
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        init_db()
+        report = asyncio.run(
+            replay(args.sessions, args.concurrency, args.api_latency_ms, args.seed)
+        )
+    finally:
+        if BENCH_SCRATCH_DIR:
+            shutil.rmtree(BENCH_SCRATCH_DIR, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+    print_report(report)
+    if report["errors"]:
+        print("handler errors during replay", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_SCRATCH_DIR = None
+if not os.getenv("DATABASE_URL", "").strip() and not os.getenv("DB_PATH"):
+    BENCH_SCRATCH_DIR = tempfile.mkdtemp(prefix="bench_db-")
+    os.environ["DB_PATH"] = os.path.join(BENCH_SCRATCH_DIR, "bench.db")
+
+from db import (
+    DB_KIND,
+    add_query_listener,
+    add_transactions_batch,
+    category_summary,
+    create_invite,
+    database_in_use,
+    get_budget_state,
+    get_budget_summary,
+    get_or_create_user,
+    init_db,
+    list_transactions,
+    list_updates,
+    remove_query_listener,
+    use_invite,
+)
+
+BENCH_SIZES = os.getenv("BENCH_SIZES", "1000,100000,1000000")
+BENCH_MEMBERS = int(os.getenv("BENCH_MEMBERS", "20"))
+BENCH_ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "30"))
+BENCH_WARMUP = int(os.getenv("BENCH_WARMUP", "3"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "42"))
+BENCH_MAX_RATIO = float(os.getenv("BENCH_MAX_RATIO", "1.5"))
+BENCH_MIN_DELTA_MS = float(os.getenv("BENCH_MIN_DELTA_MS", "0.5"))
+BENCH_DAYS = 365
+BENCH_BATCH_ROWS = 5000
+BENCH_USER_BASE = 9_000_000_000
+PLANNED_STATEMENTS = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+FULL_SCAN = re.compile(r"^(?:SCAN (?!CONSTANT ROW)(\w+)(?!.*\bUSING\b)|.*Seq Scan on (\w+))")
+WORDS = (
+    "хлеб", "молоко", "кофе", "такси", "бензин", "аптека", "обед", "ужин", "кино",
+    "подарок", "книга", "связь", "интернет", "аренда", "свет", "вода", "спорт", "корм",
+)
+CATEGORIES = {
+    "expense": (
+        "Продукты", "Транспорт", "Кафе", "Дом", "Здоровье", "Развлечения",
+        "Связь", "Одежда", "Подарки", "Спорт", "Дети", "Питомцы",
+    ),
+    "income": ("Зарплата", "Подработка", "Проценты", "Подарки"),
+}
+
+
+def owner_id(index: int) -> int:
+    return BENCH_USER_BASE + index * 100_000
+
+
+def _entries(rng: random.Random, count: int) -> list[tuple[str, float, str, str | None]]:
+    entries = []
+    for _ in range(count):
+        t_type = "income" if rng.random() < 0.15 else "expense"
+        category = rng.choice(CATEGORIES[t_type]) if rng.random() < 0.9 else None
+        description = f"{rng.choice(WORDS)} {rng.choice(WORDS)}"
+        entries.append((t_type, round(rng.lognormvariate(6, 1), 2), description, category))
+    return entries
+
+
+def generate(index: int, size: int, members: int, seed: int, now: datetime) -> int:
+    owner = owner_id(index)
+    if get_budget_state(owner)[0] is not None:
+        return owner
+    rng = random.Random(f"{seed}:{size}")
+    get_or_create_user(owner, f"owner{size}")
+    names = [f"owner{size}"]
+    for member in range(1, members + 1):
+        get_or_create_user(owner + member, f"member{member}")
+        use_invite(owner + member, create_invite(owner))
+        names.append(f"member{member}")
+    per_day, extra = divmod(size, BENCH_DAYS)
+    for day in range(BENCH_DAYS):
+        count = per_day + (1 if day < extra else 0)
+        created_at = (now - timedelta(days=BENCH_DAYS - 1 - day)).isoformat(timespec="seconds")
+        while count > 0:
+            batch = min(count, BENCH_BATCH_ROWS)
+            add_transactions_batch(owner, _entries(rng, batch), rng.choice(names), created_at)
+            count -= batch
+    return owner
+
+
+def _cases(owner: int, members: int, now: datetime, fresh) -> list[tuple[str, object, object]]:
+    member = owner + 1 if members else owner
+    week_ago = (now - timedelta(days=7)).isoformat(timespec="seconds")
+    month_start = now.replace(day=1).isoformat(timespec="seconds")
+
+    def new_user() -> tuple:
+        return (next(fresh),)
+
+    def invited_user() -> tuple:
+        telegram_id = next(fresh)
+        get_or_create_user(telegram_id)
+        return telegram_id, create_invite(owner)
+
+    return [
+        ("get_budget_summary", tuple, lambda: get_budget_summary(owner)),
+        (
+            "list_transactions",
+            tuple,
+            lambda: list_transactions(owner, "expense", week_ago, None, 50),
+        ),
+        (
+            "category_summary",
+            tuple,
+            lambda: category_summary(owner, "expense", month_start, None),
+        ),
+        ("list_updates", tuple, lambda: list_updates(member, None, 20)),
+        ("get_or_create_user", tuple, lambda: get_or_create_user(member, "member1")),
+        ("get_or_create_user:new", new_user, get_or_create_user),
+        ("use_invite", invited_user, use_invite),
+    ]
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(setup, call, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        call(*setup())
+    samples = []
+    for _ in range(max(1, iterations)):
+        args = setup()
+        started = time.perf_counter()
+        call(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "iterations": len(samples),
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(_percentile(samples, 0.5), 4),
+        "p95_ms": round(_percentile(samples, 0.95), 4),
+        "max_ms": round(max(samples), 4),
+        "mean_ms": round(sum(samples) / len(samples), 4),
+    }
+
+
+def capture_plans(setup, call) -> list[dict]:
+    plans = []
+    prefix = "EXPLAIN QUERY PLAN " if DB_KIND == "sqlite" else "EXPLAIN "
+
+    def listener(conn, query: str, params) -> None:
+        if not query.lstrip().upper().startswith(PLANNED_STATEMENTS):
+            return
+        try:
+            if DB_KIND == "postgres":
+                with conn.transaction():
+                    rows = conn.execute(prefix + query, params).fetchall()
+            else:
+                rows = conn.execute(prefix + query, params).fetchall()
+        except Exception as exc:
+            lines = [f"error: {exc}"]
+        else:
+            lines = [str(row[-1]) for row in rows]
+        plans.append({"query": " ".join(query.split()), "plan": lines})
+
+    args = setup()
+    add_query_listener(listener)
+    try:
+        call(*args)
+    finally:
+        remove_query_listener(listener)
+    return plans
+
+
+def full_scans(plans: list[dict]) -> list[str]:
+    tables = set()
+    for entry in plans:
+        for line in entry["plan"]:
+            match = FULL_SCAN.match(line.strip())
+            if match:
+                tables.add(match.group(1) or match.group(2))
+    return sorted(tables)
+
+
+def run_benchmarks(
+    sizes: list[int], members: int, iterations: int, warmup: int, seed: int
+) -> dict:
+    init_db()
+    now = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    fresh = itertools.count(BENCH_USER_BASE * 2 + time.time_ns() // 1000 % 10**12)
+    results = []
+    for index, size in enumerate(sizes):
+        started = time.perf_counter()
+        owner = generate(index, size, members, seed, now)
+        print(f"size {size}: data ready in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        for name, setup, call in _cases(owner, members, now, fresh):
+            plans = capture_plans(setup, call)
+            stats = measure(setup, call, iterations, warmup)
+            results.append(
+                {
+                    "name": name,
+                    "size": size,
+                    **stats,
+                    "full_scans": full_scans(plans),
+                    "plans": plans,
+                }
+            )
+    return {
+        "backend": DB_KIND,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "seed": seed,
+        "members": members,
+        "sizes": sizes,
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, max_ratio: float, min_delta_ms: float) -> list[str]:
+    previous = {(row["name"], row["size"]): row for row in baseline.get("results", [])}
+    problems = []
+    for row in report["results"]:
+        base = previous.get((row["name"], row["size"]))
+        if base is None:
+            continue
+        label = f"{row['name']} @ {row['size']}"
+        if (
+            row["median_ms"] > base["median_ms"] * max_ratio
+            and row["median_ms"] - base["median_ms"] > min_delta_ms
+        ):
+            problems.append(
+                f"{label}: median {row['median_ms']:.3f} ms vs {base['median_ms']:.3f} ms"
+            )
+        new_scans = sorted(set(row["full_scans"]) - set(base.get("full_scans", [])))
+        if new_scans:
+            problems.append(f"{label}: new full scan of {', '.join(new_scans)}")
+    return problems
+
+
+def print_curves(report: dict) -> None:
+    sizes = report["sizes"]
+    medians: dict[str, dict[int, float]] = {}
+    for row in report["results"]:
+        medians.setdefault(row["name"], {})[row["size"]] = row["median_ms"]
+    print(f"{'median ms':<24}" + "".join(f"{size:>12}" for size in sizes) + f"{'growth':>10}")
+    for name, values in medians.items():
+        first, last = values.get(sizes[0]), values.get(sizes[-1])
+        growth = f"{last / first:.1f}x" if first and last else "-"
+        print(
+            f"{name:<24}"
+            + "".join(f"{values.get(size, 0):>12.3f}" for size in sizes)
+            + f"{growth:>10}"
+        )
+    for row in report["results"]:
+        if row["full_scans"]:
+            print(f"full scan in {row['name']} @ {row['size']}: {', '.join(row['full_scans'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark db.py functions on a scratch database "
+        "(a temporary SQLite file unless DB_PATH or DATABASE_URL is set)"
+    )
+    parser.add_argument("--sizes", default=BENCH_SIZES, help="transactions per budget")
+    parser.add_argument("--members", type=int, default=BENCH_MEMBERS)
+    parser.add_argument("--iterations", type=int, default=BENCH_ITERATIONS)
+    parser.add_argument("--warmup", type=int, default=BENCH_WARMUP)
+    parser.add_argument("--seed", type=int, default=BENCH_SEED)
+    parser.add_argument("--output", default="bench_db.json", help="JSON results file")
+    parser.add_argument("--baseline", help="previous results to check for regressions")
+    parser.add_argument("--max-ratio", type=float, default=BENCH_MAX_RATIO)
+    parser.add_argument("--min-delta-ms", type=float, default=BENCH_MIN_DELTA_MS)
+    parser.add_argument(
+        "--allow-existing",
+        action="store_true",
+        help="run even if the database already has users",
+    )
+    args = parser.parse_args()
+    if not args.allow_existing and database_in_use():
+        parser.error(
+            "the database already has users; point DB_PATH or DATABASE_URL "
+            "at a scratch database or pass --allow-existing"
+        )
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    try:
+        report = run_benchmarks(sizes, args.members, args.iterations, args.warmup, args.seed)
+    finally:
+        if BENCH_SCRATCH_DIR:
+            shutil.rmtree(BENCH_SCRATCH_DIR, ignore_errors=True)
+    with open(args.output, "w") as handle:
+        json.dump(report, handle, ensure_ascii=False, indent=2)
+    print_curves(report)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            problems = compare(report, json.load(handle), args.max_ratio, args.min_delta_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
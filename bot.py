@@ -1,10 +1,17 @@
+import asyncio
 import logging
 import os
 from datetime import datetime
 
-from telegram import ReplyKeyboardMarkup, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    Update,
+)
 from telegram.ext import (
     ApplicationBuilder,
+    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
@@ -13,17 +20,26 @@ from telegram.ext import (
 )
 
 from db import (
-    add_transaction,
+    add_transactions_batch,
     create_invite,
     get_budget_summary,
     get_period_summary,
     get_or_create_user,
     init_db,
     leave_budget,
+    list_category_limits,
     remove_user_from_budget,
-    ensure_category,
+    set_category_limit,
+    set_digest_muted,
+    set_notify_muted,
+    submit_transaction,
     use_invite,
 )
+from digest import DIGEST_CHECK_SECONDS, digest_job
+from notify import NOTIFIER
+from outbound import OUTBOX
+from profiling import ProfiledApplication, arm, is_profile_admin
+from scheduler import SCHEDULER
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -48,15 +64,26 @@ EXPENSE_MENU = ReplyKeyboardMarkup(
 )
 
 
+PERIODS = ("неделя", "месяц", "год")
+
+
 def format_money(value: float) -> str:
     return f"{value:.2f}"
 
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def reply(update: Update, text: str, reply_markup=None) -> None:
+    if OUTBOX.running:
+        OUTBOX.send(update.effective_chat.id, text, reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def show_main_menu(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, prefix: str | None = None
+) -> None:
     balance = get_budget_summary(update.effective_user.id)
-    await update.message.reply_text(
-        f"Ваш общий бюджет: {format_money(balance)}", reply_markup=MAIN_MENU
-    )
+    text = f"Ваш общий бюджет: {format_money(balance)}"
+    await reply(update, f"{prefix}\n{text}" if prefix else text, MAIN_MENU)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -71,46 +98,113 @@ async def join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     display_name = f"@{user.username}" if user.username else user.full_name
     get_or_create_user(user.id, display_name)
     if not context.args:
-        await update.message.reply_text("Использование: /join КОД")
+        await reply(update, "Использование: /join КОД")
         return
     code = context.args[0].strip().upper()
     result = use_invite(update.effective_user.id, code)
     if result:
-        await update.message.reply_text(
-            "Бюджет объединен. Теперь вы видите общие доходы и расходы."
+        await show_main_menu(
+            update, context, "Бюджет объединен. Теперь вы видите общие доходы и расходы."
         )
-        await show_main_menu(update, context)
     else:
-        await update.message.reply_text("Код недействителен или уже использован.")
+        await reply(update, "Код недействителен или уже использован.")
 
 
 async def leave(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     get_or_create_user(update.effective_user.id)
     leave_budget(update.effective_user.id)
-    await update.message.reply_text(
-        "Вы вышли из общего бюджета и получили личный бюджет."
+    await show_main_menu(
+        update, context, "Вы вышли из общего бюджета и получили личный бюджет."
     )
-    await show_main_menu(update, context)
 
 
 async def kick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     get_or_create_user(update.effective_user.id)
     if not context.args:
-        await update.message.reply_text("Использование: /kick TELEGRAM_ID")
+        await reply(update, "Использование: /kick TELEGRAM_ID")
         return
     raw = context.args[0].strip()
     try:
         target_id = int(raw)
     except ValueError:
-        await update.message.reply_text("TELEGRAM_ID должен быть числом.")
+        await reply(update, "TELEGRAM_ID должен быть числом.")
         return
     success = remove_user_from_budget(update.effective_user.id, target_id)
     if success:
-        await update.message.reply_text("Пользователь удален из общего бюджета.")
+        await reply(update, "Пользователь удален из общего бюджета.")
     else:
-        await update.message.reply_text(
-            "Не удалось удалить. Проверьте, что вы владелец бюджета и пользователь в нем."
+        await reply(
+            update,
+            "Не удалось удалить. Проверьте, что вы владелец бюджета и пользователь в нем.",
+        )
+
+
+async def mute(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    set_notify_muted(update.effective_user.id, True)
+    await reply(update, "Уведомления о новых записях отключены. Включить: /unmute")
+
+
+async def unmute(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    set_notify_muted(update.effective_user.id, False)
+    await reply(update, "Уведомления о новых записях включены.")
+
+
+async def nodigest(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    set_digest_muted(update.effective_user.id, True)
+    await reply(update, "Регулярные отчеты отключены. Включить: /digest")
+
+
+async def digest(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    set_digest_muted(update.effective_user.id, False)
+    await reply(update, "Регулярные отчеты включены.")
+
+
+async def limit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    if len(context.args) < 2:
+        await reply(update, "Использование: /limit КАТЕГОРИЯ СУММА (0 — снять лимит)")
+        return
+    category = " ".join(context.args[:-1]).strip()
+    try:
+        amount = float(context.args[-1].replace(",", "."))
+    except ValueError:
+        await reply(update, "СУММА должна быть числом.")
+        return
+    month, amount, spent = set_category_limit(update.effective_user.id, category, amount)
+    if amount <= 0:
+        await reply(update, f"Лимит «{category}» снят.")
+        return
+    await reply(
+        update,
+        f"Лимит «{category}» на {month}: {format_money(amount)}\n"
+        f"Уже потрачено: {format_money(spent)}",
+    )
+
+
+async def limits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_or_create_user(update.effective_user.id)
+    rows = list_category_limits(update.effective_user.id)
+    if not rows:
+        await reply(update, "Лимитов нет. Установить: /limit КАТЕГОРИЯ СУММА")
+        return
+    lines = ["Лимиты на месяц:"]
+    for category, amount, spent in rows:
+        lines.append(
+            f"{category}: {format_money(spent)} из {format_money(amount)} "
+            f"({round(spent / amount * 100)}%)"
         )
+    await reply(update, "\n".join(lines))
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_profile_admin(update.effective_user.id):
+        return
+    arm(update.effective_user.id)
+    await reply(update, "Следующее действие будет профилировано.")
 
 
 async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -121,25 +215,22 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if await try_parse_quick_entry(update, context, text, display_name):
         return
     if text == "Доходы":
-        await update.message.reply_text("Выберите действие:", reply_markup=INCOME_MENU)
+        await reply(update, "Выберите действие:", INCOME_MENU)
         return
     if text == "Расходы":
-        await update.message.reply_text(
-            "Выберите действие:", reply_markup=EXPENSE_MENU
-        )
+        await reply(update, "Выберите действие:", EXPENSE_MENU)
         return
     if text == "Планы":
-        await update.message.reply_text(
-            "Раздел \"Планы\" в разработке.", reply_markup=MAIN_MENU
-        )
+        await reply(update, "Раздел \"Планы\" в разработке.", MAIN_MENU)
         return
     if text == "Пригласить":
         code = create_invite(update.effective_user.id)
-        await update.message.reply_text(
+        await reply(
+            update,
             "Передайте этот код другому пользователю:\n"
             f"{code}\n"
             "Он должен отправить команду /join КОД",
-            reply_markup=MAIN_MENU,
+            MAIN_MENU,
         )
         return
     if text == "Назад":
@@ -153,26 +244,21 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         period = text.replace("Расходы: ", "")
         await show_period_summary(update, context, "expense", period)
         return
-    await update.message.reply_text("Не понял команду.", reply_markup=MAIN_MENU)
+    await reply(update, "Не понял команду.", MAIN_MENU)
 
 
-async def try_parse_quick_entry(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    text: str,
-    display_name: str,
-) -> bool:
-    if not text or text[0] not in {"+", "-"}:
-        return False
-    parts = text.split()
+def parse_quick_entry(line: str) -> tuple[str, float, str, str | None] | None:
+    if not line or line[0] not in {"+", "-"}:
+        return None
+    parts = line.split()
     if not parts:
-        return False
+        return None
     raw_amount = parts[0][1:].replace(",", ".")
     try:
         amount = float(raw_amount)
     except ValueError:
-        return False
-    t_type = "income" if text[0] == "+" else "expense"
+        return None
+    t_type = "income" if line[0] == "+" else "expense"
     description = ""
     category = ""
     if len(parts) == 2:
@@ -180,21 +266,45 @@ async def try_parse_quick_entry(
     elif len(parts) >= 3:
         description = " ".join(parts[1:-1])
         category = parts[-1]
-    if category:
-        ensure_category(update.effective_user.id, t_type, category)
-    add_transaction(
-        update.effective_user.id,
-        t_type,
-        amount,
-        description,
-        display_name,
-        category or None,
-    )
-    label = "Доход" if t_type == "income" else "Расход"
-    await update.message.reply_text(
-        f"{label} добавлен: {amount:.2f}", reply_markup=MAIN_MENU
+    return t_type, amount, description, category or None
+
+
+async def try_parse_quick_entry(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    display_name: str,
+) -> bool:
+    if not text or text[0] not in {"+", "-"}:
+        return False
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    entries = [parse_quick_entry(line) for line in lines]
+    if len(entries) == 1 and entries[0] is None:
+        return False
+    bad = [str(i) for i, entry in enumerate(entries, start=1) if entry is None]
+    if bad:
+        await reply(
+            update,
+            f"Не удалось разобрать строки: {', '.join(bad)}. Ничего не добавлено.",
+            MAIN_MENU,
+        )
+        return True
+    balance = add_transactions_batch(update.effective_user.id, entries, display_name)
+    if len(entries) == 1:
+        t_type, amount, _, _ = entries[0]
+        label = "Доход" if t_type == "income" else "Расход"
+        summary = f"{label} добавлен: {amount:.2f}"
+    else:
+        income = sum(amount for t_type, amount, _, _ in entries if t_type == "income")
+        expense = sum(amount for t_type, amount, _, _ in entries if t_type == "expense")
+        summary = (
+            f"Добавлено записей: {len(entries)}\n"
+            f"Доходы: +{format_money(income)}\n"
+            f"Расходы: -{format_money(expense)}"
+        )
+    await reply(
+        update, f"{summary}\nВаш общий бюджет: {format_money(balance)}", MAIN_MENU
     )
-    await show_main_menu(update, context)
     return True
 
 
@@ -202,22 +312,53 @@ def period_to_days(period: str) -> int | None:
     return {"неделя": 7, "месяц": 30, "год": 365}.get(period)
 
 
+def period_keyboard(t_type: str, current: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    f"• {period}" if period == current else period,
+                    callback_data=f"period:{t_type}:{period}",
+                )
+                for period in PERIODS
+            ]
+        ]
+    )
+
+
+def period_summary_text(telegram_id: int, t_type: str, period: str) -> str:
+    total, count = get_period_summary(telegram_id, t_type, period_to_days(period))
+    label = "Доходы" if t_type == "income" else "Расходы"
+    return f"{label} за {period}: {format_money(total)}\nЗаписей: {count}"
+
+
 async def show_period_summary(
     update: Update, context: ContextTypes.DEFAULT_TYPE, t_type: str, period: str
 ) -> None:
-    days = period_to_days(period)
-    if not days:
-        await update.message.reply_text("Неизвестный период.", reply_markup=MAIN_MENU)
+    if not period_to_days(period):
+        await reply(update, "Неизвестный период.", MAIN_MENU)
         return
-    total, count = get_period_summary(update.effective_user.id, t_type, days)
-    label = "Доходы" if t_type == "income" else "Расходы"
-    await update.message.reply_text(
-        f"{label} за {period}: {format_money(total)}\n"
-        f"Записей: {count}",
-        reply_markup=MAIN_MENU,
+    await reply(
+        update,
+        period_summary_text(update.effective_user.id, t_type, period),
+        period_keyboard(t_type, period),
     )
 
 
+async def period_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    _, t_type, period = query.data.split(":", 2)
+    if t_type not in {"income", "expense"} or not period_to_days(period):
+        return
+    text = period_summary_text(update.effective_user.id, t_type, period)
+    markup = period_keyboard(t_type, period)
+    if OUTBOX.running:
+        OUTBOX.edit(query.message.chat_id, query.message.message_id, text, markup)
+    else:
+        await query.edit_message_text(text, reply_markup=markup)
+
+
 async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     display_name = f"@{user.username}" if user.username else user.full_name
@@ -228,9 +369,9 @@ async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     elif text == "Добавить расход":
         context.user_data["pending_type"] = "expense"
     else:
-        await update.message.reply_text("Не понял команду.", reply_markup=MAIN_MENU)
+        await reply(update, "Не понял команду.", MAIN_MENU)
         return ConversationHandler.END
-    await update.message.reply_text("Введите сумму:")
+    await reply(update, "Введите сумму:")
     return AMOUNT
 
 
@@ -241,10 +382,10 @@ async def add_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if amount <= 0:
             raise ValueError
     except ValueError:
-        await update.message.reply_text("Введите положительное число.")
+        await reply(update, "Введите положительное число.")
         return AMOUNT
     context.user_data["pending_amount"] = amount
-    await update.message.reply_text("Введите описание:")
+    await reply(update, "Введите описание:")
     return DESCRIPTION
 
 
@@ -253,31 +394,37 @@ async def add_description(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     t_type = context.user_data.get("pending_type")
     amount = context.user_data.get("pending_amount")
     if not t_type or amount is None:
-        await update.message.reply_text("Что-то пошло не так.", reply_markup=MAIN_MENU)
+        await reply(update, "Что-то пошло не так.", MAIN_MENU)
         return ConversationHandler.END
     user = update.effective_user
     display_name = f"@{user.username}" if user.username else user.full_name
-    add_transaction(user.id, t_type, amount, description, display_name, None)
-    when = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
-    await update.message.reply_text(
-        f"Запись добавлена ({when}).", reply_markup=MAIN_MENU
+    await asyncio.wrap_future(
+        submit_transaction(user.id, t_type, amount, description, display_name, None)
     )
-    await show_main_menu(update, context)
+    when = datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
+    await show_main_menu(update, context, f"Запись добавлена ({when}).")
     return ConversationHandler.END
 
 
+async def _post_init(app) -> None:
+    OUTBOX.start(app.bot)
+    NOTIFIER.start(OUTBOX.send)
+    SCHEDULER.every("digest", DIGEST_CHECK_SECONDS, digest_job(OUTBOX.send))
+    SCHEDULER.start("bot")
+
+
+async def _post_shutdown(app) -> None:
+    await SCHEDULER.stop()
+    await NOTIFIER.stop()
+    await OUTBOX.stop()
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Операция отменена.", reply_markup=MAIN_MENU)
+    await reply(update, "Операция отменена.", MAIN_MENU)
     return ConversationHandler.END
 
 
-def main() -> None:
-    api_key = os.getenv("TELEGRAM_API_KEY")
-    if not api_key:
-        raise RuntimeError("Не задан TELEGRAM_API_KEY")
-    init_db()
-    app = ApplicationBuilder().token(api_key).build()
-
+def register_handlers(app) -> None:
     add_conv = ConversationHandler(
         entry_points=[
             MessageHandler(
@@ -297,9 +444,33 @@ def main() -> None:
     app.add_handler(CommandHandler("join", join))
     app.add_handler(CommandHandler("leave", leave))
     app.add_handler(CommandHandler("kick", kick))
+    app.add_handler(CommandHandler("mute", mute))
+    app.add_handler(CommandHandler("unmute", unmute))
+    app.add_handler(CommandHandler("nodigest", nodigest))
+    app.add_handler(CommandHandler("digest", digest))
+    app.add_handler(CommandHandler("limit", limit))
+    app.add_handler(CommandHandler("limits", limits))
+    app.add_handler(CommandHandler("profile", profile))
     app.add_handler(add_conv)
+    app.add_handler(CallbackQueryHandler(period_callback, pattern="^period:"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, menu_router))
 
+
+def main() -> None:
+    api_key = os.getenv("TELEGRAM_API_KEY")
+    if not api_key:
+        raise RuntimeError("Не задан TELEGRAM_API_KEY")
+    init_db()
+    app = (
+        ApplicationBuilder()
+        .application_class(ProfiledApplication)
+        .token(api_key)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+
+    register_handlers(app)
     app.run_polling()
 
 
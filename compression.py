@@ -0,0 +1,137 @@
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+_STATS_LOCK = threading.Lock()
+_STATS = {"responses": 0, "compressed": 0, "raw_bytes": 0, "sent_bytes": 0}
+
+
+def compression_stats() -> dict:
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    stats["bytes_saved"] = stats["raw_bytes"] - stats["sent_bytes"]
+    return stats
+
+
+def _record(raw_size: int, sent_size: int, compressed: bool) -> None:
+    with _STATS_LOCK:
+        _STATS["responses"] += 1
+        _STATS["raw_bytes"] += raw_size
+        _STATS["sent_bytes"] += sent_size
+        if compressed:
+            _STATS["compressed"] += 1
+
+
+def _quality(params: list[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def _choose_encoding(accept_encoding: str) -> str | None:
+    offered = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if coding and _quality(params) > 0:
+            offered.add(coding)
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 500,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = _choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                names = {name.lower() for name, _ in message.get("headers", [])}
+                if b"content-disposition" in names:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or message.get("more_body", False):
+                pending, start_message = start_message, None
+                await send(pending)
+                await send(message)
+                return
+            await self._flush(send, start_message, message.get("body", b""), encoding)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _flush(self, send, start_message, body: bytes, encoding: str) -> None:
+        headers = [
+            (name, value)
+            for name, value in start_message.get("headers", [])
+            if name.lower() != b"content-length"
+        ]
+        names = {name.lower(): value for name, value in headers}
+        content_type = names.get(b"content-type", b"").decode("latin-1")
+        compressible = (
+            len(body) >= self.minimum_size
+            and b"content-encoding" not in names
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+        )
+        payload = body
+        if compressible:
+            compressed = _compress(body, encoding, self.gzip_level, self.brotli_quality)
+            if len(compressed) < len(body):
+                payload = compressed
+                headers.append((b"content-encoding", encoding.encode()))
+                headers.append((b"x-uncompressed-length", str(len(body)).encode()))
+        vary = names.get(b"vary")
+        if vary is None:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif b"accept-encoding" not in vary.lower():
+            headers = [(n, v) for n, v in headers if n.lower() != b"vary"]
+            headers.append((b"vary", vary + b", Accept-Encoding"))
+        headers.append((b"content-length", str(len(payload)).encode()))
+        _record(len(body), len(payload), payload is not body)
+        await send({**start_message, "headers": headers})
+        await send({"type": "http.response.body", "body": payload, "more_body": False})
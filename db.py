@@ -1,8 +1,17 @@
+import itertools
 import os
+import queue
+import re
 import secrets
 import sqlite3
 import string
-from datetime import datetime, timedelta
+import threading
+import time
+from calendar import monthrange
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
 
 try:
     import psycopg
@@ -16,7 +25,39 @@ except ImportError:  # pragma: no cover - handled by runtime requirements
 DB_URL = os.getenv("DATABASE_URL", "").strip()
 DB_PATH = os.getenv("DB_PATH", "bot.db")
 DB_KIND = "postgres" if DB_URL else "sqlite"
+WRITE_BATCH_ENABLED = os.getenv("WRITE_BATCH_ENABLED", "").strip().lower() in {"1", "true", "yes"}
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", "200"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "5"))
+DB_READ_URLS = [
+    url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()
+]
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_READ_PIN_SECONDS = float(os.getenv("DB_READ_PIN_SECONDS", "5"))
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+SHARDED = DB_KIND == "sqlite" and DB_SHARDS > 1
+SHARDED_TABLES = (
+    "budgets",
+    "transactions",
+    "categories",
+    "plans",
+    "recurring_rules",
+    "category_limits",
+    "transaction_archives",
+    "archive_balances",
+)
+INVITE_TTL_HOURS = float(os.getenv("INVITE_TTL_HOURS", "72"))
+TRANSACTION_PARTITIONS = os.getenv("TRANSACTION_PARTITIONS", "").strip().lower() in {"1", "true", "yes"}
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+LIMIT_THRESHOLDS = tuple(
+    sorted(
+        float(value) for value in os.getenv("LIMIT_THRESHOLDS", "0.8,1").split(",") if value.strip()
+    )
+)
+TRANSACTION_COLUMNS = (
+    "id, budget_id, t_type, amount, description, added_by, category, created_at, rev"
+)
 _POOL = None
+_READ_POOLS: list = []
 
 if DB_KIND == "postgres":
     if ConnectionPool is None:
@@ -28,25 +69,335 @@ if DB_KIND == "postgres":
         timeout=10,
         open=True,
     )
+    _READ_POOLS = [
+        ConnectionPool(
+            conninfo=url,
+            min_size=1,
+            max_size=max(1, DB_READ_POOL_SIZE),
+            timeout=10,
+            open=True,
+        )
+        for url in DB_READ_URLS
+    ]
+
+
+class _SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            call.set_result(fn())
+        except BaseException as exc:
+            call.set_exception(exc)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return call.result()
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+_WRITE_COUNTER = itertools.count(1)
+_BUDGET_WRITE_SEQ: dict[int, int] = {}
+_WRITE_LISTENERS: list = []
+_TRANSACTION_LISTENERS: list = []
+_QUERY_LISTENERS: list = []
+_LIMIT_LISTENERS: list = []
+
+
+def add_write_listener(callback) -> None:
+    _WRITE_LISTENERS.append(callback)
+
+
+def add_transaction_listener(callback) -> None:
+    _TRANSACTION_LISTENERS.append(callback)
+
+
+def add_query_listener(callback) -> None:
+    _QUERY_LISTENERS.append(callback)
+
+
+def remove_query_listener(callback) -> None:
+    _QUERY_LISTENERS.remove(callback)
+
+
+def add_limit_listener(callback) -> None:
+    _LIMIT_LISTENERS.append(callback)
+
+
+def _transactions_added(budget_id: int, telegram_id: int, entries: list[tuple]) -> None:
+    for callback in _TRANSACTION_LISTENERS:
+        callback(budget_id, telegram_id, entries)
+
+
+def _limits_crossed(budget_id: int, alerts: list[dict]) -> None:
+    if not alerts:
+        return
+    for callback in _LIMIT_LISTENERS:
+        callback(budget_id, alerts)
+
+
+def _budget_written(budget_id: int) -> None:
+    _BUDGET_WRITE_SEQ[budget_id] = next(_WRITE_COUNTER)
+    for callback in _WRITE_LISTENERS:
+        callback(budget_id)
+
+
+def _flight_key(name: str, budget_id: int, *args) -> tuple:
+    return (name, budget_id, _BUDGET_WRITE_SEQ.get(budget_id, 0), *args)
+
+
+def _read_only_uri(path: str) -> str:
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+
+class _SQLitePool:
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        directory: str | None = None,
+        read_only: bool = True,
+    ) -> None:
+        self.uri = _read_only_uri(path) if read_only else path
+        self.directory = directory
+        self.read_only = read_only
+        self.size = size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.uri, uri=self.read_only, check_same_thread=False)
+            if self.directory:
+                conn.execute(
+                    "ATTACH DATABASE ? AS directory",
+                    (_read_only_uri(self.directory) if self.read_only else self.directory,),
+                )
+        try:
+            with conn:
+                yield conn
+        except sqlite3.DatabaseError:
+            conn.close()
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._idle.qsize() < self.size:
+                    self._idle.put(conn)
+                else:
+                    conn.close()
+
 
+if DB_KIND == "sqlite" and DB_READ_POOL_SIZE > 0:
+    _READ_POOLS = [_SQLitePool(DB_PATH, DB_READ_POOL_SIZE)]
 
-def _connect():
+_READ_CYCLE = itertools.cycle(_READ_POOLS)
+_PINNED_UNTIL: dict[int, float] = {}
+_DIRECTORY = _SQLitePool(DB_PATH, max(1, DB_READ_POOL_SIZE)) if SHARDED else None
+_SHARD_READ_POOLS: dict[int, _SQLitePool] = {}
+_SHARD_WRITE_POOLS: dict[tuple[int, bool], _SQLitePool] = {}
+
+
+def shard_file(path: str, shard: int) -> str:
+    if shard == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext or '.db'}"
+
+
+def _shard_path(shard: int) -> str:
+    return shard_file(DB_PATH, shard)
+
+
+def _shards() -> list[int]:
+    return list(range(DB_SHARDS)) if SHARDED else [0]
+
+
+def _shard_for(telegram_id: int | None = None, budget_id: int | None = None) -> int:
+    with _DIRECTORY.connection() as conn:
+        if budget_id is None:
+            row = conn.execute(
+                """
+                SELECT u.budget_id, COALESCE(s.shard, 0)
+                FROM users u
+                LEFT JOIN budget_shards s ON s.budget_id = u.budget_id
+                WHERE u.telegram_id = ?
+                """,
+                (telegram_id,),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                """
+                SELECT b.id, COALESCE(s.shard, 0)
+                FROM budgets b
+                LEFT JOIN budget_shards s ON s.budget_id = b.id
+                WHERE b.id = ?
+                """,
+                (budget_id,),
+            ).fetchone()
+    return int(row[1]) if row else 0
+
+
+def _connect_shard(shard: int, directory: bool = True):
+    if not SHARDED:
+        return _connect()
+    key = (shard, bool(shard and directory))
+    pool = _SHARD_WRITE_POOLS.get(key)
+    if pool is None:
+        pool = _SHARD_WRITE_POOLS.setdefault(
+            key,
+            _SQLitePool(
+                _shard_path(shard),
+                max(1, DB_READ_POOL_SIZE),
+                DB_PATH if key[1] else None,
+                read_only=False,
+            ),
+        )
+    return pool.connection()
+
+
+def _connect(telegram_id: int | None = None, budget_id: int | None = None):
     if DB_KIND == "postgres":
         if psycopg is None:
             raise RuntimeError("psycopg is required for PostgreSQL")
         return _POOL.connection()
+    if SHARDED and (telegram_id is not None or budget_id is not None):
+        return _connect_shard(_shard_for(telegram_id, budget_id))
     return sqlite3.connect(DB_PATH)
 
 
+def _connect_read_shard(shard: int):
+    if not SHARDED:
+        return _connect_read()
+    if DB_READ_POOL_SIZE <= 0:
+        return _connect_shard(shard)
+    pool = _SHARD_READ_POOLS.get(shard)
+    if pool is None:
+        pool = _SHARD_READ_POOLS.setdefault(
+            shard,
+            _SQLitePool(
+                _shard_path(shard), DB_READ_POOL_SIZE, DB_PATH if shard else None
+            ),
+        )
+    return pool.connection()
+
+
+def _connect_read(telegram_id: int | None = None, budget_id: int | None = None):
+    if telegram_id is not None and _PINNED_UNTIL.get(telegram_id, 0) > time.monotonic():
+        return _connect(telegram_id, budget_id)
+    if SHARDED and (telegram_id is not None or budget_id is not None):
+        return _connect_read_shard(_shard_for(telegram_id, budget_id))
+    if not _READ_POOLS:
+        return _connect()
+    return next(_READ_CYCLE).connection()
+
+
+def _pin(*telegram_ids: int) -> None:
+    if not _READ_POOLS or DB_READ_PIN_SECONDS <= 0:
+        return
+    now = time.monotonic()
+    until = now + DB_READ_PIN_SECONDS
+    for telegram_id in telegram_ids:
+        _PINNED_UNTIL[telegram_id] = until
+    if len(_PINNED_UNTIL) > 10_000:
+        for key, value in list(_PINNED_UNTIL.items()):
+            if value <= now:
+                _PINNED_UNTIL.pop(key, None)
+
+
 def _execute(conn, query: str, params: tuple | list = ()):
+    if DB_KIND == "postgres":
+        query = query.replace("?", "%s")
+    for callback in _QUERY_LISTENERS:
+        callback(conn, query, params)
     if DB_KIND == "postgres":
         cur = conn.cursor()
-        cur.execute(query.replace("?", "%s"), params)
+        cur.execute(query, params)
         return cur
     return conn.execute(query, params)
 
 
+def _executemany(conn, query: str, rows: list):
+    if DB_KIND == "postgres":
+        cur = conn.cursor()
+        cur.executemany(query.replace("?", "%s"), rows)
+        return cur
+    return conn.executemany(query, rows)
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" for _ in range(count))
+
+
+def _archive_path(path: str, year: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{year}{ext or '.db'}"
+
+
+def _archived_max_id(conn, budget_id: int) -> int | None:
+    if DB_KIND != "sqlite":
+        return None
+    row = _execute(
+        conn, "SELECT max_id FROM archive_balances WHERE budget_id = ?", (budget_id,)
+    ).fetchone()
+    return int(row[0]) if row else None
+
+
+@contextmanager
+def _transactions_source(conn, start: str | None = None):
+    archives = []
+    if DB_KIND == "sqlite":
+        archives = [
+            (year, path, until)
+            for year, path, until in _execute(
+                conn,
+                """
+                SELECT year, path, archived_until
+                FROM transaction_archives
+                WHERE archived_until IS NOT NULL
+                ORDER BY year ASC
+                """,
+            ).fetchall()
+            if start is None or start < min(until, f"{year + 1:04d}-01-01T00:00:00")
+        ]
+    if not archives:
+        yield "transactions"
+        return
+    attached = []
+    try:
+        parts = [f"SELECT {TRANSACTION_COLUMNS} FROM main.transactions"]
+        for year, path, until in archives:
+            name = f"archive_{int(year)}"
+            _execute(conn, f"ATTACH DATABASE ? AS {name}", (path,))
+            attached.append(name)
+            bound = datetime.fromisoformat(until).isoformat(timespec="seconds")
+            parts.append(
+                f"SELECT {TRANSACTION_COLUMNS} FROM {name}.transactions "
+                f"WHERE created_at < '{bound}'"
+            )
+        yield "(" + " UNION ALL ".join(parts) + ") AS transactions"
+    finally:
+        for name in attached:
+            _execute(conn, f"DETACH DATABASE {name}")
+
+
 def init_db() -> None:
+    if DB_KIND == "sqlite":
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
     with _connect() as conn:
         if DB_KIND == "postgres":
             _execute(
@@ -127,6 +478,62 @@ def init_db() -> None:
                 )
                 """,
             )
+            _execute(
+                conn,
+                """
+                ALTER TABLE transactions
+                ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (
+                    to_tsvector(
+                        'simple',
+                        translate(
+                            COALESCE(description, '') || ' ' ||
+                            COALESCE(category, '') || ' ' ||
+                            COALESCE(added_by, ''),
+                            'ёЁ',
+                            'еЕ'
+                        )
+                    )
+                ) STORED
+                """,
+            )
+            _execute(
+                conn,
+                """
+                CREATE INDEX IF NOT EXISTS idx_transactions_search
+                ON transactions USING GIN (search_vector)
+                """,
+            )
+            _execute(
+                conn,
+                """
+                ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS notify_muted INTEGER NOT NULL DEFAULT 0
+                """,
+            )
+            _execute(
+                conn,
+                """
+                ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS digest_muted INTEGER NOT NULL DEFAULT 0
+                """,
+            )
+            _execute(
+                conn,
+                """
+                ALTER TABLE budgets
+                ADD COLUMN IF NOT EXISTS rev BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS plans_rev BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS categories_rev BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS rekey_rev BIGINT NOT NULL DEFAULT 0
+                """,
+            )
+            _execute(
+                conn,
+                "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS rev BIGINT NOT NULL DEFAULT 0",
+            )
+            if TRANSACTION_PARTITIONS:
+                _init_postgres_partitions(conn)
         else:
             _execute(
                 conn,
@@ -214,6 +621,21 @@ def init_db() -> None:
             cols = {row[1] for row in _execute(conn, "PRAGMA table_info(budgets)")}
             if "owner_id" not in cols:
                 _execute(conn, "ALTER TABLE budgets ADD COLUMN owner_id INTEGER")
+            if "rev" not in cols:
+                _execute(conn, "ALTER TABLE budgets ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+            if "plans_rev" not in cols:
+                _execute(
+                    conn, "ALTER TABLE budgets ADD COLUMN plans_rev INTEGER NOT NULL DEFAULT 0"
+                )
+            if "categories_rev" not in cols:
+                _execute(
+                    conn,
+                    "ALTER TABLE budgets ADD COLUMN categories_rev INTEGER NOT NULL DEFAULT 0",
+                )
+            if "rekey_rev" not in cols:
+                _execute(
+                    conn, "ALTER TABLE budgets ADD COLUMN rekey_rev INTEGER NOT NULL DEFAULT 0"
+                )
             user_cols = {row[1] for row in _execute(conn, "PRAGMA table_info(users)")}
             if "display_name" not in user_cols:
                 _execute(conn, "ALTER TABLE users ADD COLUMN display_name TEXT")
@@ -221,17 +643,71 @@ def init_db() -> None:
                 _execute(conn, "ALTER TABLE users ADD COLUMN personal_budget_id INTEGER")
             if "shared_budget_id" not in user_cols:
                 _execute(conn, "ALTER TABLE users ADD COLUMN shared_budget_id INTEGER")
+            if "notify_muted" not in user_cols:
+                _execute(
+                    conn,
+                    "ALTER TABLE users ADD COLUMN notify_muted INTEGER NOT NULL DEFAULT 0",
+                )
+            if "digest_muted" not in user_cols:
+                _execute(
+                    conn,
+                    "ALTER TABLE users ADD COLUMN digest_muted INTEGER NOT NULL DEFAULT 0",
+                )
             tx_cols = {row[1] for row in _execute(conn, "PRAGMA table_info(transactions)")}
             if "added_by" not in tx_cols:
                 _execute(conn, "ALTER TABLE transactions ADD COLUMN added_by TEXT")
             if "category" not in tx_cols:
                 _execute(conn, "ALTER TABLE transactions ADD COLUMN category TEXT")
+            if "rev" not in tx_cols:
+                _execute(
+                    conn, "ALTER TABLE transactions ADD COLUMN rev INTEGER NOT NULL DEFAULT 0"
+                )
             plan_cols = {row[1] for row in _execute(conn, "PRAGMA table_info(plans)")}
             if "current_amount" not in plan_cols:
                 _execute(
                     conn,
                     "ALTER TABLE plans ADD COLUMN current_amount REAL NOT NULL DEFAULT 0",
                 )
+            _init_sqlite_search(conn)
+            _execute(
+                conn,
+                """
+                CREATE TABLE IF NOT EXISTS transaction_archives (
+                    year INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    archived_until TEXT,
+                    row_count INTEGER NOT NULL DEFAULT 0,
+                    max_id INTEGER NOT NULL DEFAULT 0
+                )
+                """,
+            )
+            _execute(
+                conn,
+                """
+                CREATE TABLE IF NOT EXISTS archive_balances (
+                    budget_id INTEGER PRIMARY KEY,
+                    balance REAL NOT NULL,
+                    max_id INTEGER NOT NULL DEFAULT 0
+                )
+                """,
+            )
+            archive_cols = {
+                row[1] for row in _execute(conn, "PRAGMA table_info(archive_balances)")
+            }
+            if "max_id" not in archive_cols:
+                _execute(
+                    conn,
+                    "ALTER TABLE archive_balances ADD COLUMN max_id INTEGER NOT NULL DEFAULT 0",
+                )
+            _execute(
+                conn,
+                """
+                CREATE TABLE IF NOT EXISTS budget_shards (
+                    budget_id INTEGER PRIMARY KEY,
+                    shard INTEGER NOT NULL
+                )
+                """,
+            )
 
         _execute(
             conn,
@@ -243,162 +719,983 @@ def init_db() -> None:
             WHERE owner_id IS NULL
             """,
         )
-
-
-def _now() -> str:
-    return datetime.utcnow().isoformat(timespec="seconds")
-
-
-def _create_budget(conn, owner_id: int) -> int:
-    if DB_KIND == "postgres":
-        cur = _execute(
+        _execute(
             conn,
-            "INSERT INTO budgets (owner_id, created_at) VALUES (?, ?) RETURNING id",
-            (owner_id, _now()),
+            """
+            CREATE INDEX IF NOT EXISTS idx_transactions_budget_created
+            ON transactions (budget_id, created_at)
+            """,
         )
-        return int(cur.fetchone()[0])
-    cur = _execute(
-        conn,
-        "INSERT INTO budgets (owner_id, created_at) VALUES (?, ?)",
-        (owner_id, _now()),
-    )
-    return int(cur.lastrowid)
-
-
-def get_or_create_user(telegram_id: int, display_name: str | None = None) -> None:
-    with _connect() as conn:
-        cur = _execute(
+        id_column = (
+            "SERIAL PRIMARY KEY"
+            if DB_KIND == "postgres"
+            else "INTEGER PRIMARY KEY AUTOINCREMENT"
+        )
+        _execute(
             conn,
-            "SELECT budget_id, personal_budget_id FROM users WHERE telegram_id = ?",
-            (telegram_id,),
+            f"""
+            CREATE TABLE IF NOT EXISTS recurring_rules (
+                id {id_column},
+                budget_id INTEGER NOT NULL,
+                t_type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                description TEXT NOT NULL,
+                category TEXT,
+                added_by TEXT,
+                period TEXT NOT NULL,
+                interval_count INTEGER NOT NULL DEFAULT 1,
+                day_of_month INTEGER,
+                next_run_at TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_until TEXT,
+                active INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT NOT NULL
+            )
+            """,
         )
-        row = cur.fetchone()
-        if row:
-            if display_name:
-                _execute(
-                    conn,
-                    "UPDATE users SET display_name = ? WHERE telegram_id = ?",
-                    (display_name, telegram_id),
-                )
-            budget_id, personal_budget_id = row
-            if personal_budget_id is None:
-                _execute(
-                    conn,
-                    "UPDATE users SET personal_budget_id = ? WHERE telegram_id = ?",
-                    (budget_id, telegram_id),
-                )
-            return
-        budget_id = _create_budget(conn, telegram_id)
         _execute(
             conn,
-            """
-            INSERT INTO users (
-                telegram_id, budget_id, display_name, personal_budget_id, created_at
+            f"""
+            CREATE TABLE IF NOT EXISTS category_limits (
+                id {id_column},
+                budget_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                month TEXT NOT NULL,
+                amount_limit REAL NOT NULL,
+                spent REAL NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                UNIQUE(budget_id, category, month)
             )
-            VALUES (?, ?, ?, ?, ?)
             """,
-            (telegram_id, budget_id, display_name, budget_id, _now()),
         )
-
-
-def _get_budget_id(conn, telegram_id: int) -> int:
-    cur = _execute(conn, "SELECT budget_id FROM users WHERE telegram_id = ?", (telegram_id,))
-    row = cur.fetchone()
-    if not row:
-        raise RuntimeError("User not found")
-    return int(row[0])
-
-
-def get_budget_summary(telegram_id: int) -> float:
-    with _connect() as conn:
-        budget_id = _get_budget_id(conn, telegram_id)
-        cur = _execute(
+        _execute(
             conn,
             """
-            SELECT COALESCE(
-                SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END),
-                0
-            )
-            FROM transactions
-            WHERE budget_id = ?
+            CREATE INDEX IF NOT EXISTS idx_recurring_due
+            ON recurring_rules (active, next_run_at)
             """,
-            (budget_id,),
         )
-        return float(cur.fetchone()[0])
-
-
-def add_transaction(
-    telegram_id: int,
-    t_type: str,
-    amount: float,
-    description: str,
-    added_by: str | None,
-    category: str | None,
-) -> None:
-    with _connect() as conn:
-        budget_id = _get_budget_id(conn, telegram_id)
         _execute(
             conn,
             """
-            INSERT INTO transactions (
-                budget_id, t_type, amount, description, added_by, category, created_at
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            CREATE INDEX IF NOT EXISTS idx_transactions_created
+            ON transactions (created_at)
             """,
-            (budget_id, t_type, amount, description, added_by, category, _now()),
         )
-
-
-def get_period_summary(
-    telegram_id: int, t_type: str, days: int
-) -> tuple[float, int]:
-    start = (datetime.utcnow() - timedelta(days=days)).isoformat(timespec="seconds")
-    with _connect() as conn:
-        budget_id = _get_budget_id(conn, telegram_id)
-        cur = _execute(
+        _execute(
             conn,
             """
-            SELECT COALESCE(SUM(amount), 0), COUNT(*)
-            FROM transactions
-            WHERE budget_id = ? AND t_type = ? AND created_at >= ?
+            CREATE INDEX IF NOT EXISTS idx_transactions_budget_rev
+            ON transactions (budget_id, rev)
             """,
-            (budget_id, t_type, start),
         )
-        total, count = cur.fetchone()
-        return float(total), int(count)
-
-
-def get_recent_transactions(
-    telegram_id: int, t_type: str, limit: int = 10
-) -> list[tuple[int, float, str, str, str, str]]:
-    with _connect() as conn:
-        budget_id = _get_budget_id(conn, telegram_id)
-        cur = _execute(
+        _execute(
             conn,
             """
-            SELECT id, amount, description, COALESCE(added_by, ''), COALESCE(category, ''), created_at
-            FROM transactions
-            WHERE budget_id = ? AND t_type = ?
-            ORDER BY id DESC
-            LIMIT ?
+            CREATE TABLE IF NOT EXISTS digest_runs (
+                run_key TEXT PRIMARY KEY,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            )
             """,
-            (budget_id, t_type, limit),
         )
-        return list(cur.fetchall())
-
-
-def list_transactions(
-    telegram_id: int,
-    t_type: str,
-    start: str | None,
-    end: str | None,
-    limit: int = 50,
-) -> list[tuple[int, float, str, str, str, str]]:
+        _execute(
+            conn,
+            """
+            CREATE TABLE IF NOT EXISTS digest_sent (
+                run_key TEXT NOT NULL,
+                telegram_id BIGINT NOT NULL,
+                sent_at TEXT NOT NULL,
+                PRIMARY KEY (run_key, telegram_id)
+            )
+            """,
+        )
+        _execute(
+            conn,
+            """
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                telegram_id BIGINT NOT NULL,
+                idempotency_key TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                response TEXT,
+                created_at TEXT NOT NULL,
+                reserved_at TEXT,
+                PRIMARY KEY (telegram_id, idempotency_key)
+            )
+            """,
+        )
+        _execute(
+            conn,
+            """
+            CREATE INDEX IF NOT EXISTS idx_idempotency_created
+            ON idempotency_keys (created_at)
+            """,
+        )
+        if DB_KIND == "postgres":
+            _execute(
+                conn, "ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS reserved_at TEXT"
+            )
+        elif "reserved_at" not in {
+            row[1] for row in _execute(conn, "PRAGMA table_info(idempotency_keys)")
+        }:
+            _execute(conn, "ALTER TABLE idempotency_keys ADD COLUMN reserved_at TEXT")
+        _execute(
+            conn,
+            """
+            CREATE INDEX IF NOT EXISTS idx_invites_budget
+            ON invites (budget_id, used_by)
+            """,
+        )
+        _execute(
+            conn,
+            """
+            CREATE INDEX IF NOT EXISTS idx_invites_created
+            ON invites (created_at)
+            """,
+        )
+        if DB_KIND == "postgres" and TRANSACTION_PARTITIONS:
+            _ensure_partitions(conn, datetime.utcnow())
+    for shard in _shards()[1:]:
+        _init_shard(shard)
+
+
+def _init_shard(shard: int) -> None:
+    conn = sqlite3.connect(_shard_path(shard))
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("ATTACH DATABASE ? AS directory", (DB_PATH,))
+        with conn:
+            existing = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master")}
+            schema = conn.execute(
+                f"""
+                SELECT type, name, sql
+                FROM directory.sqlite_master
+                WHERE tbl_name IN ({_placeholders(len(SHARDED_TABLES))})
+                    AND type IN ('table', 'index')
+                    AND sql IS NOT NULL
+                ORDER BY type = 'index'
+                """,
+                SHARDED_TABLES,
+            ).fetchall()
+            for kind, name, sql in schema:
+                if name not in existing:
+                    conn.execute(sql)
+                    continue
+                if kind != "table":
+                    continue
+                cols = {row[1] for row in conn.execute(f"PRAGMA main.table_info({name})")}
+                for _, column, column_type, notnull, default, _ in conn.execute(
+                    f"PRAGMA directory.table_info({name})"
+                ).fetchall():
+                    if column in cols:
+                        continue
+                    ddl = f"ALTER TABLE main.{name} ADD COLUMN {column} {column_type}"
+                    if notnull:
+                        ddl += " NOT NULL"
+                    if default is not None:
+                        ddl += f" DEFAULT {default}"
+                    conn.execute(ddl)
+            _init_sqlite_search(conn)
+        conn.execute("DETACH DATABASE directory")
+    finally:
+        conn.close()
+
+
+def _init_sqlite_search(conn) -> None:
+    exists = _execute(
+        conn, "SELECT 1 FROM sqlite_master WHERE name = 'transactions_fts'"
+    ).fetchone()
+    _execute(
+        conn,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            budget,
+            description,
+            category,
+            added_by,
+            content = '',
+            prefix = '2 3',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+    )
+    row_values = """
+        'b' || {row}.budget_id,
+        replace(replace({row}.description, 'ё', 'е'), 'Ё', 'Е'),
+        replace(replace(COALESCE({row}.category, ''), 'ё', 'е'), 'Ё', 'Е'),
+        COALESCE({row}.added_by, '')
+    """
+    insert_new = f"""
+        INSERT INTO transactions_fts (rowid, budget, description, category, added_by)
+        VALUES (new.id, {row_values.format(row="new")});
+    """
+    delete_old = f"""
+        INSERT INTO transactions_fts (
+            transactions_fts, rowid, budget, description, category, added_by
+        )
+        VALUES ('delete', old.id, {row_values.format(row="old")});
+    """
+    _execute(
+        conn,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions
+        BEGIN {insert_new} END
+        """,
+    )
+    _execute(
+        conn,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions
+        BEGIN {delete_old} END
+        """,
+    )
+    _execute(
+        conn,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_au
+        AFTER UPDATE OF budget_id, description, category, added_by ON transactions
+        BEGIN {delete_old} {insert_new} END
+        """,
+    )
+    if not exists:
+        _execute(
+            conn,
+            f"""
+            INSERT INTO transactions_fts (rowid, budget, description, category, added_by)
+            SELECT id, {row_values.format(row="transactions")}
+            FROM transactions
+            """,
+        )
+
+
+def _month_start(value: datetime, offset: int = 0) -> datetime:
+    index = value.year * 12 + value.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"transactions_p{month:%Y%m}"
+
+
+def _init_postgres_partitions(conn) -> None:
+    kind = _execute(
+        conn, "SELECT relkind FROM pg_class WHERE oid = 'transactions'::regclass"
+    ).fetchone()[0]
+    if kind == "p":
+        return
+    cutover = _month_start(datetime.utcnow()).isoformat(timespec="seconds")
+    _execute(conn, "ALTER TABLE transactions RENAME TO transactions_legacy")
+    for index in (
+        "transactions_pkey",
+        "idx_transactions_search",
+        "idx_transactions_budget_created",
+        "idx_transactions_created",
+        "idx_transactions_budget_rev",
+    ):
+        _execute(conn, f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy")
+    _execute(
+        conn,
+        """
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            budget_id INTEGER NOT NULL,
+            t_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT NOT NULL,
+            added_by TEXT,
+            category TEXT,
+            created_at TEXT NOT NULL,
+            search_vector tsvector GENERATED ALWAYS AS (
+                to_tsvector(
+                    'simple',
+                    translate(
+                        COALESCE(description, '') || ' ' ||
+                        COALESCE(category, '') || ' ' ||
+                        COALESCE(added_by, ''),
+                        'ёЁ',
+                        'еЕ'
+                    )
+                )
+            ) STORED,
+            rev BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """,
+    )
+    _execute(
+        conn,
+        f"""
+        ALTER TABLE transactions_legacy
+        ADD CONSTRAINT transactions_legacy_before_cutover CHECK (created_at < '{cutover}')
+        """,
+    )
+    _execute(
+        conn, "ALTER TABLE transactions_legacy DROP CONSTRAINT IF EXISTS transactions_pkey_legacy"
+    )
+    _execute(conn, "ALTER TABLE transactions ATTACH PARTITION transactions_legacy DEFAULT")
+    _execute(conn, "ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id")
+    _execute(
+        conn,
+        """
+        CREATE INDEX IF NOT EXISTS idx_transactions_search
+        ON transactions USING GIN (search_vector)
+        """,
+    )
+
+
+def _ensure_partitions(conn, now: datetime) -> int:
+    latest = _execute(
+        conn,
+        """
+        SELECT MAX(c.relname)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'transactions'::regclass
+          AND c.relname ~ '^transactions_p[0-9]{6}$'
+        """,
+    ).fetchone()[0]
+    month = _month_start(now)
+    if latest:
+        month = min(
+            month, _month_start(datetime.strptime(latest[-6:], "%Y%m"), 1)
+        )
+    last = _month_start(now, PARTITION_MONTHS_AHEAD)
+    created = 0
+    while month <= last:
+        upper = _month_start(month, 1)
+        _execute(
+            conn,
+            f"""
+            CREATE TABLE IF NOT EXISTS {_partition_name(month)}
+            PARTITION OF transactions
+            FOR VALUES FROM ('{month.isoformat(timespec="seconds")}')
+            TO ('{upper.isoformat(timespec="seconds")}')
+            """,
+        )
+        created += 1
+        month = upper
+    return created
+
+
+def ensure_transaction_partitions(now: datetime | None = None) -> int:
+    if DB_KIND != "postgres" or not TRANSACTION_PARTITIONS:
+        return 0
+    with _connect() as conn:
+        return _ensure_partitions(conn, now or datetime.utcnow())
+
+
+def _archive_schema(name: str) -> list[str]:
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {name}.transactions (
+            id INTEGER PRIMARY KEY,
+            budget_id INTEGER NOT NULL,
+            t_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT NOT NULL,
+            added_by TEXT,
+            category TEXT,
+            created_at TEXT NOT NULL,
+            rev INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {name}.idx_transactions_budget_created
+        ON transactions (budget_id, created_at)
+        """,
+        f"""
+        CREATE INDEX IF NOT EXISTS {name}.idx_transactions_created
+        ON transactions (created_at)
+        """,
+    ]
+
+
+def archive_transactions(before: str) -> int:
+    if DB_KIND != "sqlite":
+        return 0
+    return sum(_archive_shard(_shard_path(shard), before) for shard in _shards())
+
+
+def _archive_shard(path: str, before: str) -> int:
+    with sqlite3.connect(path) as conn:
+        years = [
+            int(row[0])
+            for row in _execute(
+                conn,
+                """
+                SELECT DISTINCT substr(created_at, 1, 4)
+                FROM transactions
+                WHERE created_at < ?
+                """,
+                (before,),
+            ).fetchall()
+        ]
+    moved = 0
+    for year in sorted(years):
+        lower = f"{year:04d}-01-01T00:00:00"
+        upper = min(before, f"{year + 1:04d}-01-01T00:00:00")
+        conn = sqlite3.connect(path)
+        attached = False
+        try:
+            conn.execute("ATTACH DATABASE ? AS cold", (_archive_path(path, year),))
+            attached = True
+            for statement in _archive_schema("cold"):
+                conn.execute(statement)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO cold.transactions ({TRANSACTION_COLUMNS})
+                SELECT {TRANSACTION_COLUMNS}
+                FROM main.transactions
+                WHERE created_at >= ? AND created_at < ?
+                """,
+                (lower, upper),
+            )
+            conn.execute(
+                """
+                INSERT INTO archive_balances (budget_id, balance, max_id)
+                SELECT
+                    budget_id,
+                    SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END),
+                    MAX(id)
+                FROM main.transactions
+                WHERE created_at >= ? AND created_at < ?
+                GROUP BY budget_id
+                ON CONFLICT (budget_id) DO UPDATE SET
+                    balance = balance + excluded.balance,
+                    max_id = MAX(max_id, excluded.max_id)
+                """,
+                (lower, upper),
+            )
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cold.transactions").fetchone()[0]
+            count = conn.execute(
+                "DELETE FROM main.transactions WHERE created_at >= ? AND created_at < ?",
+                (lower, upper),
+            ).rowcount
+            conn.execute(
+                """
+                INSERT INTO transaction_archives (year, path, archived_until, row_count, max_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (year) DO UPDATE SET
+                    archived_until = MAX(COALESCE(archived_until, ''), excluded.archived_until),
+                    row_count = row_count + excluded.row_count,
+                    max_id = MAX(max_id, excluded.max_id)
+                """,
+                (year, _archive_path(path, year), upper, count, max_id),
+            )
+            conn.commit()
+            moved += count
+        finally:
+            conn.rollback()
+            if attached:
+                conn.execute("DETACH DATABASE cold")
+            conn.close()
+    return moved
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+
+def _begin_write(conn) -> None:
+    if DB_KIND == "sqlite" and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+def _create_budget(conn, owner_id: int) -> int:
+    if DB_KIND == "postgres":
+        cur = _execute(
+            conn,
+            "INSERT INTO budgets (owner_id, created_at) VALUES (?, ?) RETURNING id",
+            (owner_id, _now()),
+        )
+        return int(cur.fetchone()[0])
+    created_at = _now()
+    cur = _execute(
+        conn,
+        "INSERT INTO budgets (owner_id, created_at) VALUES (?, ?)",
+        (owner_id, created_at),
+    )
+    budget_id = int(cur.lastrowid)
+    shard = budget_id % DB_SHARDS if SHARDED else 0
+    if shard:
+        _execute(
+            conn,
+            "INSERT INTO budget_shards (budget_id, shard) VALUES (?, ?)",
+            (budget_id, shard),
+        )
+        with _connect_shard(shard, directory=False) as shard_conn:
+            shard_conn.execute(
+                """
+                INSERT INTO budgets (id, owner_id, created_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    owner_id = excluded.owner_id,
+                    created_at = excluded.created_at,
+                    rev = 0,
+                    plans_rev = 0,
+                    categories_rev = 0,
+                    rekey_rev = 0
+                """,
+                (budget_id, owner_id, created_at),
+            )
+    return budget_id
+
+
+def _drop_budget(conn, budget_id: int) -> None:
+    _execute(conn, "DELETE FROM budgets WHERE id = ?", (budget_id,))
+    if not SHARDED:
+        return
+    row = _execute(
+        conn, "DELETE FROM budget_shards WHERE budget_id = ? RETURNING shard", (budget_id,)
+    ).fetchone()
+    if row and row[0]:
+        with _connect_shard(int(row[0]), directory=False) as shard_conn:
+            shard_conn.execute("DELETE FROM budgets WHERE id = ?", (budget_id,))
+
+
+def get_or_create_user(telegram_id: int, display_name: str | None = None) -> None:
     with _connect() as conn:
+        cur = _execute(
+            conn,
+            """
+            SELECT budget_id, personal_budget_id, display_name
+            FROM users
+            WHERE telegram_id = ?
+            """,
+            (telegram_id,),
+        )
+        row = cur.fetchone()
+        if row:
+            budget_id, personal_budget_id, stored_name = row
+            if display_name and display_name != stored_name:
+                _execute(
+                    conn,
+                    "UPDATE users SET display_name = ? WHERE telegram_id = ?",
+                    (display_name, telegram_id),
+                )
+            if personal_budget_id is None:
+                _execute(
+                    conn,
+                    "UPDATE users SET personal_budget_id = ? WHERE telegram_id = ?",
+                    (budget_id, telegram_id),
+                )
+            return
+        _pin(telegram_id)
+        budget_id = _create_budget(conn, telegram_id)
+        _execute(
+            conn,
+            """
+            INSERT INTO users (
+                telegram_id, budget_id, display_name, personal_budget_id, created_at
+            )
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (telegram_id, budget_id, display_name, budget_id, _now()),
+        )
+
+
+def _get_budget_id(conn, telegram_id: int) -> int:
+    cur = _execute(conn, "SELECT budget_id FROM users WHERE telegram_id = ?", (telegram_id,))
+    row = cur.fetchone()
+    if not row:
+        raise RuntimeError("User not found")
+    return int(row[0])
+
+
+def _bump_rev(
+    conn, budget_id: int, plans: bool = False, categories: bool = False
+) -> int:
+    query = "UPDATE budgets SET rev = rev + 1"
+    if plans:
+        query += ", plans_rev = rev + 1"
+    if categories:
+        query += ", categories_rev = rev + 1"
+    cur = _execute(conn, query + " WHERE id = ? RETURNING rev", (budget_id,))
+    return int(cur.fetchone()[0])
+
+
+def _budget_balance(conn, budget_id: int) -> float:
+    cur = _execute(
+        conn,
+        """
+        SELECT COALESCE(
+            SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END),
+            0
+        )
+        FROM transactions
+        WHERE budget_id = ?
+        """,
+        (budget_id,),
+    )
+    balance = float(cur.fetchone()[0])
+    if DB_KIND == "sqlite":
+        row = _execute(
+            conn, "SELECT balance FROM archive_balances WHERE budget_id = ?", (budget_id,)
+        ).fetchone()
+        if row:
+            balance += float(row[0])
+    return balance
+
+
+def get_budget_summary(telegram_id: int) -> float:
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        return _SINGLE_FLIGHT.do(
+            _flight_key("balance", budget_id),
+            lambda: _budget_balance(conn, budget_id),
+        )
+
+
+_INSERT_TRANSACTION = """
+    INSERT INTO transactions (
+        budget_id, t_type, amount, description, added_by, category, created_at, rev
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _limit_deltas(entries) -> dict[tuple[str, str], float]:
+    deltas: dict[tuple[str, str], float] = {}
+    for t_type, amount, category, created_at in entries:
+        if t_type == "expense" and category:
+            key = (category, created_at[:7])
+            deltas[key] = deltas.get(key, 0.0) + amount
+    return deltas
+
+
+def _apply_limits(conn, budget_id: int, entries) -> list[dict]:
+    alerts = []
+    for (category, month), amount in _limit_deltas(entries).items():
+        if not amount:
+            continue
+        row = _execute(
+            conn,
+            """
+            UPDATE category_limits
+            SET spent = spent + ?
+            WHERE budget_id = ? AND category = ? AND month = ?
+            RETURNING amount_limit, spent
+            """,
+            (amount, budget_id, category, month),
+        ).fetchone()
+        if row is None:
+            if amount <= 0:
+                continue
+            latest = _execute(
+                conn,
+                """
+                SELECT month, amount_limit
+                FROM category_limits
+                WHERE budget_id = ? AND category = ?
+                ORDER BY month DESC
+                LIMIT 1
+                """,
+                (budget_id, category),
+            ).fetchone()
+            if latest is None or latest[0] > month or latest[1] <= 0:
+                continue
+            _execute(
+                conn,
+                """
+                INSERT INTO category_limits (
+                    budget_id, category, month, amount_limit, spent, created_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (budget_id, category, month, latest[1], amount, _now()),
+            )
+            row = (latest[1], amount)
+        limit, spent = float(row[0]), float(row[1])
+        if limit <= 0 or amount <= 0:
+            continue
+        crossed = [
+            threshold
+            for threshold in LIMIT_THRESHOLDS
+            if spent - amount < limit * threshold <= spent
+        ]
+        if crossed:
+            alerts.append(
+                {
+                    "category": category,
+                    "month": month,
+                    "limit": limit,
+                    "spent": round(spent, 2),
+                    "threshold": crossed[-1],
+                }
+            )
+    return alerts
+
+
+def add_transaction(
+    telegram_id: int,
+    t_type: str,
+    amount: float,
+    description: str,
+    added_by: str | None,
+    category: str | None,
+) -> list[dict]:
+    _pin(telegram_id)
+    if WRITE_BATCH_ENABLED:
+        return submit_transaction(
+            telegram_id, t_type, amount, description, added_by, category
+        ).result()
+    created_at = _now()
+    with _connect(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        rev = _bump_rev(conn, budget_id)
+        _execute(
+            conn,
+            _INSERT_TRANSACTION,
+            (budget_id, t_type, amount, description, added_by, category, created_at, rev),
+        )
+        alerts = _apply_limits(conn, budget_id, [(t_type, amount, category, created_at)])
+    _budget_written(budget_id)
+    _transactions_added(
+        budget_id, telegram_id, [(t_type, amount, description, category, added_by)]
+    )
+    _limits_crossed(budget_id, alerts)
+    return alerts
+
+
+def submit_transaction(
+    telegram_id: int,
+    t_type: str,
+    amount: float,
+    description: str,
+    added_by: str | None,
+    category: str | None,
+) -> Future:
+    _pin(telegram_id)
+    if not WRITE_BATCH_ENABLED:
+        future = Future()
+        try:
+            alerts = add_transaction(
+                telegram_id, t_type, amount, description, added_by, category
+            )
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(alerts)
+        return future
+    return _WRITER.submit(
+        (telegram_id, t_type, amount, description, added_by, category, _now())
+    )
+
+
+def add_transactions_batch(
+    telegram_id: int,
+    entries: list[tuple[str, float, str, str | None]],
+    added_by: str | None,
+    created_at: str | None = None,
+) -> float:
+    _pin(telegram_id)
+    created_at = created_at or _now()
+    with _connect(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        categories = {(t_type, category) for t_type, _, _, category in entries if category}
+        rev = _bump_rev(conn, budget_id, categories=bool(categories))
+        if categories:
+            _executemany(
+                conn,
+                """
+                INSERT INTO categories (budget_id, t_type, name, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (budget_id, t_type, name) DO NOTHING
+                """,
+                [(budget_id, t_type, name, created_at) for t_type, name in sorted(categories)],
+            )
+        _executemany(
+            conn,
+            _INSERT_TRANSACTION,
+            [
+                (budget_id, t_type, amount, description, added_by, category, created_at, rev)
+                for t_type, amount, description, category in entries
+            ],
+        )
+        alerts = _apply_limits(
+            conn,
+            budget_id,
+            [(t_type, amount, category, created_at) for t_type, amount, _, category in entries],
+        )
+        balance = _budget_balance(conn, budget_id)
+    _budget_written(budget_id)
+    _transactions_added(
+        budget_id,
+        telegram_id,
+        [
+            (t_type, amount, description, category, added_by)
+            for t_type, amount, description, category in entries
+        ],
+    )
+    _limits_crossed(budget_id, alerts)
+    return balance
+
+
+class _GroupCommitWriter:
+    def __init__(self, max_size: int, max_delay: float) -> None:
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: tuple) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="db-group-commit", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: list) -> None:
+        try:
+            if not SHARDED:
+                self._commit_shard(0, batch)
+                return
+            groups: dict[int, list] = {}
+            for item, future in batch:
+                groups.setdefault(_shard_for(item[0]), []).append((item, future))
+            for shard, items in groups.items():
+                self._commit_shard(shard, items)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+    def _commit_shard(self, shard: int, batch: list) -> None:
+        accepted = []
+        added: dict[tuple[int, int], list[tuple]] = {}
+        try:
+            with _connect_shard(shard) as conn:
+                telegram_ids = list({item[0] for item, _ in batch})
+                cur = _execute(
+                    conn,
+                    "SELECT telegram_id, budget_id FROM users "
+                    f"WHERE telegram_id IN ({_placeholders(len(telegram_ids))})",
+                    telegram_ids,
+                )
+                budgets = {int(row[0]): int(row[1]) for row in cur.fetchall()}
+                revs = {
+                    budget_id: _bump_rev(conn, budget_id)
+                    for budget_id in sorted(set(budgets.values()))
+                }
+                rows = []
+                limited = []
+                for item, future in batch:
+                    telegram_id, *values = item
+                    budget_id = budgets.get(telegram_id)
+                    if budget_id is None:
+                        future.set_exception(RuntimeError("User not found"))
+                        continue
+                    rows.append((budget_id, *values, revs[budget_id]))
+                    accepted.append(future)
+                    t_type, amount, description, added_by, category, created_at = values
+                    limited.append((budget_id, (t_type, amount, category, created_at)))
+                    added.setdefault((budget_id, telegram_id), []).append(
+                        (t_type, amount, description, category, added_by)
+                    )
+                if rows:
+                    _executemany(conn, _INSERT_TRANSACTION, rows)
+                alerts = [
+                    (budget_id, _apply_limits(conn, budget_id, [entry]))
+                    for budget_id, entry in limited
+                ]
+        except Exception as exc:
+            for future in accepted or [future for _, future in batch]:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for budget_id in {budget_id for budget_id, _ in added}:
+            _budget_written(budget_id)
+        for future, (_, item_alerts) in zip(accepted, alerts):
+            future.set_result(item_alerts)
+        for (budget_id, telegram_id), entries in added.items():
+            _transactions_added(budget_id, telegram_id, entries)
+        for budget_id, item_alerts in alerts:
+            _limits_crossed(budget_id, item_alerts)
+
+
+_WRITER = _GroupCommitWriter(WRITE_BATCH_MAX_SIZE, WRITE_BATCH_MAX_DELAY_MS / 1000)
+
+
+def get_period_summary(
+    telegram_id: int, t_type: str, days: int
+) -> tuple[float, int]:
+    start = (datetime.utcnow() - timedelta(days=days)).isoformat(timespec="seconds")
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        with _transactions_source(conn, start) as source:
+            cur = _execute(
+                conn,
+                f"""
+                SELECT COALESCE(SUM(amount), 0), COUNT(*)
+                FROM {source}
+                WHERE budget_id = ? AND t_type = ? AND created_at >= ?
+                """,
+                (budget_id, t_type, start),
+            )
+            total, count = cur.fetchone()
+        return float(total), int(count)
+
+
+def get_recent_transactions(
+    telegram_id: int, t_type: str, limit: int = 10
+) -> list[tuple[int, float, str, str, str, str]]:
+    query = """
+        SELECT id, amount, description, COALESCE(added_by, ''), COALESCE(category, ''), created_at
+        FROM {source}
+        WHERE budget_id = ? AND t_type = ?
+        ORDER BY id DESC
+        LIMIT ?
+    """
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        params = (budget_id, t_type, limit)
+        rows = _execute(conn, query.format(source="transactions"), params).fetchall()
+        archived_max_id = _archived_max_id(conn, budget_id)
+        if archived_max_id is not None and (len(rows) < limit or rows[-1][0] < archived_max_id):
+            with _transactions_source(conn) as source:
+                rows = _execute(conn, query.format(source=source), params).fetchall()
+        return list(rows)
+
+
+def list_transactions(
+    telegram_id: int,
+    t_type: str,
+    start: str | None,
+    end: str | None,
+    limit: int = 50,
+) -> list[tuple[int, float, str, str, str, str]]:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         query = """
             SELECT id, amount, description, COALESCE(added_by, ''), COALESCE(category, ''), created_at
-            FROM transactions
+            FROM {source}
             WHERE budget_id = ? AND t_type = ?
         """
         params: list = [budget_id, t_type]
@@ -410,18 +1707,19 @@ def list_transactions(
             params.append(end)
         query += " ORDER BY id DESC LIMIT ?"
         params.append(limit)
-        cur = _execute(conn, query, tuple(params))
-        return list(cur.fetchall())
+        with _transactions_source(conn, start) as source:
+            rows = _execute(conn, query.format(source=source), tuple(params)).fetchall()
+        return list(rows)
 
 
 def list_updates(
     telegram_id: int, since: str | None, limit: int = 20
 ) -> list[tuple[str, float, str, str, str]]:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         query = """
             SELECT t_type, amount, description, COALESCE(added_by, ''), created_at
-            FROM transactions
+            FROM {source}
             WHERE budget_id = ?
         """
         params: list = [budget_id]
@@ -430,8 +1728,12 @@ def list_updates(
             params.append(since)
         query += " ORDER BY id ASC LIMIT ?"
         params.append(limit)
-        cur = _execute(conn, query, tuple(params))
-        return list(cur.fetchall())
+
+        def load() -> list:
+            with _transactions_source(conn, since) as source:
+                return list(_execute(conn, query.format(source=source), tuple(params)).fetchall())
+
+        return _SINGLE_FLIGHT.do(_flight_key("updates", budget_id, since, limit), load)
 
 
 def update_transaction(
@@ -441,60 +1743,839 @@ def update_transaction(
     description: str,
     category: str,
 ) -> bool:
-    with _connect() as conn:
+    _pin(telegram_id)
+    alerts = []
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
+        lock = " FOR UPDATE" if DB_KIND == "postgres" else ""
+        previous = _execute(
+            conn,
+            f"""
+            SELECT t_type, amount, category, created_at
+            FROM transactions
+            WHERE id = ? AND budget_id = ?{lock}
+            """,
+            (transaction_id, budget_id),
+        ).fetchone()
+        if previous is None:
+            with _transactions_source(conn) as source:
+                archived = _execute(
+                    conn,
+                    f"SELECT 1 FROM {source} WHERE id = ? AND budget_id = ?",
+                    (transaction_id, budget_id),
+                ).fetchone()
+            if archived:
+                raise ValueError("Transaction is archived")
+            return False
+        rev = _bump_rev(conn, budget_id)
         cur = _execute(
             conn,
             """
-            UPDATE transactions
-            SET amount = ?, description = ?, category = ?
-            WHERE id = ? AND budget_id = ?
+            UPDATE transactions
+            SET amount = ?, description = ?, category = ?, rev = ?
+            WHERE id = ? AND budget_id = ?
+            """,
+            (amount, description, category, rev, transaction_id, budget_id),
+        )
+        updated = cur.rowcount > 0
+        if updated:
+            t_type, old_amount, old_category, created_at = previous
+            alerts = _apply_limits(
+                conn,
+                budget_id,
+                [
+                    (t_type, -old_amount, old_category, created_at),
+                    (t_type, amount, category, created_at),
+                ],
+            )
+    if updated:
+        _budget_written(budget_id)
+        _limits_crossed(budget_id, alerts)
+    return updated
+
+
+def list_categories(telegram_id: int, t_type: str) -> list[str]:
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        with _transactions_source(conn) as source:
+            rows = _execute(
+                conn,
+                f"""
+                SELECT DISTINCT category
+                FROM {source}
+                WHERE budget_id = ? AND t_type = ? AND category IS NOT NULL AND category != ''
+                ORDER BY category ASC
+                """,
+                (budget_id, t_type),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def category_summary(
+    telegram_id: int, t_type: str, start: str | None, end: str | None
+) -> list[tuple[str, float]]:
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        query = """
+            SELECT COALESCE(category, 'Без категории') AS cat, SUM(amount)
+            FROM {source}
+            WHERE budget_id = ? AND t_type = ?
+        """
+        params: list = [budget_id, t_type]
+        if start:
+            query += " AND created_at >= ?"
+            params.append(start)
+        if end:
+            query += " AND created_at <= ?"
+            params.append(end)
+        query += " GROUP BY cat ORDER BY SUM(amount) DESC"
+        with _transactions_source(conn, start) as source:
+            rows = _execute(conn, query.format(source=source), tuple(params)).fetchall()
+        return [(row[0] or "Без категории", float(row[1] or 0)) for row in rows]
+
+
+SEARCH_MAX_TERMS = 8
+
+
+def _search_terms(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower().replace("ё", "е"))[:SEARCH_MAX_TERMS]
+
+
+def search_transactions(
+    telegram_id: int,
+    text: str,
+    t_type: str | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    category: str | None = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> list[tuple[int, str, float, str, str, str, str]]:
+    terms = _search_terms(text)
+    if not terms:
+        return []
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        if DB_KIND == "postgres":
+            match = " & ".join(f"'{term}':*" for term in terms)
+            query = """
+                SELECT t.id, t.t_type, t.amount, t.description,
+                    COALESCE(t.added_by, ''), COALESCE(t.category, ''), t.created_at
+                FROM transactions t, to_tsquery('simple', ?) q
+                WHERE t.budget_id = ? AND t.search_vector @@ q
+            """
+            order = " ORDER BY ts_rank(t.search_vector, q) DESC, t.id DESC"
+        else:
+            words = " AND ".join(f'"{term}"*' for term in terms)
+            match = f'budget : "b{budget_id}" AND {{description category added_by}} : ({words})'
+            query = """
+                SELECT t.id, t.t_type, t.amount, t.description,
+                    COALESCE(t.added_by, ''), COALESCE(t.category, ''), t.created_at
+                FROM transactions_fts f
+                JOIN transactions t ON t.id = f.rowid
+                WHERE transactions_fts MATCH ? AND t.budget_id = ?
+            """
+            order = " ORDER BY bm25(transactions_fts, 0, 10.0, 5.0, 1.0), t.id DESC"
+        params: list = [match, budget_id]
+        if t_type:
+            query += " AND t.t_type = ?"
+            params.append(t_type)
+        if start:
+            query += " AND t.created_at >= ?"
+            params.append(start)
+        if end:
+            query += " AND t.created_at <= ?"
+            params.append(end)
+        if category:
+            query += " AND t.category = ?"
+            params.append(category)
+        query += order + " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        cur = _execute(conn, query, tuple(params))
+        return list(cur.fetchall())
+
+
+RECURRING_PERIODS = ("day", "week", "month")
+RECURRING_MAX_CATCHUP = int(os.getenv("RECURRING_MAX_CATCHUP", "31"))
+
+
+def _next_occurrence(
+    when: datetime, period: str, interval_count: int, day_of_month: int | None
+) -> datetime:
+    if period == "day":
+        return when + timedelta(days=interval_count)
+    if period == "week":
+        return when + timedelta(weeks=interval_count)
+    month_index = when.month - 1 + interval_count
+    year = when.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(day_of_month or when.day, monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+
+def add_recurring(
+    telegram_id: int,
+    t_type: str,
+    amount: float,
+    description: str,
+    category: str | None,
+    added_by: str | None,
+    period: str,
+    interval_count: int,
+    first_run_at: str | None,
+) -> int:
+    if period not in RECURRING_PERIODS:
+        raise ValueError("Unknown period")
+    _pin(telegram_id)
+    first_run = datetime.fromisoformat(first_run_at) if first_run_at else datetime.utcnow()
+    if first_run.tzinfo is not None:
+        first_run = first_run.astimezone(timezone.utc).replace(tzinfo=None)
+    first_run = first_run.replace(microsecond=0)
+    with _connect(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        query = """
+            INSERT INTO recurring_rules (
+                budget_id, t_type, amount, description, category, added_by,
+                period, interval_count, day_of_month, next_run_at, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        params = (
+            budget_id,
+            t_type,
+            amount,
+            description,
+            category,
+            added_by,
+            period,
+            max(1, interval_count),
+            first_run.day,
+            first_run.isoformat(timespec="seconds"),
+            _now(),
+        )
+        if DB_KIND == "postgres":
+            cur = _execute(conn, query + " RETURNING id", params)
+            return int(cur.fetchone()[0])
+        return int(_execute(conn, query, params).lastrowid)
+
+
+def list_recurring(
+    telegram_id: int,
+) -> list[tuple[int, str, float, str, str, str, int, str]]:
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        cur = _execute(
+            conn,
+            """
+            SELECT id, t_type, amount, description, COALESCE(category, ''),
+                period, interval_count, next_run_at
+            FROM recurring_rules
+            WHERE budget_id = ? AND active = 1
+            ORDER BY next_run_at ASC
+            """,
+            (budget_id,),
+        )
+        return list(cur.fetchall())
+
+
+def delete_recurring(telegram_id: int, rule_id: int) -> bool:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        cur = _execute(
+            conn,
+            "UPDATE recurring_rules SET active = 0 WHERE id = ? AND budget_id = ? AND active = 1",
+            (rule_id, budget_id),
+        )
+        return cur.rowcount > 0
+
+
+def claim_due_recurring(
+    worker: str, now: datetime, limit: int, lease_seconds: float
+) -> list[tuple]:
+    now_iso = now.isoformat(timespec="seconds")
+    lease_until = (now + timedelta(seconds=lease_seconds)).isoformat(timespec="seconds")
+    lock = " FOR UPDATE SKIP LOCKED" if DB_KIND == "postgres" else ""
+    rules = []
+    for shard in _shards():
+        if len(rules) >= limit:
+            break
+        with _connect_shard(shard, directory=False) as conn:
+            _begin_write(conn)
+            cur = _execute(
+                conn,
+                f"""
+                UPDATE recurring_rules
+                SET lease_owner = ?, lease_until = ?
+                WHERE id IN (
+                    SELECT id FROM recurring_rules
+                    WHERE active = 1
+                        AND next_run_at <= ?
+                        AND (lease_until IS NULL OR lease_until < ?)
+                    ORDER BY next_run_at ASC
+                    LIMIT ?{lock}
+                )
+                RETURNING id, budget_id, t_type, amount, description, category, added_by,
+                    period, interval_count, day_of_month, next_run_at
+                """,
+                (worker, lease_until, now_iso, now_iso, limit - len(rules)),
+            )
+            rules.extend(cur.fetchall())
+    return rules
+
+
+def materialize_recurring(worker: str, rules: list[tuple], now: datetime) -> int:
+    if SHARDED:
+        groups: dict[int, list[tuple]] = {}
+        for rule in rules:
+            groups.setdefault(_shard_for(budget_id=rule[1]), []).append(rule)
+        return sum(
+            _materialize_shard(worker, shard, shard_rules, now)
+            for shard, shard_rules in groups.items()
+        )
+    return _materialize_shard(worker, 0, rules, now)
+
+
+def _materialize_shard(worker: str, shard: int, rules: list[tuple], now: datetime) -> int:
+    rows = []
+    revs: dict[int, int] = {}
+    with _connect_shard(shard, directory=False) as conn:
+        _begin_write(conn)
+        for (
+            rule_id,
+            budget_id,
+            t_type,
+            amount,
+            description,
+            category,
+            added_by,
+            period,
+            interval_count,
+            day_of_month,
+            next_run_at,
+        ) in rules:
+            run_at = datetime.fromisoformat(next_run_at)
+            due = []
+            while run_at <= now and len(due) < RECURRING_MAX_CATCHUP:
+                due.append(run_at)
+                run_at = _next_occurrence(run_at, period, interval_count, day_of_month)
+            while run_at <= now:
+                run_at = _next_occurrence(run_at, period, interval_count, day_of_month)
+            cur = _execute(
+                conn,
+                """
+                UPDATE recurring_rules
+                SET next_run_at = ?, lease_owner = NULL, lease_until = NULL
+                WHERE id = ? AND next_run_at = ? AND lease_owner = ? AND active = 1
+                """,
+                (run_at.isoformat(timespec="seconds"), rule_id, next_run_at, worker),
+            )
+            if cur.rowcount == 0:
+                continue
+            if budget_id not in revs:
+                revs[budget_id] = _bump_rev(conn, budget_id)
+            rows.extend(
+                (
+                    budget_id,
+                    t_type,
+                    amount,
+                    description,
+                    added_by,
+                    category,
+                    when.isoformat(timespec="seconds"),
+                    revs[budget_id],
+                )
+                for when in due
+            )
+        if rows:
+            _executemany(conn, _INSERT_TRANSACTION, rows)
+        limited: dict[int, list[tuple]] = {}
+        for row in rows:
+            limited.setdefault(row[0], []).append((row[1], row[2], row[5], row[6]))
+        alerts = {
+            budget_id: _apply_limits(conn, budget_id, entries)
+            for budget_id, entries in limited.items()
+        }
+    for budget_id in revs:
+        _budget_written(budget_id)
+        _limits_crossed(budget_id, alerts.get(budget_id, []))
+    return len(rows)
+
+
+def start_digest_run(run_key: str) -> bool:
+    with _connect() as conn:
+        _execute(
+            conn,
+            """
+            INSERT INTO digest_runs (run_key, started_at)
+            VALUES (?, ?)
+            ON CONFLICT (run_key) DO NOTHING
+            """,
+            (run_key, _now()),
+        )
+        cur = _execute(
+            conn, "SELECT finished_at FROM digest_runs WHERE run_key = ?", (run_key,)
+        )
+        return cur.fetchone()[0] is None
+
+
+def finish_digest_run(run_key: str) -> None:
+    with _connect() as conn:
+        _execute(
+            conn,
+            "UPDATE digest_runs SET finished_at = ? WHERE run_key = ?",
+            (_now(), run_key),
+        )
+
+
+def digest_aggregates(start: str, end: str) -> list[tuple[int, str, str, float, int]]:
+    rows = []
+    for shard in _shards():
+        with _connect_read_shard(shard) as conn, _transactions_source(conn, start) as source:
+            cur = _execute(
+                conn,
+                f"""
+                SELECT budget_id, t_type, COALESCE(category, ''), SUM(amount), COUNT(*)
+                FROM {source}
+                WHERE created_at >= ? AND created_at < ?
+                GROUP BY budget_id, t_type, COALESCE(category, '')
+                """,
+                (start, end),
+            )
+            rows.extend(
+                (int(row[0]), row[1], row[2], float(row[3]), int(row[4]))
+                for row in cur.fetchall()
+            )
+    return rows
+
+
+def list_digest_recipients(run_key: str) -> list[tuple[int, int]]:
+    with _connect_read() as conn:
+        cur = _execute(
+            conn,
+            """
+            SELECT telegram_id, budget_id
+            FROM users
+            WHERE digest_muted = 0
+              AND telegram_id NOT IN (
+                SELECT telegram_id FROM digest_sent WHERE run_key = ?
+              )
+            ORDER BY telegram_id ASC
+            """,
+            (run_key,),
+        )
+        return [(int(row[0]), int(row[1])) for row in cur.fetchall()]
+
+
+def mark_digest_sent(run_key: str, telegram_ids: list[int]) -> None:
+    if not telegram_ids:
+        return
+    sent_at = _now()
+    with _connect() as conn:
+        _executemany(
+            conn,
+            """
+            INSERT INTO digest_sent (run_key, telegram_id, sent_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (run_key, telegram_id) DO NOTHING
+            """,
+            [(run_key, telegram_id, sent_at) for telegram_id in telegram_ids],
+        )
+
+
+def reserve_idempotency_key(
+    telegram_id: int, key: str, endpoint: str, fingerprint: str, lease_seconds: float
+) -> tuple[str, str, str | None] | None:
+    now = datetime.utcnow()
+    with _connect() as conn:
+        cur = _execute(
+            conn,
+            """
+            INSERT INTO idempotency_keys (
+                telegram_id, idempotency_key, endpoint, fingerprint, created_at, reserved_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (telegram_id, idempotency_key) DO NOTHING
+            """,
+            (
+                telegram_id,
+                key,
+                endpoint,
+                fingerprint,
+                now.isoformat(timespec="seconds"),
+                now.isoformat(timespec="seconds"),
+            ),
+        )
+        if cur.rowcount > 0:
+            return None
+        cur = _execute(
+            conn,
+            """
+            UPDATE idempotency_keys
+            SET reserved_at = ?
+            WHERE telegram_id = ? AND idempotency_key = ?
+                AND endpoint = ? AND fingerprint = ?
+                AND response IS NULL
+                AND (reserved_at IS NULL OR reserved_at < ?)
+            """,
+            (
+                now.isoformat(timespec="seconds"),
+                telegram_id,
+                key,
+                endpoint,
+                fingerprint,
+                (now - timedelta(seconds=lease_seconds)).isoformat(timespec="seconds"),
+            ),
+        )
+        if cur.rowcount > 0:
+            return None
+        cur = _execute(
+            conn,
+            """
+            SELECT endpoint, fingerprint, response
+            FROM idempotency_keys
+            WHERE telegram_id = ? AND idempotency_key = ?
+            """,
+            (telegram_id, key),
+        )
+        return cur.fetchone()
+
+
+def complete_idempotency_key(telegram_id: int, key: str, response: str) -> None:
+    with _connect() as conn:
+        _execute(
+            conn,
+            """
+            UPDATE idempotency_keys
+            SET response = ?
+            WHERE telegram_id = ? AND idempotency_key = ?
             """,
-            (amount, description, category, transaction_id, budget_id),
+            (response, telegram_id, key),
         )
-        return cur.rowcount > 0
 
 
-def list_categories(telegram_id: int, t_type: str) -> list[str]:
+def release_idempotency_key(telegram_id: int, key: str) -> None:
     with _connect() as conn:
-        budget_id = _get_budget_id(conn, telegram_id)
-        cur = _execute(
+        _execute(
             conn,
             """
-            SELECT DISTINCT category
-            FROM transactions
-            WHERE budget_id = ? AND t_type = ? AND category IS NOT NULL AND category != ''
-            ORDER BY category ASC
+            DELETE FROM idempotency_keys
+            WHERE telegram_id = ? AND idempotency_key = ? AND response IS NULL
             """,
-            (budget_id, t_type),
+            (telegram_id, key),
         )
-        return [row[0] for row in cur.fetchall()]
 
 
-def category_summary(
-    telegram_id: int, t_type: str, start: str | None, end: str | None
+def purge_idempotency_keys(before: str, batch_size: int = 1000) -> int:
+    total = 0
+    while True:
+        with _connect() as conn:
+            cur = _execute(
+                conn,
+                """
+                DELETE FROM idempotency_keys
+                WHERE (telegram_id, idempotency_key) IN (
+                    SELECT telegram_id, idempotency_key
+                    FROM idempotency_keys
+                    WHERE created_at < ?
+                    LIMIT ?
+                )
+                """,
+                (before, batch_size),
+            )
+            deleted = cur.rowcount
+        total += max(deleted, 0)
+        if deleted < batch_size:
+            return total
+
+
+def purge_invites(before: str, batch_size: int = 1000, pause: float = 0.0) -> int:
+    total = 0
+    while True:
+        with _connect() as conn:
+            cur = _execute(
+                conn,
+                """
+                DELETE FROM invites
+                WHERE code IN (
+                    SELECT code FROM invites WHERE created_at < ? LIMIT ?
+                )
+                """,
+                (before, batch_size),
+            )
+            deleted = cur.rowcount
+        total += max(deleted, 0)
+        if deleted < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def analyze_database(limit: int = 1000) -> None:
+    if DB_KIND == "postgres":
+        with _connect() as conn:
+            _execute(conn, "ANALYZE")
+        return
+    for shard in _shards():
+        with _connect_shard(shard, directory=False) as conn:
+            conn.execute(f"PRAGMA analysis_limit = {int(limit)}")
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+            conn.execute(
+                "INSERT INTO transactions_fts (transactions_fts, rank) VALUES ('merge', 200)"
+            )
+
+
+def vacuum_step(pages: int) -> int:
+    if DB_KIND != "sqlite":
+        return 0
+    freed = 0
+    for shard in _shards():
+        with _connect_shard(shard, directory=False) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                continue
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if before:
+                conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+                freed += before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return freed
+
+
+def enable_incremental_vacuum() -> None:
+    if DB_KIND != "sqlite":
+        return
+    for shard in _shards():
+        conn = sqlite3.connect(_shard_path(shard))
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+def checkpoint_wal() -> list[tuple[int, int, int]]:
+    if DB_KIND != "sqlite":
+        return []
+    results = []
+    for shard in _shards():
+        with _connect_shard(shard, directory=False) as conn:
+            busy, log, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            results.append((int(busy), int(log), int(checkpointed)))
+    return results
+
+
+def storage_report() -> list[tuple[str, str, int]]:
+    if DB_KIND == "postgres":
+        with _connect() as conn:
+            cur = _execute(
+                conn,
+                """
+                SELECT
+                    c.relname,
+                    CASE WHEN c.relkind = 'i' THEN 'index' ELSE 'table' END,
+                    pg_total_relation_size(c.oid)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'i')
+                ORDER BY 3 DESC
+                """,
+            )
+            return [(row[0], row[1], int(row[2])) for row in cur.fetchall()]
+    report = []
+    for shard in _shards():
+        prefix = f"shard{shard}." if SHARDED else ""
+        with _connect_shard(shard, directory=False) as conn:
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT s.name, COALESCE(m.type, 'table'), s.pgsize
+                    FROM (SELECT name, pgsize FROM dbstat WHERE aggregate = TRUE) s
+                    LEFT JOIN sqlite_master m ON m.name = s.name
+                    """
+                ).fetchall()
+            except sqlite3.OperationalError:
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+                rows = [("database", "file", page_size * page_count)]
+        report.extend((prefix + name, kind, int(size)) for name, kind, size in rows)
+    return sorted(report, key=lambda row: -row[2])
+
+
+def database_files() -> list[str]:
+    if DB_KIND != "sqlite":
+        return []
+    paths = []
+    for shard in _shards():
+        paths.append(_shard_path(shard))
+        with _connect_shard(shard, directory=False) as conn:
+            paths.extend(
+                row[0]
+                for row in conn.execute("SELECT path FROM transaction_archives ORDER BY year")
+            )
+    return paths
+
+
+def database_in_use() -> bool:
+    if DB_KIND == "postgres":
+        with _connect() as conn:
+            if _execute(conn, "SELECT to_regclass('users')").fetchone()[0] is None:
+                return False
+            return bool(_execute(conn, "SELECT EXISTS (SELECT 1 FROM users)").fetchone()[0])
+    if not os.path.exists(DB_PATH):
+        return False
+    conn = sqlite3.connect(_read_only_uri(DB_PATH), uri=True)
+    try:
+        if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+        ).fetchone():
+            return False
+        return bool(conn.execute("SELECT EXISTS (SELECT 1 FROM users)").fetchone()[0])
+    finally:
+        conn.close()
+
+
+BALANCE_RESOLUTIONS = ("day", "week", "month")
+
+
+def _bucket_expr(resolution: str, value: str) -> str:
+    if resolution == "day":
+        return f"substr({value}, 1, 10)"
+    if resolution == "month":
+        return f"substr({value}, 1, 7)"
+    if DB_KIND == "postgres":
+        return f"to_char(date_trunc('week', CAST({value} AS timestamp)), 'YYYY-MM-DD')"
+    return f"date({value}, 'weekday 0', '-6 days')"
+
+
+def balance_history(
+    telegram_id: int, resolution: str, start: str | None, end: str | None
 ) -> list[tuple[str, float]]:
-    with _connect() as conn:
+    if resolution not in BALANCE_RESOLUTIONS:
+        raise ValueError("Unknown resolution")
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
-        query = """
-            SELECT COALESCE(category, 'Без категории') AS cat, SUM(amount)
-            FROM transactions
-            WHERE budget_id = ? AND t_type = ?
+        inner = f"""
+            SELECT
+                {_bucket_expr(resolution, "created_at")} AS bucket,
+                SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END) AS delta
+            FROM {{source}}
+            WHERE budget_id = ?
         """
-        params: list = [budget_id, t_type]
-        if start:
-            query += " AND created_at >= ?"
-            params.append(start)
+        params: list = [budget_id]
         if end:
-            query += " AND created_at <= ?"
+            inner += (
+                f" AND {_bucket_expr(resolution, 'created_at')}"
+                f" <= {_bucket_expr(resolution, '?')}"
+            )
             params.append(end)
-        query += " GROUP BY cat ORDER BY SUM(amount) DESC"
-        cur = _execute(conn, query, tuple(params))
-        return [(row[0] or "Без категории", float(row[1] or 0)) for row in cur.fetchall()]
+        inner += " GROUP BY bucket"
+        query = f"""
+            SELECT bucket, balance
+            FROM (
+                SELECT
+                    bucket,
+                    SUM(delta) OVER (ORDER BY bucket ROWS UNBOUNDED PRECEDING) AS balance
+                FROM ({inner}) deltas
+            ) running
+        """
+        if start:
+            query += f" WHERE bucket >= {_bucket_expr(resolution, '?')}"
+            params.append(start)
+        query += " ORDER BY bucket ASC"
+        with _transactions_source(conn) as source:
+            rows = _execute(conn, query.format(source=source), tuple(params)).fetchall()
+        return [(row[0], float(row[1])) for row in rows]
+
+
+def sync_changes(
+    telegram_id: int, since: tuple[int, int] | None, window_start: str, limit: int
+) -> dict:
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        rev, plans_rev, categories_rev, rekey_rev = _execute(
+            conn,
+            "SELECT rev, plans_rev, categories_rev, rekey_rev FROM budgets WHERE id = ?",
+            (budget_id,),
+        ).fetchone()
+        reset = (
+            since is None
+            or since[0] != budget_id
+            or since[1] > rev
+            or since[1] < rekey_rev
+        )
+        if not reset and since[1] == rev:
+            return {"budget_id": budget_id, "rev": int(rev), "reset": False, "changed": False}
+        transactions = None
+        if not reset:
+            transactions = _execute(
+                conn,
+                """
+                SELECT id, t_type, amount, description, COALESCE(added_by, ''),
+                       category, created_at
+                FROM transactions
+                WHERE budget_id = ? AND rev > ?
+                ORDER BY id ASC
+                LIMIT ?
+                """,
+                (budget_id, since[1], limit + 1),
+            ).fetchall()
+            reset = len(transactions) > limit
+        if reset:
+            transactions = _execute(
+                conn,
+                """
+                SELECT id, t_type, amount, description, COALESCE(added_by, ''),
+                       category, created_at
+                FROM transactions
+                WHERE budget_id = ? AND created_at >= ?
+                ORDER BY id ASC
+                """,
+                (budget_id, window_start),
+            ).fetchall()
+        plans = None
+        if reset or plans_rev > since[1]:
+            plans = _execute(
+                conn,
+                """
+                SELECT
+                    id,
+                    title,
+                    description,
+                    target_amount,
+                    current_amount,
+                    COALESCE(created_by, ''),
+                    created_at
+                FROM plans
+                WHERE budget_id = ?
+                ORDER BY id DESC
+                """,
+                (budget_id,),
+            ).fetchall()
+        categories = None
+        if reset or categories_rev > since[1]:
+            categories = _execute(
+                conn,
+                """
+                SELECT id, t_type, name
+                FROM categories
+                WHERE budget_id = ?
+                ORDER BY name ASC
+                """,
+                (budget_id,),
+            ).fetchall()
+        return {
+            "budget_id": budget_id,
+            "rev": int(rev),
+            "reset": reset,
+            "changed": True,
+            "balance": _budget_balance(conn, budget_id),
+            "transactions": list(transactions),
+            "plans": None if plans is None else list(plans),
+            "categories": None if categories is None else list(categories),
+        }
 
 
 def list_categories_full(telegram_id: int, t_type: str) -> list[tuple[int, str]]:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -510,10 +2591,11 @@ def list_categories_full(telegram_id: int, t_type: str) -> list[tuple[int, str]]
 
 
 def ensure_category(telegram_id: int, t_type: str, name: str) -> None:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         if DB_KIND == "postgres":
-            _execute(
+            cur = _execute(
                 conn,
                 """
                 INSERT INTO categories (budget_id, t_type, name, created_at)
@@ -522,6 +2604,8 @@ def ensure_category(telegram_id: int, t_type: str, name: str) -> None:
                 """,
                 (budget_id, t_type, name, _now()),
             )
+            if cur.rowcount > 0:
+                _bump_rev(conn, budget_id, categories=True)
             return
         try:
             _execute(
@@ -534,6 +2618,7 @@ def ensure_category(telegram_id: int, t_type: str, name: str) -> None:
             )
         except sqlite3.IntegrityError:
             return
+        _bump_rev(conn, budget_id, categories=True)
 
 
 def add_category(telegram_id: int, t_type: str, name: str) -> None:
@@ -541,7 +2626,8 @@ def add_category(telegram_id: int, t_type: str, name: str) -> None:
 
 
 def update_category(telegram_id: int, category_id: int, name: str) -> bool:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -552,26 +2638,116 @@ def update_category(telegram_id: int, category_id: int, name: str) -> bool:
             """,
             (name, category_id, budget_id),
         )
+        if cur.rowcount > 0:
+            _bump_rev(conn, budget_id, categories=True)
         return cur.rowcount > 0
 
 
 def delete_category(telegram_id: int, category_id: int) -> bool:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
             "DELETE FROM categories WHERE id = ? AND budget_id = ?",
             (category_id, budget_id),
         )
+        if cur.rowcount > 0:
+            _bump_rev(conn, budget_id, categories=True)
         return cur.rowcount > 0
 
 
+def set_category_limit(
+    telegram_id: int, category: str, amount: float, month: str | None = None
+) -> tuple[str, float, float]:
+    current = _now()[:7]
+    start = datetime.strptime(month or current, "%Y-%m")
+    month = start.strftime("%Y-%m")
+    if month < current:
+        raise ValueError("Month is in the past")
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
+        _begin_write(conn)
+        budget_id = _get_budget_id(conn, telegram_id)
+        if DB_KIND == "postgres":
+            _execute(conn, "SELECT id FROM budgets WHERE id = ? FOR UPDATE", (budget_id,))
+        amount = max(float(amount), 0.0)
+        row = _execute(
+            conn,
+            """
+            UPDATE category_limits
+            SET amount_limit = ?
+            WHERE budget_id = ? AND category = ? AND month = ?
+            RETURNING spent
+            """,
+            (amount, budget_id, category, month),
+        ).fetchone()
+        if row:
+            return month, amount, float(row[0])
+        spent = _execute(
+            conn,
+            """
+            SELECT COALESCE(SUM(amount), 0)
+            FROM transactions
+            WHERE budget_id = ? AND t_type = 'expense' AND category = ?
+                AND created_at >= ? AND created_at < ?
+            """,
+            (
+                budget_id,
+                category,
+                start.isoformat(timespec="seconds"),
+                _month_start(start, 1).isoformat(timespec="seconds"),
+            ),
+        ).fetchone()[0]
+        _execute(
+            conn,
+            """
+            INSERT INTO category_limits (
+                budget_id, category, month, amount_limit, spent, created_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (budget_id, category, month, amount, float(spent), _now()),
+        )
+        return month, amount, float(spent)
+
+
+def list_category_limits(
+    telegram_id: int, month: str | None = None
+) -> list[tuple[str, float, float]]:
+    month = month or _now()[:7]
+    with _connect_read(telegram_id) as conn:
+        budget_id = _get_budget_id(conn, telegram_id)
+        rows = _execute(
+            conn,
+            """
+            SELECT category, amount_limit, CASE WHEN month = ? THEN spent ELSE 0 END
+            FROM category_limits AS l
+            WHERE budget_id = ? AND amount_limit > 0 AND month = (
+                SELECT MAX(month)
+                FROM category_limits
+                WHERE budget_id = l.budget_id AND category = l.category AND month <= ?
+            )
+            ORDER BY category ASC
+            """,
+            (month, budget_id, month),
+        ).fetchall()
+        return [(row[0], float(row[1]), float(row[2])) for row in rows]
+
+
 def _generate_code(length: int = 8) -> str:
     alphabet = string.ascii_uppercase + string.digits
     return "".join(secrets.choice(alphabet) for _ in range(length))
 
 
+def _invite_cutoff(hours: float = INVITE_TTL_HOURS) -> str:
+    if hours <= 0:
+        return ""
+    return (datetime.utcnow() - timedelta(hours=hours)).isoformat(timespec="seconds")
+
+
 def create_invite(telegram_id: int) -> str:
+    _pin(telegram_id)
     with _connect() as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         _execute(
@@ -610,26 +2786,28 @@ def create_invite(telegram_id: int) -> str:
 
 
 def use_invite(telegram_id: int, code: str) -> bool:
+    _pin(telegram_id)
     with _connect() as conn:
+        _begin_write(conn)
         cur = _execute(
-            conn, "SELECT budget_id, used_by FROM invites WHERE code = ?", (code,)
+            conn,
+            """
+            UPDATE invites
+            SET used_by = ?, used_at = ?
+            WHERE code = ? AND used_by IS NULL AND created_at >= ?
+            RETURNING budget_id
+            """,
+            (telegram_id, _now(), code, _invite_cutoff()),
         )
         row = cur.fetchone()
         if not row:
             return False
-        budget_id, used_by = row
-        if used_by is not None:
-            return False
+        budget_id = row[0]
         _execute(
             conn,
             "UPDATE users SET budget_id = ?, shared_budget_id = ? WHERE telegram_id = ?",
             (budget_id, budget_id, telegram_id),
         )
-        _execute(
-            conn,
-            "UPDATE invites SET used_by = ?, used_at = ? WHERE code = ?",
-            (telegram_id, _now(), code),
-        )
         _execute(
             conn,
             "UPDATE users SET shared_budget_id = ? WHERE budget_id = ?",
@@ -639,11 +2817,15 @@ def use_invite(telegram_id: int, code: str) -> bool:
 
 
 def leave_budget(telegram_id: int) -> None:
+    _pin(telegram_id)
+    lock = " FOR UPDATE" if DB_KIND == "postgres" else ""
     with _connect() as conn:
-        cur = _execute(
-            conn, "SELECT personal_budget_id FROM users WHERE telegram_id = ?", (telegram_id,)
-        )
-        row = cur.fetchone()
+        _begin_write(conn)
+        row = _execute(
+            conn,
+            f"SELECT personal_budget_id FROM users WHERE telegram_id = ?{lock}",
+            (telegram_id,),
+        ).fetchone()
         if not row:
             return
         personal_budget_id = row[0]
@@ -671,7 +2853,8 @@ def _get_budget_owner(conn, budget_id: int) -> int | None:
 def add_plan(
     telegram_id: int, title: str, description: str, target_amount: float, created_by: str
 ) -> None:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         _execute(
             conn,
@@ -689,12 +2872,14 @@ def add_plan(
             """,
             (budget_id, title, description, target_amount, 0.0, created_by, _now()),
         )
+        _bump_rev(conn, budget_id, plans=True)
+    _budget_written(budget_id)
 
 
 def list_plans(
     telegram_id: int,
 ) -> list[tuple[int, str, str, float, float, str, str]]:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -719,7 +2904,7 @@ def list_plans(
 def get_plan(
     telegram_id: int, plan_id: int
 ) -> tuple[int, str, str, float, float, str, str] | None:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -743,7 +2928,8 @@ def get_plan(
 def update_plan(
     telegram_id: int, plan_id: int, title: str, description: str, target_amount: float
 ) -> bool:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -754,11 +2940,17 @@ def update_plan(
             """,
             (title, description, target_amount, plan_id, budget_id),
         )
-        return cur.rowcount > 0
+        updated = cur.rowcount > 0
+        if updated:
+            _bump_rev(conn, budget_id, plans=True)
+    if updated:
+        _budget_written(budget_id)
+    return updated
 
 
 def deposit_plan(telegram_id: int, plan_id: int, amount: float) -> bool:
-    with _connect() as conn:
+    _pin(telegram_id)
+    with _connect(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         cur = _execute(
             conn,
@@ -769,11 +2961,16 @@ def deposit_plan(telegram_id: int, plan_id: int, amount: float) -> bool:
             """,
             (amount, plan_id, budget_id),
         )
-        return cur.rowcount > 0
+        updated = cur.rowcount > 0
+        if updated:
+            _bump_rev(conn, budget_id, plans=True)
+    if updated:
+        _budget_written(budget_id)
+    return updated
 
 
 def get_budget_users(telegram_id: int, use_shared: bool) -> list[tuple[int, str]]:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         cur = _execute(
             conn,
             "SELECT personal_budget_id, shared_budget_id FROM users WHERE telegram_id = ?",
@@ -811,8 +3008,63 @@ def get_budget_users(telegram_id: int, use_shared: bool) -> list[tuple[int, str]
         return list(cur.fetchall())
 
 
-def get_budget_state(telegram_id: int) -> tuple[int | None, int | None, int | None]:
+def list_notify_recipients(budget_id: int) -> list[int]:
+    with _connect_read() as conn:
+        cur = _execute(
+            conn,
+            """
+            SELECT telegram_id
+            FROM users
+            WHERE (budget_id = ? OR shared_budget_id = ?) AND notify_muted = 0
+            ORDER BY telegram_id ASC
+            """,
+            (budget_id, budget_id),
+        )
+        return [int(row[0]) for row in cur.fetchall()]
+
+
+def set_notify_muted(telegram_id: int, muted: bool) -> None:
+    _pin(telegram_id)
+    with _connect() as conn:
+        _execute(
+            conn,
+            "UPDATE users SET notify_muted = ? WHERE telegram_id = ?",
+            (1 if muted else 0, telegram_id),
+        )
+
+
+def set_digest_muted(telegram_id: int, muted: bool) -> None:
+    _pin(telegram_id)
     with _connect() as conn:
+        _execute(
+            conn,
+            "UPDATE users SET digest_muted = ? WHERE telegram_id = ?",
+            (1 if muted else 0, telegram_id),
+        )
+
+
+def get_active_budget_id(telegram_id: int) -> int:
+    with _connect_read(telegram_id) as conn:
+        return _get_budget_id(conn, telegram_id)
+
+
+def load_transaction_columns(budget_id: int) -> list[tuple[str, float, str, str]]:
+    with _connect_read(budget_id=budget_id) as conn, _transactions_source(conn) as source:
+        cur = _execute(
+            conn,
+            f"""
+            SELECT t_type, amount, created_at, COALESCE(category, '')
+            FROM {source}
+            WHERE budget_id = ?
+            ORDER BY created_at ASC
+            """,
+            (budget_id,),
+        )
+        return list(cur.fetchall())
+
+
+def get_budget_state(telegram_id: int) -> tuple[int | None, int | None, int | None]:
+    with _connect_read(telegram_id) as conn:
         cur = _execute(
             conn,
             """
@@ -829,68 +3081,69 @@ def get_budget_state(telegram_id: int) -> tuple[int | None, int | None, int | No
 
 
 def switch_budget(telegram_id: int, mode: str) -> bool:
+    _pin(telegram_id)
     with _connect() as conn:
-        cur = _execute(
+        _begin_write(conn)
+        if mode == "shared":
+            cur = _execute(
+                conn,
+                """
+                UPDATE users
+                SET budget_id = shared_budget_id
+                WHERE telegram_id = ? AND shared_budget_id IS NOT NULL
+                """,
+                (telegram_id,),
+            )
+            return cur.rowcount > 0
+        if mode != "personal":
+            return False
+        lock = " FOR UPDATE" if DB_KIND == "postgres" else ""
+        row = _execute(
             conn,
-            """
-            SELECT personal_budget_id, shared_budget_id
-            FROM users
-            WHERE telegram_id = ?
-            """,
+            f"SELECT personal_budget_id, shared_budget_id FROM users WHERE telegram_id = ?{lock}",
             (telegram_id,),
-        )
-        row = cur.fetchone()
+        ).fetchone()
         if not row:
             return False
         personal_budget_id, shared_budget_id = row
-        if mode == "personal":
-            if personal_budget_id is None:
-                personal_budget_id = _create_budget(conn, telegram_id)
-            if shared_budget_id and personal_budget_id == shared_budget_id:
-                personal_budget_id = _create_budget(conn, telegram_id)
-            _execute(
-                conn,
-                "UPDATE users SET budget_id = ?, personal_budget_id = ? WHERE telegram_id = ?",
-                (personal_budget_id, personal_budget_id, telegram_id),
-            )
-            return True
-        if mode == "shared":
-            if shared_budget_id is None:
-                return False
-            _execute(
-                conn,
-                "UPDATE users SET budget_id = ? WHERE telegram_id = ?",
-                (shared_budget_id, telegram_id),
-            )
-            return True
-        return False
+        if personal_budget_id is None or personal_budget_id == shared_budget_id:
+            personal_budget_id = _create_budget(conn, telegram_id)
+        _execute(
+            conn,
+            "UPDATE users SET budget_id = ?, personal_budget_id = ? WHERE telegram_id = ?",
+            (personal_budget_id, personal_budget_id, telegram_id),
+        )
+        return True
 
 
 def get_budget_owner_id(telegram_id: int) -> int | None:
-    with _connect() as conn:
+    with _connect_read(telegram_id) as conn:
         budget_id = _get_budget_id(conn, telegram_id)
         return _get_budget_owner(conn, budget_id)
 
 
 def remove_user_from_budget(owner_id: int, target_telegram_id: int) -> bool:
+    _pin(owner_id, target_telegram_id)
+    if target_telegram_id == owner_id:
+        return False
+    lock = " FOR UPDATE" if DB_KIND == "postgres" else ""
     with _connect() as conn:
-        owner_budget_id = _get_budget_id(conn, owner_id)
-        owner_of_budget = _get_budget_owner(conn, owner_budget_id)
-        if owner_of_budget != owner_id:
-            return False
-        target_budget_id = _get_budget_id(conn, target_telegram_id)
-        if target_budget_id != owner_budget_id:
-            return False
-        if target_telegram_id == owner_id:
-            return False
-        cur = _execute(
+        _begin_write(conn)
+        row = _execute(
             conn,
-            "SELECT personal_budget_id FROM users WHERE telegram_id = ?",
-            (target_telegram_id,),
-        )
-        row = cur.fetchone()
-        personal_budget_id = row[0] if row else None
-        if personal_budget_id is None:
+            f"""
+            SELECT budget_id, personal_budget_id
+            FROM users
+            WHERE telegram_id = ?
+                AND budget_id = (SELECT budget_id FROM users WHERE telegram_id = ?)
+                AND budget_id IN (SELECT id FROM budgets WHERE owner_id = ?){lock}
+            """,
+            (target_telegram_id, owner_id, owner_id),
+        ).fetchone()
+        if not row:
+            return False
+        budget_id, personal_budget_id = row
+        if personal_budget_id is None or personal_budget_id == budget_id:
             personal_budget_id = _create_budget(conn, target_telegram_id)
         _execute(
             conn,
@@ -902,3 +3155,132 @@ def remove_user_from_budget(owner_id: int, target_telegram_id: int) -> bool:
             (personal_budget_id, personal_budget_id, target_telegram_id),
         )
         return True
+
+
+def _table_columns(conn, schema: str, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def move_budget(budget_id: int, target: int) -> int:
+    if not SHARDED:
+        raise RuntimeError("Sharding is disabled")
+    if not 0 <= target < DB_SHARDS:
+        raise ValueError("Unknown shard")
+    source = _shard_for(budget_id=budget_id)
+    if source == target:
+        return 0
+    conn = sqlite3.connect(_shard_path(source))
+    attached = ["target"]
+    try:
+        conn.execute("ATTACH DATABASE ? AS target", (_shard_path(target),))
+        directory = "main" if source == 0 else "target" if target == 0 else "directory"
+        if directory == "directory":
+            conn.execute("ATTACH DATABASE ? AS directory", (DB_PATH,))
+            attached.append("directory")
+        archives = conn.execute(
+            """
+            SELECT year, path, archived_until
+            FROM main.transaction_archives
+            WHERE archived_until IS NOT NULL
+            """
+        ).fetchall()
+        for year, path, _ in archives:
+            conn.execute(f"ATTACH DATABASE ? AS archive_{int(year)}", (path,))
+            attached.append(f"archive_{int(year)}")
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT rev FROM main.budgets WHERE id = ?", (budget_id,)).fetchone()
+        if row is None:
+            raise RuntimeError("Budget not found")
+        rev = int(row[0]) + 1
+        columns = ", ".join(_table_columns(conn, "main", "budgets"))
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO target.budgets ({columns})
+            SELECT {columns} FROM main.budgets WHERE id = ?
+            """,
+            (budget_id,),
+        )
+        conn.execute(
+            "UPDATE target.budgets SET rev = ?, rekey_rev = ? WHERE id = ?",
+            (rev, rev, budget_id),
+        )
+        for table in ("categories", "plans", "recurring_rules", "category_limits"):
+            columns = ", ".join(
+                column for column in _table_columns(conn, "main", table) if column != "id"
+            )
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO target.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE budget_id = ? ORDER BY id
+                """,
+                (budget_id,),
+            )
+            conn.execute(f"DELETE FROM main.{table} WHERE budget_id = ?", (budget_id,))
+        columns = ", ".join(
+            column
+            for column in TRANSACTION_COLUMNS.split(", ")
+            if column not in ("id", "rev")
+        )
+        parts = [f"SELECT {TRANSACTION_COLUMNS} FROM main.transactions WHERE budget_id = ?"]
+        params: list = [budget_id]
+        for year, _, until in archives:
+            parts.append(
+                f"SELECT {TRANSACTION_COLUMNS} FROM archive_{int(year)}.transactions "
+                "WHERE budget_id = ? AND created_at < ?"
+            )
+            params.extend((budget_id, until))
+        moved = conn.execute(
+            f"""
+            INSERT INTO target.transactions ({columns}, rev)
+            SELECT {columns}, ? FROM ({" UNION ALL ".join(parts)}) ORDER BY id
+            """,
+            (rev, *params),
+        ).rowcount
+        conn.execute("DELETE FROM main.transactions WHERE budget_id = ?", (budget_id,))
+        for year, _, _ in archives:
+            count = conn.execute(
+                f"DELETE FROM archive_{int(year)}.transactions WHERE budget_id = ?",
+                (budget_id,),
+            ).rowcount
+            conn.execute(
+                "UPDATE main.transaction_archives SET row_count = row_count - ? WHERE year = ?",
+                (count, year),
+            )
+        conn.execute("DELETE FROM main.archive_balances WHERE budget_id = ?", (budget_id,))
+        if source != 0:
+            conn.execute("DELETE FROM main.budgets WHERE id = ?", (budget_id,))
+        conn.execute(
+            f"""
+            INSERT INTO {directory}.budget_shards (budget_id, shard)
+            VALUES (?, ?)
+            ON CONFLICT (budget_id) DO UPDATE SET shard = excluded.shard
+            """,
+            (budget_id, target),
+        )
+        conn.commit()
+    finally:
+        conn.rollback()
+        for name in attached:
+            conn.execute(f"DETACH DATABASE {name}")
+        conn.close()
+    _budget_written(budget_id)
+    return moved
+
+
+def shard_stats() -> list[tuple[int, int, int]]:
+    with _connect() as conn:
+        placed = dict(
+            _execute(
+                conn, "SELECT shard, COUNT(*) FROM budget_shards GROUP BY shard"
+            ).fetchall()
+        )
+        total = _execute(conn, "SELECT COUNT(*) FROM budgets").fetchone()[0]
+    stats = []
+    for shard in _shards():
+        with _connect_shard(shard, directory=False) as conn:
+            transactions = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        budgets = placed.get(shard, 0)
+        if shard == 0:
+            budgets = total - sum(count for key, count in placed.items() if key != 0)
+        stats.append((shard, int(budgets), int(transactions)))
+    return stats
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden
+
+from db import (
+    digest_aggregates,
+    finish_digest_run,
+    list_digest_recipients,
+    mark_digest_sent,
+    start_digest_run,
+)
+
+DIGEST_PERIOD = os.getenv("DIGEST_PERIOD", "week").strip().lower()
+DIGEST_CHECK_SECONDS = float(os.getenv("DIGEST_CHECK_SECONDS", "3600"))
+DIGEST_TOP_CATEGORIES = int(os.getenv("DIGEST_TOP_CATEGORIES", "3"))
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "20"))
+DIGEST_PERIODS = ("week", "month")
+UNCATEGORIZED = "Без категории"
+
+logger = logging.getLogger(__name__)
+
+
+def digest_window(period: str, now: datetime) -> tuple[str, datetime, datetime]:
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        end = today - timedelta(days=today.weekday())
+        start = end - timedelta(days=7)
+        year, week, _ = start.isocalendar()
+        return f"week:{year}-W{week:02d}", start, end
+    if period == "month":
+        end = today.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        return f"month:{start:%Y-%m}", start, end
+    raise ValueError(f"Unknown digest period: {period}")
+
+
+def build_reports(
+    rows: list[tuple[int, str, str, float, int]], top: int = DIGEST_TOP_CATEGORIES
+) -> dict[int, dict]:
+    reports: dict[int, dict] = {}
+    for budget_id, t_type, category, total, count in rows:
+        report = reports.setdefault(
+            budget_id, {"income": 0.0, "expense": 0.0, "count": 0, "categories": {}}
+        )
+        report[t_type] = report.get(t_type, 0.0) + total
+        report["count"] += count
+        if t_type == "expense":
+            name = category or UNCATEGORIZED
+            report["categories"][name] = report["categories"].get(name, 0.0) + total
+    for report in reports.values():
+        report["categories"] = sorted(
+            report["categories"].items(), key=lambda item: (-item[1], item[0])
+        )[:top]
+    return reports
+
+
+def render_report(period: str, start: datetime, end: datetime, report: dict) -> str:
+    label = "неделю" if period == "week" else "месяц"
+    last_day = end - timedelta(days=1)
+    lines = [
+        f"Итоги за {label} {start:%d.%m}–{last_day:%d.%m.%Y}",
+        f"Доходы: {report['income']:.2f}",
+        f"Расходы: {report['expense']:.2f}",
+        f"Разница: {report['income'] - report['expense']:.2f}",
+        f"Записей: {report['count']}",
+    ]
+    if report["categories"]:
+        lines.append("Больше всего трат:")
+        lines.extend(
+            f"{i}. {name} — {total:.2f}"
+            for i, (name, total) in enumerate(report["categories"], start=1)
+        )
+    return "\n".join(lines)
+
+
+async def run_digest(
+    send, period: str = DIGEST_PERIOD, now: datetime | None = None
+) -> int:
+    now = now or datetime.utcnow()
+    run_key, start, end = digest_window(period, now)
+    if not await asyncio.to_thread(start_digest_run, run_key):
+        return 0
+    rows = await asyncio.to_thread(
+        digest_aggregates,
+        start.isoformat(timespec="seconds"),
+        end.isoformat(timespec="seconds"),
+    )
+    reports = build_reports(rows)
+    texts = {
+        budget_id: render_report(period, start, end, report)
+        for budget_id, report in reports.items()
+    }
+    recipients = [
+        (telegram_id, budget_id)
+        for telegram_id, budget_id in await asyncio.to_thread(
+            list_digest_recipients, run_key
+        )
+        if budget_id in texts
+    ]
+    async def deliver(telegram_id: int, budget_id: int) -> None:
+        try:
+            await send(telegram_id, texts[budget_id])
+        except Forbidden:
+            pass
+        await asyncio.to_thread(mark_digest_sent, run_key, [telegram_id])
+
+    sent = 0
+    failed = 0
+    for i in range(0, len(recipients), max(1, DIGEST_BATCH_SIZE)):
+        chunk = recipients[i : i + max(1, DIGEST_BATCH_SIZE)]
+        results = await asyncio.gather(
+            *(deliver(telegram_id, budget_id) for telegram_id, budget_id in chunk),
+            return_exceptions=True,
+        )
+        for (telegram_id, _), result in zip(chunk, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logger.warning("Digest to %s failed: %s", telegram_id, result)
+            else:
+                sent += 1
+    if not failed:
+        await asyncio.to_thread(finish_digest_run, run_key)
+    return sent
+
+
+def digest_job(send):
+    async def job() -> None:
+        if DIGEST_PERIOD not in DIGEST_PERIODS:
+            return
+        sent = await run_digest(send)
+        if sent:
+            logger.info("Sent %s digest messages", sent)
+
+    return job
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from db import (
+    INVITE_TTL_HOURS,
+    analyze_database,
+    checkpoint_wal,
+    purge_invites,
+    storage_report,
+    vacuum_step,
+)
+
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "86400"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_PAUSE_SECONDS = float(os.getenv("MAINTENANCE_PAUSE_SECONDS", "0.05"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "256"))
+MAINTENANCE_MAX_VACUUM_STEPS = int(os.getenv("MAINTENANCE_MAX_VACUUM_STEPS", "400"))
+MAINTENANCE_REPORT_TOP = int(os.getenv("MAINTENANCE_REPORT_TOP", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+def run_maintenance(now: datetime | None = None, report: bool = True) -> dict:
+    now = now or datetime.utcnow()
+    started = time.monotonic()
+    result: dict = {"invites_purged": 0, "vacuumed_pages": 0}
+    if INVITE_TTL_HOURS > 0:
+        before = now - timedelta(hours=INVITE_TTL_HOURS)
+        result["invites_purged"] = purge_invites(
+            before.isoformat(timespec="seconds"),
+            MAINTENANCE_BATCH_SIZE,
+            MAINTENANCE_PAUSE_SECONDS,
+        )
+    analyze_database()
+    for _ in range(MAINTENANCE_MAX_VACUUM_STEPS):
+        freed = vacuum_step(MAINTENANCE_VACUUM_PAGES)
+        result["vacuumed_pages"] += freed
+        if freed <= 0:
+            break
+        time.sleep(MAINTENANCE_PAUSE_SECONDS)
+    result["checkpoint"] = checkpoint_wal()
+    if report:
+        result["sizes"] = storage_report()
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    value = size / 1024
+    for unit in ("KB", "MB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB"
+
+
+async def run_maintenance_job() -> None:
+    result = await asyncio.to_thread(run_maintenance)
+    largest = ", ".join(
+        f"{name}={format_size(size)}"
+        for name, _, size in result.get("sizes", [])[:MAINTENANCE_REPORT_TOP]
+    )
+    logger.info(
+        "Maintenance finished in %ss: purged %s invites, vacuumed %s pages; largest: %s",
+        result["seconds"],
+        result["invites_purged"],
+        result["vacuumed_pages"],
+        largest or "-",
+    )
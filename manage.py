@@ -0,0 +1,121 @@
+import argparse
+import logging
+
+from backup import BACKUP_DIR, create_backup, list_backups, restore_backup
+from db import enable_incremental_vacuum, init_db, move_budget, shard_stats
+from maintenance import format_size, run_maintenance
+from migrate import MIGRATE_CHUNK_ROWS, MIGRATE_WORKERS, run_migration, verify_migration
+
+
+def cmd_shards(args: argparse.Namespace) -> None:
+    for shard, budgets, transactions in shard_stats():
+        print(f"shard {shard}: budgets={budgets} transactions={transactions}")
+
+
+def cmd_rebalance(args: argparse.Namespace) -> None:
+    moved = move_budget(args.budget_id, args.shard)
+    print(f"Moved budget {args.budget_id} to shard {args.shard} ({moved} transactions)")
+
+
+def cmd_maintenance(args: argparse.Namespace) -> None:
+    if args.full_vacuum:
+        enable_incremental_vacuum()
+    result = run_maintenance(report=not args.no_report)
+    print(f"Purged invites: {result['invites_purged']}")
+    print(f"Vacuumed pages: {result['vacuumed_pages']}")
+    for busy, log, checkpointed in result["checkpoint"]:
+        print(f"WAL checkpoint: busy={busy} log={log} checkpointed={checkpointed}")
+    for name, kind, size in result.get("sizes", []):
+        print(f"{format_size(size):>10}  {kind:<5}  {name}")
+    print(f"Finished in {result['seconds']}s")
+
+
+def cmd_backup(args: argparse.Namespace) -> None:
+    path = create_backup(args.dir)
+    if path is None:
+        print("Another backup is already running")
+        return
+    print(f"Backup written to {path}")
+
+
+def cmd_backups(args: argparse.Namespace) -> None:
+    for path in list_backups(args.dir):
+        print(path)
+
+
+def cmd_restore(args: argparse.Namespace) -> None:
+    restored = restore_backup(args.path, args.destination, args.verify_only)
+    action = "Verified" if args.verify_only else "Restored"
+    for path in restored:
+        print(f"{action} {path}")
+
+
+def cmd_migrate(args: argparse.Namespace) -> None:
+    if not args.verify_only:
+        result = run_migration(args.workers, args.chunk_rows)
+        for table, rows in result.items():
+            print(f"{table}: {rows}")
+    problems = verify_migration()
+    for problem in problems:
+        print(f"MISMATCH {problem}")
+    if problems:
+        raise SystemExit(1)
+    print("Row counts and budget balances match")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Database management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    shards = commands.add_parser("shards", help="show budgets and transactions per shard")
+    shards.set_defaults(handler=cmd_shards)
+    rebalance = commands.add_parser("rebalance", help="move a budget to another shard")
+    rebalance.add_argument("budget_id", type=int)
+    rebalance.add_argument("shard", type=int)
+    rebalance.set_defaults(handler=cmd_rebalance)
+    maintenance = commands.add_parser(
+        "maintenance", help="purge expired invites, refresh statistics, vacuum and report sizes"
+    )
+    maintenance.add_argument(
+        "--full-vacuum",
+        action="store_true",
+        help="rebuild SQLite files once to enable incremental vacuum (blocks writes)",
+    )
+    maintenance.add_argument("--no-report", action="store_true", help="skip the size report")
+    maintenance.set_defaults(handler=cmd_maintenance)
+    backup = commands.add_parser("backup", help="write an online backup of the SQLite files")
+    backup.add_argument("--dir", default=BACKUP_DIR, help="backup directory (BACKUP_DIR)")
+    backup.set_defaults(handler=cmd_backup)
+    backups = commands.add_parser("backups", help="list available backups")
+    backups.add_argument("--dir", default=BACKUP_DIR, help="backup directory (BACKUP_DIR)")
+    backups.set_defaults(handler=cmd_backups)
+    restore = commands.add_parser(
+        "restore", help="verify and restore a backup (stop the bot and server first)"
+    )
+    restore.add_argument("path", help="backup directory containing manifest.json")
+    restore.add_argument(
+        "--destination", help="restore into this directory instead of the original paths"
+    )
+    restore.add_argument(
+        "--verify-only", action="store_true", help="check checksums and integrity only"
+    )
+    restore.set_defaults(handler=cmd_restore)
+    migrate = commands.add_parser(
+        "migrate",
+        help="copy DB_PATH into the PostgreSQL DATABASE_URL; rerun to catch up before cut-over",
+    )
+    migrate.add_argument("--workers", type=int, default=MIGRATE_WORKERS)
+    migrate.add_argument("--chunk-rows", type=int, default=MIGRATE_CHUNK_ROWS)
+    migrate.add_argument(
+        "--verify-only", action="store_true", help="only compare row counts and balances"
+    )
+    migrate.set_defaults(handler=cmd_migrate)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command != "restore":
+        init_db()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psycopg
+except ImportError:  # pragma: no cover - handled by runtime requirements
+    psycopg = None
+
+from db import DB_KIND, DB_PATH, DB_URL, TRANSACTION_COLUMNS, shard_file
+
+MIGRATE_WORKERS = int(os.getenv("MIGRATE_WORKERS", "4"))
+MIGRATE_CHUNK_ROWS = int(os.getenv("MIGRATE_CHUNK_ROWS", "20000"))
+MIGRATE_ID_HEADROOM = int(os.getenv("MIGRATE_ID_HEADROOM", "1000000"))
+DIRECTORY_TABLES = ("users", "invites", "digest_runs", "digest_sent", "idempotency_keys")
+BUDGET_TABLES = ("categories", "plans", "recurring_rules", "category_limits")
+REKEYED_TABLES = ("transactions", *BUDGET_TABLES)
+SERIAL_TABLES = ("budgets", *REKEYED_TABLES)
+
+logger = logging.getLogger(__name__)
+
+
+def source_shards(path: str = DB_PATH) -> dict[int, str]:
+    if not os.path.exists(path):
+        raise RuntimeError(f"SQLite database not found: {path}")
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT DISTINCT shard FROM budget_shards").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    return {shard: shard_file(path, shard) for shard in sorted({0, *(row[0] for row in rows)})}
+
+
+def _shard_filter(shards: dict[int, str], shard: int, column: str) -> str:
+    if shard or len(shards) == 1:
+        return ""
+    return f"WHERE {column} NOT IN (SELECT budget_id FROM budget_shards WHERE shard != 0)"
+
+
+def _open_source(path: str):
+    conn = sqlite3.connect(path, isolation_level=None)
+    parts = [f"SELECT {TRANSACTION_COLUMNS} FROM main.transactions"]
+    for year, archive, until in conn.execute(
+        """
+        SELECT year, path, archived_until
+        FROM transaction_archives
+        WHERE archived_until IS NOT NULL
+        ORDER BY year
+        """
+    ).fetchall():
+        conn.execute(f"ATTACH DATABASE ? AS archive_{int(year)}", (archive,))
+        parts.append(
+            f"SELECT {TRANSACTION_COLUMNS} FROM archive_{int(year)}.transactions "
+            f"WHERE created_at < '{until.replace(chr(39), '')}'"
+        )
+    conn.execute(
+        f"CREATE TEMP VIEW migrate_transactions AS {' UNION ALL '.join(parts)}"
+    )
+    return conn
+
+
+def _connect_target():
+    if DB_KIND != "postgres" or psycopg is None:
+        raise RuntimeError("Set DATABASE_URL to the target PostgreSQL database")
+    return psycopg.connect(DB_URL, autocommit=True)
+
+
+def _target_columns(pg, table: str) -> list[str]:
+    return [
+        row[0]
+        for row in pg.execute(
+            """
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+                AND table_name = %s
+                AND is_generated = 'NEVER'
+            ORDER BY ordinal_position
+            """,
+            (table,),
+        ).fetchall()
+    ]
+
+
+def _columns(src, pg, table: str) -> list[str]:
+    target = set(_target_columns(pg, table))
+    return [row[1] for row in src.execute(f"PRAGMA table_info({table})") if row[1] in target]
+
+
+def _copy(pg, table: str, columns: list[str], rows, shift=None) -> int:
+    count = 0
+    with pg.cursor().copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(shift(row) if shift else row)
+            count += 1
+    return count
+
+
+def _shift_ids(columns: list[str], offset: int):
+    if not offset:
+        return None
+    index = columns.index("id")
+
+    def shift(row: tuple) -> tuple:
+        row = list(row)
+        row[index] += offset
+        return row
+
+    return shift
+
+
+def _rekey_budgets(columns: list[str]):
+    rev = columns.index("rev")
+    rekey = columns.index("rekey_rev")
+
+    def shift(row: tuple) -> tuple:
+        row = list(row)
+        row[rev] += 1
+        row[rekey] = row[rev]
+        return row
+
+    return shift
+
+
+def _max_id(path: str, table: str) -> int:
+    conn = _open_source(path) if table == "transactions" else sqlite3.connect(path)
+    try:
+        source = "migrate_transactions" if table == "transactions" else table
+        return int(conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {source}").fetchone()[0])
+    finally:
+        conn.close()
+
+
+def _prepare_state(pg, shards: dict[int, str]) -> dict[tuple[str, int], tuple[int, int]]:
+    with pg.transaction():
+        pg.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migration_state (
+                tbl TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                id_offset BIGINT NOT NULL,
+                last_id BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (tbl, shard)
+            )
+            """
+        )
+        pg.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migration_budgets (
+                budget_id INTEGER PRIMARY KEY,
+                rev BIGINT NOT NULL
+            )
+            """
+        )
+        state = {
+            (table, shard): (int(offset), int(last_id))
+            for table, shard, offset, last_id in pg.execute(
+                "SELECT tbl, shard, id_offset, last_id FROM migration_state"
+            ).fetchall()
+        }
+        for table in REKEYED_TABLES:
+            floor = 0
+            for shard, path in shards.items():
+                if (table, shard) not in state:
+                    offset = floor + MIGRATE_ID_HEADROOM if floor else 0
+                    state[(table, shard)] = (offset, 0)
+                    pg.execute(
+                        "INSERT INTO migration_state (tbl, shard, id_offset) VALUES (%s, %s, %s)",
+                        (table, shard, offset),
+                    )
+                offset = state[(table, shard)][0]
+                if floor and offset <= floor:
+                    raise RuntimeError(
+                        f"{table} ids on shard {shard - 1} outgrew the migration offset; "
+                        "raise MIGRATE_ID_HEADROOM and migrate into an empty database"
+                    )
+                floor = offset + _max_id(path, table)
+    return state
+
+
+def _refresh_directory_table(shards: dict[int, str], table: str) -> int:
+    src = sqlite3.connect(shards[0])
+    try:
+        with _connect_target() as pg, pg.transaction():
+            columns = _columns(src, pg, table)
+            pg.execute(f"DELETE FROM {table}")
+            return _copy(
+                pg, table, columns, src.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            )
+    finally:
+        src.close()
+
+
+def _refresh_budget_table(shards: dict[int, str], state: dict, table: str) -> int:
+    copied = 0
+    with _connect_target() as pg, pg.transaction():
+        pg.execute(f"DELETE FROM {table}")
+        for shard, path in shards.items():
+            src = sqlite3.connect(path)
+            try:
+                columns = _columns(src, pg, table)
+                copied += _copy(
+                    pg,
+                    table,
+                    columns,
+                    src.execute(
+                        f"SELECT {', '.join(columns)} FROM {table} "
+                        + _shard_filter(shards, shard, "budget_id")
+                    ),
+                    _shift_ids(columns, state[(table, shard)][0]),
+                )
+            finally:
+                src.close()
+    return copied
+
+
+def _refresh_budgets(shards: dict[int, str]) -> int:
+    copied = 0
+    with _connect_target() as pg, pg.transaction():
+        pg.execute("DELETE FROM budgets")
+        pg.execute("DELETE FROM migration_budgets")
+        for shard, path in shards.items():
+            src = sqlite3.connect(path, isolation_level=None)
+            try:
+                src.execute("BEGIN")
+                columns = _columns(src, pg, "budgets")
+                copied += _copy(
+                    pg,
+                    "budgets",
+                    columns,
+                    src.execute(
+                        f"SELECT {', '.join(columns)} FROM budgets {_shard_filter(shards, shard, 'id')}"
+                    ),
+                    _rekey_budgets(columns) if shard else None,
+                )
+                _copy(
+                    pg,
+                    "migration_budgets",
+                    ["budget_id", "rev"],
+                    src.execute(f"SELECT id, rev FROM budgets {_shard_filter(shards, shard, 'id')}"),
+                )
+                src.execute("COMMIT")
+            finally:
+                src.close()
+    return copied
+
+
+def _sync_transactions(
+    shards: dict[int, str],
+    shard: int,
+    offset: int,
+    last_id: int,
+    revs: dict[int, int],
+    chunk_rows: int,
+) -> tuple[int, int]:
+    src = _open_source(shards[shard])
+    updated = copied = 0
+    try:
+        with _connect_target() as pg:
+            target = set(_target_columns(pg, "transactions"))
+            columns = [column for column in TRANSACTION_COLUMNS.split(", ") if column in target]
+            select = f"SELECT {', '.join(columns)} FROM migrate_transactions"
+            shift = _shift_ids(columns, offset)
+            changed = [
+                (budget_id, revs[budget_id])
+                for budget_id, rev in src.execute(
+                    f"SELECT id, rev FROM budgets {_shard_filter(shards, shard, 'id')}"
+                ).fetchall()
+                if budget_id in revs and rev > revs[budget_id]
+            ]
+            if changed and last_id:
+                with pg.transaction():
+                    pg.execute(
+                        f"""
+                        CREATE TEMP TABLE migrate_stage ON COMMIT DROP AS
+                        SELECT {', '.join(columns)} FROM transactions WITH NO DATA
+                        """
+                    )
+                    updated = _copy(
+                        pg,
+                        "migrate_stage",
+                        columns,
+                        (
+                            row
+                            for budget_id, rev in changed
+                            for row in src.execute(
+                                f"{select} WHERE budget_id = ? AND rev > ? AND id <= ?",
+                                (budget_id, rev, last_id),
+                            )
+                        ),
+                        shift,
+                    )
+                    pg.execute(
+                        "DELETE FROM transactions t USING migrate_stage s WHERE t.id = s.id"
+                    )
+                    pg.execute(
+                        f"""
+                        INSERT INTO transactions ({', '.join(columns)})
+                        SELECT {', '.join(columns)} FROM migrate_stage
+                        """
+                    )
+            while True:
+                rows = src.execute(
+                    f"{select} WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_rows)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                with pg.transaction():
+                    copied += _copy(pg, "transactions", columns, rows, shift)
+                    pg.execute(
+                        """
+                        UPDATE migration_state SET last_id = %s
+                        WHERE tbl = 'transactions' AND shard = %s
+                        """,
+                        (last_id, shard),
+                    )
+                if len(rows) < chunk_rows:
+                    break
+    finally:
+        src.close()
+    return copied, updated
+
+
+def _fix_sequences(pg) -> None:
+    with pg.transaction():
+        for table in SERIAL_TABLES:
+            pg.execute(
+                f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{table}', 'id'),
+                    COALESCE(MAX(id), 0) + 1,
+                    false
+                )
+                FROM {table}
+                """
+            )
+
+
+def _timed(label: str, fn, *args):
+    started = time.monotonic()
+    result = fn(*args)
+    seconds = time.monotonic() - started
+    rows = result[0] if isinstance(result, tuple) else result
+    logger.info("%s: %s rows in %.1fs (%.0f rows/s)", label, rows, seconds, rows / max(seconds, 1e-6))
+    return result
+
+
+def run_migration(
+    workers: int = MIGRATE_WORKERS, chunk_rows: int = MIGRATE_CHUNK_ROWS
+) -> dict[str, int]:
+    shards = source_shards()
+    with _connect_target() as pg:
+        state = _prepare_state(pg, shards)
+        revs = dict(pg.execute("SELECT budget_id, rev FROM migration_budgets").fetchall())
+    result: dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        jobs = {"budgets": pool.submit(_timed, "budgets", _refresh_budgets, shards)}
+        for table in DIRECTORY_TABLES:
+            jobs[table] = pool.submit(_timed, table, _refresh_directory_table, shards, table)
+        for table in BUDGET_TABLES:
+            jobs[table] = pool.submit(
+                _timed, table, _refresh_budget_table, shards, state, table
+            )
+        for table, job in jobs.items():
+            result[table] = job.result()
+        jobs = {
+            shard: pool.submit(
+                _timed,
+                f"transactions shard {shard}",
+                _sync_transactions,
+                shards,
+                shard,
+                *state[("transactions", shard)],
+                revs,
+                chunk_rows,
+            )
+            for shard in shards
+        }
+        result["transactions"] = 0
+        result["transactions_updated"] = 0
+        for job in jobs.values():
+            copied, updated = job.result()
+            result["transactions"] += copied
+            result["transactions_updated"] += updated
+    with _connect_target() as pg:
+        _fix_sequences(pg)
+    return result
+
+
+def _source_counts(shards: dict[int, str]) -> tuple[dict[str, int], dict[int, tuple]]:
+    counts = dict.fromkeys((*SERIAL_TABLES, *DIRECTORY_TABLES), 0)
+    balances: dict[int, tuple] = {}
+    for shard, path in shards.items():
+        src = _open_source(path)
+        try:
+            src.execute("BEGIN")
+            if shard == 0:
+                for table in DIRECTORY_TABLES:
+                    counts[table] = src.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            counts["budgets"] += src.execute(
+                f"SELECT COUNT(*) FROM budgets {_shard_filter(shards, shard, 'id')}"
+            ).fetchone()[0]
+            for table in BUDGET_TABLES:
+                counts[table] += src.execute(
+                    f"SELECT COUNT(*) FROM {table} {_shard_filter(shards, shard, 'budget_id')}"
+                ).fetchone()[0]
+            for budget_id, count, balance, volume in src.execute(
+                """
+                SELECT
+                    budget_id,
+                    COUNT(*),
+                    SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END),
+                    SUM(ABS(amount))
+                FROM migrate_transactions
+                GROUP BY budget_id
+                """
+            ):
+                counts["transactions"] += count
+                balances[budget_id] = (count, balance, volume)
+            src.execute("COMMIT")
+        finally:
+            src.close()
+    return counts, balances
+
+
+def verify_migration() -> list[str]:
+    counts, balances = _source_counts(source_shards())
+    problems = []
+    with _connect_target() as pg:
+        for table, expected in counts.items():
+            actual = pg.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if actual != expected:
+                problems.append(f"{table}: {expected} rows in SQLite, {actual} in PostgreSQL")
+        target = {
+            budget_id: (count, balance)
+            for budget_id, count, balance in pg.execute(
+                """
+                SELECT
+                    budget_id,
+                    COUNT(*),
+                    SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END::float8)
+                FROM transactions
+                GROUP BY budget_id
+                """
+            ).fetchall()
+        }
+    for budget_id in sorted(set(balances) | set(target)):
+        count, balance, volume = balances.get(budget_id, (0, 0.0, 0.0))
+        actual_count, actual_balance = target.get(budget_id, (0, 0.0))
+        if actual_count != count or abs(actual_balance - balance) > 1e-6 * volume + 0.01:
+            problems.append(
+                f"budget {budget_id}: {count} rows / {balance:.2f} in SQLite, "
+                f"{actual_count} rows / {actual_balance:.2f} in PostgreSQL"
+            )
+    return problems
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+
+from db import add_limit_listener, add_transaction_listener, list_notify_recipients
+
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"
+NOTIFY_DEBOUNCE_SECONDS = float(os.getenv("NOTIFY_DEBOUNCE_SECONDS", "30"))
+NOTIFY_MAX_LINES = int(os.getenv("NOTIFY_MAX_LINES", "10"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+
+logger = logging.getLogger(__name__)
+
+
+def render_digest(entries: list[tuple], max_lines: int = NOTIFY_MAX_LINES) -> str:
+    lines = ["Новые записи в общем бюджете:"]
+    for t_type, amount, description, category, added_by in entries[:max_lines]:
+        sign = "+" if t_type == "income" else "−"
+        line = f"{sign}{amount:.2f}"
+        if description:
+            line += f" {description}"
+        if category:
+            line += f" · {category}"
+        if added_by:
+            line += f" — {added_by}"
+        lines.append(line)
+    if len(entries) > max_lines:
+        lines.append(f"…и ещё {len(entries) - max_lines}")
+    income = sum(entry[1] for entry in entries if entry[0] == "income")
+    expense = sum(entry[1] for entry in entries if entry[0] != "income")
+    if len(entries) > 1:
+        lines.append(f"Итого: +{income:.2f} / −{expense:.2f}")
+    return "\n".join(lines)
+
+
+def render_limit_alert(alert: dict) -> str:
+    percent = round(alert["spent"] / alert["limit"] * 100)
+    if alert["threshold"] >= 1:
+        return (
+            f"Лимит «{alert['category']}» на {alert['month']} превышен: "
+            f"{alert['spent']:.2f} из {alert['limit']:.2f} ({percent}%)"
+        )
+    return (
+        f"Лимит «{alert['category']}» на {alert['month']}: "
+        f"потрачено {alert['spent']:.2f} из {alert['limit']:.2f} ({percent}%)"
+    )
+
+
+class MemberNotifier:
+    def __init__(
+        self,
+        debounce: float = NOTIFY_DEBOUNCE_SECONDS,
+        max_lines: int = NOTIFY_MAX_LINES,
+        concurrency: int = NOTIFY_CONCURRENCY,
+    ) -> None:
+        self.debounce = debounce
+        self.max_lines = max_lines
+        self.concurrency = max(1, concurrency)
+        self.stats = {"events": 0, "digests": 0, "limit_alerts": 0, "messages": 0, "failed": 0}
+        self._send = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._pending: dict[int, list[tuple[int, tuple]]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._flushes: set[asyncio.Task] = set()
+
+    def start(self, send) -> None:
+        self._send = send
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def stop(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        for budget_id in list(self._pending):
+            self._flush(budget_id)
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        self._loop = None
+
+    def on_transactions(self, budget_id: int, telegram_id: int, entries: list[tuple]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._add, budget_id, telegram_id, entries)
+        except RuntimeError:
+            pass
+
+    def on_limits(self, budget_id: int, alerts: list[dict]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._alert, budget_id, alerts)
+        except RuntimeError:
+            pass
+
+    def _alert(self, budget_id: int, alerts: list[dict]) -> None:
+        if self._loop is None:
+            return
+        self.stats["limit_alerts"] += len(alerts)
+        task = asyncio.ensure_future(self._deliver_alerts(budget_id, alerts))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _deliver_alerts(self, budget_id: int, alerts: list[dict]) -> None:
+        recipients = await asyncio.to_thread(list_notify_recipients, budget_id)
+        text = "\n".join(render_limit_alert(alert) for alert in alerts)
+        await asyncio.gather(*(self._send_text(member, text) for member in recipients))
+
+    def _add(self, budget_id: int, telegram_id: int, entries: list[tuple]) -> None:
+        if self._loop is None:
+            return
+        self.stats["events"] += len(entries)
+        self._pending.setdefault(budget_id, []).extend(
+            (telegram_id, entry) for entry in entries
+        )
+        if budget_id not in self._timers:
+            self._timers[budget_id] = self._loop.call_later(
+                self.debounce, self._flush, budget_id
+            )
+
+    def _flush(self, budget_id: int) -> None:
+        self._timers.pop(budget_id, None)
+        events = self._pending.pop(budget_id, None)
+        if not events:
+            return
+        task = asyncio.ensure_future(self._deliver(budget_id, events))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _deliver(self, budget_id: int, events: list[tuple[int, tuple]]) -> None:
+        self.stats["digests"] += 1
+        recipients = await asyncio.to_thread(list_notify_recipients, budget_id)
+        await asyncio.gather(
+            *(
+                self._notify(member, [entry for author, entry in events if author != member])
+                for member in recipients
+            )
+        )
+
+    async def _notify(self, member: int, entries: list[tuple]) -> None:
+        if not entries:
+            return
+        await self._send_text(member, render_digest(entries, self.max_lines))
+
+    async def _send_text(self, member: int, text: str) -> None:
+        async with self._semaphore:
+            try:
+                await self._send(member, text)
+            except Exception as exc:
+                self.stats["failed"] += 1
+                logger.warning("Notification to %s failed: %s", member, exc)
+            else:
+                self.stats["messages"] += 1
+
+
+NOTIFIER = MemberNotifier()
+if NOTIFY_ENABLED:
+    add_transaction_listener(NOTIFIER.on_transactions)
+    add_limit_listener(NOTIFIER.on_limits)
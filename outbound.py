@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from ratelimit import RateLimiter
+
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "0.5"))
+TELEGRAM_MERGE_DELAY = float(os.getenv("TELEGRAM_MERGE_DELAY", "0.05"))
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", "8"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+MAX_MESSAGE_LENGTH = 4096
+
+logger = logging.getLogger(__name__)
+
+
+class _Outgoing:
+    __slots__ = ("kind", "text", "reply_markup", "message_id", "future", "queued_at")
+
+    def __init__(self, kind: str, text: str, reply_markup, message_id: int | None) -> None:
+        self.kind = kind
+        self.text = text
+        self.reply_markup = reply_markup
+        self.message_id = message_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+
+class OutboundQueue:
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+        merge_delay: float = TELEGRAM_MERGE_DELAY,
+        workers: int = TELEGRAM_SEND_WORKERS,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+    ) -> None:
+        self.chat_interval = chat_interval
+        self.merge_delay = merge_delay
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.stats = {"requested": 0, "sent": 0, "edited": 0, "merged": 0, "retries": 0}
+        self._limiter = RateLimiter(global_rate, max(1, int(global_rate)))
+        self._bot = None
+        self._pending: dict[int, deque[_Outgoing]] = {}
+        self._last_sent: dict[int, float] = {}
+        self._ready: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot) -> None:
+        if self._tasks:
+            return
+        self._bot = bot
+        self._ready = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"outbound:{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        if self._ready is not None:
+            await self.flush()
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def flush(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.merge_delay or 0.01)
+
+    def send(self, chat_id: int, text: str, reply_markup=None) -> asyncio.Future:
+        return self._enqueue(chat_id, _Outgoing("send", text, reply_markup, None))
+
+    def edit(
+        self, chat_id: int, message_id: int, text: str, reply_markup=None
+    ) -> asyncio.Future:
+        return self._enqueue(chat_id, _Outgoing("edit", text, reply_markup, message_id))
+
+    def _enqueue(self, chat_id: int, item: _Outgoing) -> asyncio.Future:
+        self.stats["requested"] += 1
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            self._pending[chat_id] = deque([item])
+            self._ready.put_nowait(chat_id)
+        else:
+            pending.append(item)
+        return item.future
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            try:
+                await self._drain(chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbound delivery to %s failed", chat_id)
+
+    async def _drain(self, chat_id: int) -> None:
+        pending = self._pending[chat_id]
+        try:
+            while pending:
+                wait = max(
+                    pending[0].queued_at + self.merge_delay - time.monotonic(),
+                    self._last_sent.get(chat_id, 0) + self.chat_interval - time.monotonic(),
+                )
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                batch = [pending.popleft()]
+                if batch[0].kind == "send":
+                    while (
+                        pending
+                        and pending[0].kind == "send"
+                        and len("\n\n".join(item.text for item in batch + [pending[0]]))
+                        <= MAX_MESSAGE_LENGTH
+                    ):
+                        batch.append(pending.popleft())
+                try:
+                    await self._deliver(chat_id, batch)
+                except asyncio.CancelledError:
+                    for item in batch:
+                        item.future.cancel()
+                    raise
+                except Exception as exc:
+                    self._fail(batch, exc)
+                self._last_sent[chat_id] = time.monotonic()
+        finally:
+            if pending:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._pending[chat_id]
+
+    async def _deliver(self, chat_id: int, batch: list[_Outgoing]) -> None:
+        head = batch[0]
+        text = "\n\n".join(item.text for item in batch)
+        reply_markup = next(
+            (item.reply_markup for item in reversed(batch) if item.reply_markup), None
+        )
+        self.stats["merged"] += len(batch) - 1
+        attempt = 0
+        while True:
+            delay = self._limiter.acquire("global")
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                if head.kind == "edit":
+                    result = await self._bot.edit_message_text(
+                        text,
+                        chat_id=chat_id,
+                        message_id=head.message_id,
+                        reply_markup=reply_markup,
+                    )
+                    self.stats["edited"] += 1
+                else:
+                    result = await self._bot.send_message(
+                        chat_id, text, reply_markup=reply_markup
+                    )
+                    self.stats["sent"] += 1
+            except RetryAfter as exc:
+                retry_after = exc.retry_after
+                seconds = (
+                    retry_after.total_seconds()
+                    if hasattr(retry_after, "total_seconds")
+                    else float(retry_after)
+                )
+                self.stats["retries"] += 1
+                await asyncio.sleep(seconds)
+                continue
+            except BadRequest as exc:
+                if head.kind == "edit" and "not modified" in str(exc).lower():
+                    result = None
+                else:
+                    self._fail(batch, exc)
+                    return
+            except (TimedOut, NetworkError) as exc:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._fail(batch, exc)
+                    return
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(2**attempt, 30))
+                continue
+            except Exception as exc:
+                self._fail(batch, exc)
+                return
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(result)
+            return
+
+    @staticmethod
+    def _fail(batch: list[_Outgoing], exc: Exception) -> None:
+        logger.warning("Telegram request failed: %s", exc)
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(exc)
+            item.future.exception()
+
+
+OUTBOX = OutboundQueue()
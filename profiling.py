@@ -0,0 +1,256 @@
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from fastapi.routing import APIRoute
+from telegram.ext import Application
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "").strip()
+PROFILE_ADMIN_IDS = {
+    int(value) for value in os.getenv("PROFILE_ADMIN_IDS", "").split(",") if value.strip()
+}
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").strip().lower()
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "1"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_MODES = ("cprofile", "sampling")
+PROFILE_FILE = re.compile(r"^[\w.-]+\.(prof|txt|folded)$")
+
+logger = logging.getLogger(__name__)
+
+_SESSION: contextvars.ContextVar = contextvars.ContextVar("profile_session", default=None)
+_ARMED: set[int] = set()
+
+
+def is_admin_token(token: str | None) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN and token) and hmac.compare_digest(
+        token.encode(), PROFILE_ADMIN_TOKEN.encode()
+    )
+
+
+def is_profile_admin(telegram_id: int) -> bool:
+    return telegram_id in PROFILE_ADMIN_IDS
+
+
+def arm(telegram_id: int) -> None:
+    _ARMED.add(telegram_id)
+
+
+def _sampled() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class ProfileSession:
+    def __init__(
+        self, mode: str = PROFILE_MODE, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS
+    ) -> None:
+        self.mode = mode if mode in PROFILE_MODES else "cprofile"
+        self.interval = max(interval_ms, 0.1) / 1000
+        self.seconds = 0.0
+        self.used = False
+        self._profile = cProfile.Profile() if self.mode == "cprofile" else None
+        self._stacks: Counter = Counter()
+
+    @contextmanager
+    def active(self):
+        self.used = True
+        started = time.perf_counter()
+        if self._profile is not None:
+            self._profile.enable()
+            try:
+                yield
+            finally:
+                self._profile.disable()
+                self.seconds += time.perf_counter() - started
+            return
+        target = threading.get_ident()
+        done = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(target, done), name="profile-sampler", daemon=True
+        )
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+            self.seconds += time.perf_counter() - started
+
+    def _sample(self, target: int, done: threading.Event) -> None:
+        while not done.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def save(self, kind: str, label: str, directory: str = PROFILE_DIR) -> str | None:
+        if not self.used:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^\w-]+", "-", label).strip("-")[:60] or "request"
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{kind}-{slug}-{secrets.token_hex(3)}"
+        base = os.path.join(directory, name)
+        if self._profile is not None:
+            self._profile.dump_stats(f"{base}.prof")
+            summary = io.StringIO()
+            summary.write(f"{label}\n{self.seconds * 1000:.1f} ms\n\n")
+            stats = pstats.Stats(self._profile, stream=summary)
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+            with open(f"{base}.txt", "w") as handle:
+                handle.write(summary.getvalue())
+        else:
+            with open(f"{base}.folded", "w") as handle:
+                for stack, count in self._stacks.most_common():
+                    handle.write(f"{stack} {count}\n")
+        _prune(directory, PROFILE_KEEP)
+        logger.info("Profiled %s %s in %.1f ms: %s", kind, label, self.seconds * 1000, name)
+        return name
+
+
+def start_session(token: str | None = None, force: bool = False) -> ProfileSession | None:
+    if force or is_admin_token(token) or _sampled():
+        return ProfileSession()
+    return None
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> list[dict]:
+    if not os.path.isdir(directory):
+        return []
+    items = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and PROFILE_FILE.match(entry.name):
+            stat = entry.stat()
+            items.append(
+                {
+                    "name": entry.name,
+                    "size": stat.st_size,
+                    "created_at": datetime.utcfromtimestamp(stat.st_mtime).isoformat(
+                        timespec="seconds"
+                    ),
+                }
+            )
+    return sorted(items, key=lambda item: item["name"], reverse=True)
+
+
+def profile_path(name: str, directory: str = PROFILE_DIR) -> str | None:
+    if not PROFILE_FILE.match(name):
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+def _prune(directory: str, keep: int) -> None:
+    if keep <= 0:
+        return
+    profiles = sorted(
+        {name.rsplit(".", 1)[0] for name in os.listdir(directory) if PROFILE_FILE.match(name)}
+    )
+    stale = set(profiles[:-keep])
+    for name in os.listdir(directory):
+        if PROFILE_FILE.match(name) and name.rsplit(".", 1)[0] in stale:
+            os.remove(os.path.join(directory, name))
+
+
+def profiled(func):
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            session = _SESSION.get()
+            if session is None:
+                return await func(*args, **kwargs)
+            with session.active():
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _SESSION.get()
+        if session is None:
+            return func(*args, **kwargs)
+        with session.active():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs) -> None:
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request):
+            session = start_session(request.headers.get(PROFILE_HEADER))
+            if session is None:
+                return await handler(request)
+            token = _SESSION.set(session)
+            try:
+                response = await handler(request)
+            finally:
+                _SESSION.reset(token)
+                name = session.save("http", f"{request.method} {self.path}")
+            if name:
+                response.headers["X-Profile-Id"] = name
+            return response
+
+        return route_handler
+
+
+def _update_label(update) -> str:
+    if update.callback_query is not None:
+        return "callback-" + (update.callback_query.data or "").split(":")[0]
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith("/"):
+        return message.text.split()[0][1:].split("@")[0]
+    return "message"
+
+
+class ProfiledApplication(Application):
+    async def process_update(self, update: object) -> None:
+        user = getattr(update, "effective_user", None)
+        armed = user is not None and user.id in _ARMED
+        session = start_session(force=armed)
+        if session is None:
+            await super().process_update(update)
+            return
+        if armed:
+            _ARMED.discard(user.id)
+        try:
+            with session.active():
+                await super().process_update(update)
+        finally:
+            name = session.save("bot", _update_label(update))
+        if armed and name:
+            try:
+                await self.bot.send_message(update.effective_chat.id, f"Профиль сохранен: {name}")
+            except Exception as exc:
+                logger.warning("Could not report profile %s: %s", name, exc)
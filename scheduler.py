@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+from backup import BACKUP_INTERVAL_SECONDS, run_backup_job
+from db import (
+    archive_transactions,
+    claim_due_recurring,
+    ensure_transaction_partitions,
+    materialize_recurring,
+    purge_idempotency_keys,
+)
+from maintenance import MAINTENANCE_INTERVAL_SECONDS, run_maintenance_job
+
+RECURRING_INTERVAL_SECONDS = float(os.getenv("RECURRING_INTERVAL_SECONDS", "60"))
+RECURRING_BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "500"))
+RECURRING_LEASE_SECONDS = float(os.getenv("RECURRING_LEASE_SECONDS", "120"))
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "3600"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "0"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "86400"))
+HOUSEKEEPING_PROCESS = os.getenv("HOUSEKEEPING_PROCESS", "server").strip().lower()
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    def __init__(self) -> None:
+        self._jobs: list[tuple[str, float, object, str | None]] = []
+        self._tasks: list[asyncio.Task] = []
+
+    def every(self, name: str, interval: float, job, process: str | None = None) -> None:
+        if interval > 0:
+            self._jobs.append((name, interval, job, process))
+
+    def start(self, process: str) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._loop(name, interval, job), name=f"scheduler:{name}")
+            for name, interval, job, owner in self._jobs
+            if owner is None or owner == process
+        ]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _loop(self, name: str, interval: float, job) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduled job %s failed", name)
+
+
+def materialize_due_recurring(now: datetime | None = None) -> int:
+    now = now or datetime.utcnow().replace(microsecond=0)
+    total = 0
+    while True:
+        rules = claim_due_recurring(
+            WORKER_ID, now, RECURRING_BATCH_SIZE, RECURRING_LEASE_SECONDS
+        )
+        if not rules:
+            break
+        total += materialize_recurring(WORKER_ID, rules, now)
+        if len(rules) < RECURRING_BATCH_SIZE:
+            break
+    return total
+
+
+async def run_recurring() -> None:
+    created = await asyncio.to_thread(materialize_due_recurring)
+    if created:
+        logger.info("Materialized %s recurring transactions", created)
+
+
+async def run_idempotency_purge() -> None:
+    before = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    purged = await asyncio.to_thread(
+        purge_idempotency_keys, before.isoformat(timespec="seconds")
+    )
+    if purged:
+        logger.info("Purged %s idempotency keys", purged)
+
+
+def archive_cutoff(now: datetime, months: int) -> datetime:
+    index = now.year * 12 + now.month - 1 - months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+async def run_storage_maintenance() -> None:
+    now = datetime.utcnow()
+    await asyncio.to_thread(ensure_transaction_partitions, now)
+    if ARCHIVE_AFTER_MONTHS <= 0:
+        return
+    moved = await asyncio.to_thread(
+        archive_transactions,
+        archive_cutoff(now, ARCHIVE_AFTER_MONTHS).isoformat(timespec="seconds"),
+    )
+    if moved:
+        logger.info("Archived %s transactions", moved)
+
+
+SCHEDULER = Scheduler()
+SCHEDULER.every("recurring", RECURRING_INTERVAL_SECONDS, run_recurring)
+SCHEDULER.every(
+    "idempotency-purge", IDEMPOTENCY_PURGE_SECONDS, run_idempotency_purge, "server"
+)
+SCHEDULER.every(
+    "storage", ARCHIVE_INTERVAL_SECONDS, run_storage_maintenance, HOUSEKEEPING_PROCESS
+)
+SCHEDULER.every(
+    "maintenance", MAINTENANCE_INTERVAL_SECONDS, run_maintenance_job, HOUSEKEEPING_PROCESS
+)
+SCHEDULER.every("backup", BACKUP_INTERVAL_SECONDS, run_backup_job, HOUSEKEEPING_PROCESS)
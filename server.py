@@ -1,19 +1,46 @@
 import hashlib
 import hmac
 import json
+import logging
 import os
+import time
+from datetime import datetime, timedelta
 from urllib.parse import parse_qsl
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response
 from pydantic import BaseModel
+from telegram import Bot
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - handled by runtime requirements
+    orjson = None
+
+from analytics import compute_analytics, forecast_plans
+from backup import backup_stats
+from compression import CompressionMiddleware, compression_stats
+from notify import NOTIFIER, NOTIFY_ENABLED
+from outbound import OUTBOX
+from profiling import ProfiledRoute, is_admin_token, list_profiles, profile_path
+from ratelimit import RateLimiter
+from scheduler import SCHEDULER
 
 from db import (
+    BALANCE_RESOLUTIONS,
+    RECURRING_PERIODS,
+    add_recurring,
     add_transaction,
+    complete_idempotency_key,
+    release_idempotency_key,
+    reserve_idempotency_key,
+    balance_history,
     add_plan,
     create_invite,
     get_budget_owner_id,
     get_budget_state,
+    get_active_budget_id,
     get_budget_summary,
     get_or_create_user,
     get_period_summary,
@@ -33,15 +60,82 @@ from db import (
     list_categories,
     category_summary,
     list_categories_full,
+    list_category_limits,
+    set_category_limit,
     add_category,
     update_category,
     delete_category,
     ensure_category,
     list_updates,
+    list_recurring,
+    delete_recurring,
+    search_transactions,
+    sync_changes,
 )
 
 
 BOT_TOKEN = os.getenv("TELEGRAM_API_KEY", "").strip()
+JSON_RESPONSE = os.getenv("JSON_RESPONSE", "orjson").strip().lower()
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+USE_ORJSON = JSON_RESPONSE == "orjson" and orjson is not None
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "5"))
+RATE_LIMIT_USER_BURST = int(os.getenv("RATE_LIMIT_USER_BURST", "30"))
+RATE_LIMIT_BUDGET_RATE = float(os.getenv("RATE_LIMIT_BUDGET_RATE", "10"))
+RATE_LIMIT_BUDGET_BURST = int(os.getenv("RATE_LIMIT_BUDGET_BURST", "60"))
+SYNC_WINDOW_DAYS = int(os.getenv("SYNC_WINDOW_DAYS", "31"))
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "500"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+IDEMPOTENCY_COMPLETE_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+USER_LIMITER = RateLimiter(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST)
+BUDGET_LIMITER = RateLimiter(RATE_LIMIT_BUDGET_RATE, RATE_LIMIT_BUDGET_BURST)
+
+TRANSACTION_FIELDS = ("id", "amount", "description", "added_by", "category", "created_at")
+PLAN_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "target_amount",
+    "current_amount",
+    "created_by",
+    "created_at",
+)
+UPDATE_FIELDS = ("t_type", "amount", "description", "added_by", "created_at")
+RECURRING_FIELDS = (
+    "id",
+    "t_type",
+    "amount",
+    "description",
+    "category",
+    "period",
+    "interval_count",
+    "next_run_at",
+)
+SEARCH_FIELDS = (
+    "id",
+    "t_type",
+    "amount",
+    "description",
+    "added_by",
+    "category",
+    "created_at",
+)
+PLAN_ITEM_FIELDS = PLAN_FIELDS + ("forecast",)
+CATEGORY_FIELDS = ("id", "t_type", "name")
+SYNC_TRANSACTION_FIELDS = (
+    "id",
+    "t_type",
+    "amount",
+    "description",
+    "added_by",
+    "category",
+    "created_at",
+)
 
 
 class InitPayload(BaseModel):
@@ -131,6 +225,16 @@ class CategoryDeletePayload(InitPayload):
     category_id: int
 
 
+class LimitsPayload(InitPayload):
+    month: str | None = None
+
+
+class LimitSetPayload(InitPayload):
+    category: str
+    amount: float
+    month: str | None = None
+
+
 class SummaryRangePayload(InitPayload):
     t_type: str
     start: str | None = None
@@ -141,6 +245,49 @@ class UpdatesPayload(InitPayload):
     since: str | None = None
 
 
+class RecurringPayload(InitPayload):
+    t_type: str
+    amount: float
+    description: str
+    category: str | None = None
+    period: str
+    interval_count: int = 1
+    start: str | None = None
+
+
+class RecurringDeletePayload(InitPayload):
+    rule_id: int
+
+
+class TransactionSearchPayload(InitPayload):
+    query: str
+    t_type: str | None = None
+    start: str | None = None
+    end: str | None = None
+    category: str | None = None
+    limit: int = 50
+    offset: int = 0
+
+
+class AnalyticsPayload(InitPayload):
+    t_type: str
+    start: str | None = None
+    end: str | None = None
+    top: int = 5
+    window: int = 7
+    tz_offset: int = 0
+
+
+class BalanceHistoryPayload(InitPayload):
+    resolution: str = "day"
+    start: str | None = None
+    end: str | None = None
+
+
+class SyncPayload(InitPayload):
+    token: str | None = None
+
+
 def _verify_init_data(init_data: str) -> dict:
     if not BOT_TOKEN:
         raise HTTPException(status_code=500, detail="Missing TELEGRAM_API_KEY")
@@ -162,9 +309,64 @@ def _verify_init_data(init_data: str) -> dict:
         user = json.loads(user_raw)
     except json.JSONDecodeError as exc:
         raise HTTPException(status_code=401, detail="Invalid user payload") from exc
+    _check_rate(USER_LIMITER, int(user["id"]))
     return user
 
 
+def _check_rate(limiter: RateLimiter, key) -> None:
+    retry_after = limiter.acquire(key)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, round(retry_after)))},
+        )
+
+
+def _idempotent(
+    telegram_id: int, key: str | None, endpoint: str, payload: BaseModel, handler
+) -> dict:
+    if not key:
+        return handler()
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+    fingerprint = hashlib.sha256(
+        _dumps(payload.model_dump(exclude={"initData"}))
+    ).hexdigest()
+    existing = reserve_idempotency_key(
+        telegram_id, key, endpoint, fingerprint, IDEMPOTENCY_LEASE_SECONDS
+    )
+    if existing:
+        stored_endpoint, stored_fingerprint, response = existing
+        if stored_endpoint != endpoint or stored_fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=422, detail="Idempotency-Key reused with another request"
+            )
+        if response is None:
+            raise HTTPException(
+                status_code=409,
+                detail="Request with this Idempotency-Key is in progress",
+                headers={"Retry-After": "1"},
+            )
+        return json.loads(response)
+    try:
+        result = handler()
+    except BaseException:
+        release_idempotency_key(telegram_id, key)
+        raise
+    response = _dumps(result).decode()
+    for attempt in range(IDEMPOTENCY_COMPLETE_ATTEMPTS):
+        try:
+            complete_idempotency_key(telegram_id, key, response)
+            break
+        except Exception:
+            if attempt + 1 == IDEMPOTENCY_COMPLETE_ATTEMPTS:
+                logger.exception("Failed to store response for Idempotency-Key %s", key)
+            else:
+                time.sleep(0.05 * 2**attempt)
+    return result
+
+
 def _period_to_days(period: str) -> int | None:
     return {"week": 7, "month": 30, "year": 365}.get(period)
 
@@ -178,47 +380,158 @@ def _display_name(user: dict) -> str:
     return name or f"id:{user.get('id')}"
 
 
-app = FastAPI()
+def _dumps(content) -> bytes:
+    if USE_ORJSON:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _rows(fields: tuple[str, ...], rows) -> dict:
+    return {"fields": fields, "items": list(rows)}
+
+
+def _items_response(fields: tuple[str, ...], rows) -> Response:
+    return Response(content=_dumps(_rows(fields, rows)), media_type="application/json")
+
+
+def _plan_rows(budget_id: int | None, rows) -> list:
+    forecasts = forecast_plans(budget_id, rows)
+    return [(*row, forecasts.get(row[0])) for row in rows]
+
+
+app = FastAPI(default_response_class=ORJSONResponse if USE_ORJSON else JSONResponse)
+app.router.route_class = ProfiledRoute
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 
 @app.on_event("startup")
-def _startup() -> None:
+async def _startup() -> None:
     init_db()
+    SCHEDULER.start("server")
+    if BOT_TOKEN and NOTIFY_ENABLED:
+        OUTBOX.start(Bot(BOT_TOKEN))
+        NOTIFIER.start(OUTBOX.send)
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await SCHEDULER.stop()
+    await NOTIFIER.stop()
+    await OUTBOX.stop()
 
 
 @app.get("/health")
 def health() -> dict:
-    return {"ok": True}
+    return {"ok": True, "compression": compression_stats(), "backup": backup_stats()}
 
 
-@app.post("/api/init")
-def api_init(payload: InitPayload) -> dict:
-    user = _verify_init_data(payload.initData)
-    telegram_id = int(user["id"])
-    display_name = _display_name(user)
-    get_or_create_user(telegram_id, display_name)
-    balance = get_budget_summary(telegram_id)
-    owner_id = get_budget_owner_id(telegram_id)
+def _check_admin(token: str | None) -> None:
+    if not is_admin_token(token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/admin/profiles")
+def admin_profiles(
+    admin_token: str | None = Header(default=None, alias="X-Admin-Token"),
+) -> dict:
+    _check_admin(admin_token)
+    return {"items": list_profiles()}
+
+
+@app.get("/admin/profiles/{name}")
+def admin_profile(
+    name: str, admin_token: str | None = Header(default=None, alias="X-Admin-Token")
+) -> FileResponse:
+    _check_admin(admin_token)
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+
+def _session(telegram_id: int, display_name: str) -> dict:
     active_budget, personal_budget, shared_budget = get_budget_state(telegram_id)
+    _check_rate(BUDGET_LIMITER, active_budget)
+    owner_id = get_budget_owner_id(telegram_id)
     return {
         "telegram_id": telegram_id,
         "display_name": display_name,
-        "balance": balance,
         "is_owner": owner_id == telegram_id,
         "mode": "shared" if shared_budget and active_budget == shared_budget else "personal",
         "has_shared": bool(shared_budget),
     }
 
 
+@app.post("/api/init")
+def api_init(payload: InitPayload) -> dict:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    session = _session(telegram_id, display_name)
+    return {**session, "balance": get_budget_summary(telegram_id)}
+
+
+def _parse_sync_token(token: str | None) -> tuple[int, int] | None:
+    if not token:
+        return None
+    budget_id, _, rev = token.partition(":")
+    try:
+        return int(budget_id), int(rev)
+    except ValueError:
+        return None
+
+
+@app.post("/api/sync")
+def api_sync(payload: SyncPayload) -> Response:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    session = _session(telegram_id, display_name)
+    window_start = (datetime.utcnow() - timedelta(days=SYNC_WINDOW_DAYS)).isoformat(
+        timespec="seconds"
+    )
+    changes = sync_changes(
+        telegram_id, _parse_sync_token(payload.token), window_start, SYNC_MAX_CHANGES
+    )
+    body = {
+        **session,
+        "token": f"{changes['budget_id']}:{changes['rev']}",
+        "reset": changes["reset"],
+        "changed": changes["changed"],
+    }
+    if changes["changed"]:
+        body["balance"] = changes["balance"]
+        body["window_start"] = window_start
+        body["transactions"] = _rows(SYNC_TRANSACTION_FIELDS, changes["transactions"])
+        if changes["plans"] is not None:
+            body["plans"] = _rows(
+                PLAN_ITEM_FIELDS, _plan_rows(changes["budget_id"], changes["plans"])
+            )
+        if changes["categories"] is not None:
+            body["categories"] = _rows(CATEGORY_FIELDS, changes["categories"])
+    return Response(content=_dumps(body), media_type="application/json")
+
+
 @app.post("/api/transaction")
-def api_transaction(payload: TransactionPayload) -> dict:
+def api_transaction(
+    payload: TransactionPayload,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+) -> dict:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
@@ -228,18 +541,22 @@ def api_transaction(payload: TransactionPayload) -> dict:
         raise HTTPException(status_code=400, detail="Invalid type")
     if payload.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    if payload.category:
-        ensure_category(telegram_id, t_type, payload.category.strip())
-    add_transaction(
-        telegram_id,
-        t_type,
-        payload.amount,
-        payload.description.strip(),
-        display_name,
-        (payload.category or "").strip() or None,
-    )
-    balance = get_budget_summary(telegram_id)
-    return {"ok": True, "balance": balance}
+
+    def handler() -> dict:
+        if payload.category:
+            ensure_category(telegram_id, t_type, payload.category.strip())
+        alerts = add_transaction(
+            telegram_id,
+            t_type,
+            payload.amount,
+            payload.description.strip(),
+            display_name,
+            (payload.category or "").strip() or None,
+        )
+        balance = get_budget_summary(telegram_id)
+        return {"ok": True, "balance": balance, "alerts": alerts}
+
+    return _idempotent(telegram_id, idempotency_key, "transaction", payload, handler)
 
 
 @app.post("/api/summary")
@@ -304,7 +621,7 @@ def api_kick(payload: KickPayload) -> dict:
 
 
 @app.post("/api/transactions")
-def api_transactions(payload: SummaryPayload) -> dict:
+def api_transactions(payload: SummaryPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
@@ -312,44 +629,24 @@ def api_transactions(payload: SummaryPayload) -> dict:
     if payload.t_type not in {"income", "expense"}:
         raise HTTPException(status_code=400, detail="Invalid type")
     rows = get_recent_transactions(telegram_id, payload.t_type, limit=10)
-    items = [
-        {
-            "id": tx_id,
-            "amount": amount,
-            "description": description,
-            "added_by": added_by,
-            "category": category,
-            "created_at": created_at,
-        }
-        for tx_id, amount, description, added_by, category, created_at in rows
-    ]
-    return {"items": items}
+    return _items_response(TRANSACTION_FIELDS, rows)
 
 
 @app.post("/api/plans")
-def api_plans(payload: InitPayload) -> dict:
+def api_plans(payload: InitPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
     get_or_create_user(telegram_id, display_name)
-    rows = list_plans(telegram_id)
-    items = [
-        {
-            "id": plan_id,
-            "title": title,
-            "description": description,
-            "target_amount": target_amount,
-            "current_amount": current_amount,
-            "created_by": created_by,
-            "created_at": created_at,
-        }
-        for plan_id, title, description, target_amount, current_amount, created_by, created_at in rows
-    ]
-    return {"items": items}
+    rows = _plan_rows(get_active_budget_id(telegram_id), list_plans(telegram_id))
+    return _items_response(PLAN_ITEM_FIELDS, rows)
 
 
 @app.post("/api/plan")
-def api_plan_create(payload: PlanPayload) -> dict:
+def api_plan_create(
+    payload: PlanPayload,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+) -> dict:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
@@ -360,8 +657,12 @@ def api_plan_create(payload: PlanPayload) -> dict:
         raise HTTPException(status_code=400, detail="Title required")
     if payload.target_amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    add_plan(telegram_id, title, description, payload.target_amount, display_name)
-    return {"ok": True}
+
+    def handler() -> dict:
+        add_plan(telegram_id, title, description, payload.target_amount, display_name)
+        return {"ok": True}
+
+    return _idempotent(telegram_id, idempotency_key, "plan", payload, handler)
 
 
 @app.post("/api/plan/get")
@@ -374,6 +675,7 @@ def api_plan_get(payload: PlanGetPayload) -> dict:
     if not row:
         raise HTTPException(status_code=404, detail="Not found")
     plan_id, title, description, target_amount, current_amount, created_by, created_at = row
+    forecast = forecast_plans(get_active_budget_id(telegram_id), list_plans(telegram_id))
     return {
         "id": plan_id,
         "title": title,
@@ -382,6 +684,7 @@ def api_plan_get(payload: PlanGetPayload) -> dict:
         "current_amount": current_amount,
         "created_by": created_by,
         "created_at": created_at,
+        "forecast": forecast.get(plan_id),
     }
 
 
@@ -406,17 +709,24 @@ def api_plan_update(payload: PlanUpdatePayload) -> dict:
 
 
 @app.post("/api/plan/deposit")
-def api_plan_deposit(payload: PlanDepositPayload) -> dict:
+def api_plan_deposit(
+    payload: PlanDepositPayload,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+) -> dict:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
     get_or_create_user(telegram_id, display_name)
     if payload.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    ok = deposit_plan(telegram_id, payload.plan_id, payload.amount)
-    if not ok:
-        raise HTTPException(status_code=404, detail="Not found")
-    return {"ok": True}
+
+    def handler() -> dict:
+        ok = deposit_plan(telegram_id, payload.plan_id, payload.amount)
+        if not ok:
+            raise HTTPException(status_code=404, detail="Not found")
+        return {"ok": True}
+
+    return _idempotent(telegram_id, idempotency_key, "plan/deposit", payload, handler)
 
 
 @app.post("/api/users")
@@ -453,7 +763,7 @@ def api_budget_switch(payload: BudgetSwitchPayload) -> dict:
 
 
 @app.post("/api/transactions/list")
-def api_transactions_list(payload: TransactionListPayload) -> dict:
+def api_transactions_list(payload: TransactionListPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
@@ -467,18 +777,28 @@ def api_transactions_list(payload: TransactionListPayload) -> dict:
         payload.end,
         limit=50,
     )
-    items = [
-        {
-            "id": tx_id,
-            "amount": amount,
-            "description": description,
-            "added_by": added_by,
-            "category": category,
-            "created_at": created_at,
-        }
-        for tx_id, amount, description, added_by, category, created_at in rows
-    ]
-    return {"items": items}
+    return _items_response(TRANSACTION_FIELDS, rows)
+
+
+@app.post("/api/transactions/search")
+def api_transactions_search(payload: TransactionSearchPayload) -> Response:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    if payload.t_type and payload.t_type not in {"income", "expense"}:
+        raise HTTPException(status_code=400, detail="Invalid type")
+    rows = search_transactions(
+        telegram_id,
+        payload.query,
+        payload.t_type,
+        payload.start,
+        payload.end,
+        (payload.category or "").strip() or None,
+        limit=min(max(payload.limit, 1), 100),
+        offset=max(payload.offset, 0),
+    )
+    return _items_response(SEARCH_FIELDS, rows)
 
 
 @app.post("/api/transaction/update")
@@ -489,13 +809,18 @@ def api_transaction_update(payload: TransactionUpdatePayload) -> dict:
     get_or_create_user(telegram_id, display_name)
     if payload.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    ok = update_transaction(
-        telegram_id,
-        payload.transaction_id,
-        payload.amount,
-        payload.description.strip(),
-        payload.category.strip(),
-    )
+    try:
+        ok = update_transaction(
+            telegram_id,
+            payload.transaction_id,
+            payload.amount,
+            payload.description.strip(),
+            payload.category.strip(),
+        )
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=409, detail="Archived transactions cannot be edited"
+        ) from exc
     if not ok:
         raise HTTPException(status_code=404, detail="Not found")
     balance = get_budget_summary(telegram_id)
@@ -515,21 +840,19 @@ def api_categories(payload: CategoryPayload) -> dict:
 
 
 @app.post("/api/categories/summary")
-def api_category_summary(payload: CategorySummaryPayload) -> dict:
+def api_category_summary(payload: CategorySummaryPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
     get_or_create_user(telegram_id, display_name)
     if payload.t_type not in {"income", "expense"}:
         raise HTTPException(status_code=400, detail="Invalid type")
-    items = category_summary(telegram_id, payload.t_type, payload.start, payload.end)
-    return {
-        "items": [{"category": cat, "total": total} for cat, total in items]
-    }
+    rows = category_summary(telegram_id, payload.t_type, payload.start, payload.end)
+    return _items_response(("category", "total"), rows)
 
 
 @app.post("/api/categories/list")
-def api_categories_list(payload: CategoryPayload) -> dict:
+def api_categories_list(payload: CategoryPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
@@ -537,7 +860,7 @@ def api_categories_list(payload: CategoryPayload) -> dict:
     if payload.t_type not in {"income", "expense"}:
         raise HTTPException(status_code=400, detail="Invalid type")
     rows = list_categories_full(telegram_id, payload.t_type)
-    return {"items": [{"id": cid, "name": name} for cid, name in rows]}
+    return _items_response(("id", "name"), rows)
 
 
 @app.post("/api/category/add")
@@ -582,6 +905,37 @@ def api_category_delete(payload: CategoryDeletePayload) -> dict:
     return {"ok": True}
 
 
+@app.post("/api/limits")
+def api_limits(payload: LimitsPayload) -> Response:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    return _items_response(
+        ("category", "limit", "spent"), list_category_limits(telegram_id, payload.month)
+    )
+
+
+@app.post("/api/limits/set")
+def api_limits_set(payload: LimitSetPayload) -> dict:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    category = payload.category.strip()
+    if not category:
+        raise HTTPException(status_code=400, detail="Category required")
+    if payload.amount < 0:
+        raise HTTPException(status_code=400, detail="Amount must not be negative")
+    try:
+        month, amount, spent = set_category_limit(
+            telegram_id, category, payload.amount, payload.month
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid month") from exc
+    return {"ok": True, "month": month, "limit": amount, "spent": spent}
+
+
 @app.post("/api/summary/range")
 def api_summary_range(payload: SummaryRangePayload) -> dict:
     user = _verify_init_data(payload.initData)
@@ -602,20 +956,98 @@ def api_summary_range(payload: SummaryRangePayload) -> dict:
 
 
 @app.post("/api/updates")
-def api_updates(payload: UpdatesPayload) -> dict:
+def api_updates(payload: UpdatesPayload) -> Response:
     user = _verify_init_data(payload.initData)
     telegram_id = int(user["id"])
     display_name = _display_name(user)
     get_or_create_user(telegram_id, display_name)
+    if BUDGET_LIMITER.enabled:
+        _check_rate(BUDGET_LIMITER, get_budget_state(telegram_id)[0])
     rows = list_updates(telegram_id, payload.since, limit=20)
-    items = [
-        {
-            "t_type": t_type,
-            "amount": amount,
-            "description": description,
-            "added_by": added_by,
-            "created_at": created_at,
-        }
-        for t_type, amount, description, added_by, created_at in rows
-    ]
-    return {"items": items}
+    return _items_response(UPDATE_FIELDS, rows)
+
+
+@app.post("/api/balance/history")
+def api_balance_history(payload: BalanceHistoryPayload) -> Response:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    if payload.resolution not in BALANCE_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Invalid resolution")
+    rows = balance_history(telegram_id, payload.resolution, payload.start, payload.end)
+    return _items_response(("period", "balance"), rows)
+
+
+@app.post("/api/analytics")
+def api_analytics(payload: AnalyticsPayload) -> dict:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    if payload.t_type not in {"income", "expense"}:
+        raise HTTPException(status_code=400, detail="Invalid type")
+    try:
+        return compute_analytics(
+            get_active_budget_id(telegram_id),
+            payload.t_type,
+            payload.start,
+            payload.end,
+            top=min(max(payload.top, 1), 20),
+            window=min(max(payload.window, 1), 90),
+            tz_offset_minutes=payload.tz_offset,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid date") from exc
+
+
+@app.post("/api/recurring")
+def api_recurring(payload: InitPayload) -> Response:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    return _items_response(RECURRING_FIELDS, list_recurring(telegram_id))
+
+
+@app.post("/api/recurring/add")
+def api_recurring_add(payload: RecurringPayload) -> dict:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    if payload.t_type not in {"income", "expense"}:
+        raise HTTPException(status_code=400, detail="Invalid type")
+    if payload.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if payload.period not in RECURRING_PERIODS:
+        raise HTTPException(status_code=400, detail="Invalid period")
+    category = (payload.category or "").strip() or None
+    if category:
+        ensure_category(telegram_id, payload.t_type, category)
+    try:
+        rule_id = add_recurring(
+            telegram_id,
+            payload.t_type,
+            payload.amount,
+            payload.description.strip(),
+            category,
+            display_name,
+            payload.period,
+            payload.interval_count,
+            payload.start,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid start") from exc
+    return {"ok": True, "id": rule_id}
+
+
+@app.post("/api/recurring/delete")
+def api_recurring_delete(payload: RecurringDeletePayload) -> dict:
+    user = _verify_init_data(payload.initData)
+    telegram_id = int(user["id"])
+    display_name = _display_name(user)
+    get_or_create_user(telegram_id, display_name)
+    if not delete_recurring(telegram_id, payload.rule_id):
+        raise HTTPException(status_code=404, detail="Not found")
+    return {"ok": True}
@@ -0,0 +1,28 @@
+import itertools
+import os
+import sys
+import tempfile
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import db
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    db.init_db()
+
+
+@pytest.fixture(scope="session")
+def new_user():
+    ids = itertools.count(1_000)
+
+    def create() -> int:
+        telegram_id = next(ids)
+        db.get_or_create_user(telegram_id, f"user{telegram_id}")
+        return telegram_id
+
+    return create
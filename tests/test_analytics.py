@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import analytics
+import db
+
+NOW = int(np.datetime64("2024-07-01T00:00:00", "s").astype(np.int64))
+MONTH = analytics.SECONDS_PER_MONTH
+
+
+def _at(months_ago: float) -> str:
+    return str(np.datetime64(int(NOW - months_ago * MONTH), "s"))
+
+
+def _plan(plan_id: int, target: float, current: float, months_ago: float) -> tuple:
+    return (plan_id, f"plan {plan_id}", "", target, current, "tester", _at(months_ago))
+
+
+def test_forecast_splits_free_cash_between_idle_plans():
+    columns = analytics.BudgetColumns(
+        [("income", 900, _at(3), ""), ("expense", 300, _at(1), "Еда")]
+    )
+    plans = [
+        _plan(1, 1000, 200, 2),
+        _plan(2, 500, 0, 1),
+        _plan(3, 90_000, 0, 1),
+        _plan(4, 50, 80, 1),
+        _plan(5, 10**9, 0, 1),
+    ]
+    forecast = analytics._forecast(columns, plans, NOW)
+    assert forecast[1]["monthly_pace"] == pytest.approx(100)
+    assert forecast[1]["months_left"] == pytest.approx(8)
+    eta = np.datetime64(int(NOW + 8 * MONTH), "s").astype("datetime64[D]")
+    assert forecast[1]["eta"] == str(eta)
+    assert forecast[2]["net_monthly"] == pytest.approx(200)
+    assert forecast[2]["monthly_pace"] == pytest.approx(200 / 3)
+    assert forecast[2]["months_left"] == pytest.approx(7.5)
+    assert forecast[3]["months_left"] is None and forecast[3]["eta"] is None
+    assert forecast[4] == {**forecast[4], "done": True, "months_left": 0.0, "eta": None}
+    assert forecast[5]["months_left"] is None and forecast[5]["eta"] is None
+    horizon = analytics.PLAN_FORECAST_HORIZON_MONTHS
+    assert forecast[1]["required_monthly"] == pytest.approx(800 / horizon)
+
+
+def test_forecast_without_savings_has_no_eta():
+    columns = analytics.BudgetColumns([("expense", 300, _at(1), "")])
+    forecast = analytics._forecast(columns, [_plan(1, 500, 0, 1)], NOW)
+    assert forecast[1]["monthly_pace"] == 0
+    assert forecast[1]["months_left"] is None and forecast[1]["eta"] is None
+
+
+def test_forecast_cache_follows_writes(new_user):
+    telegram_id = new_user()
+    db.add_plan(telegram_id, "Trip", "", 1000, "tester")
+    budget_id = db.get_active_budget_id(telegram_id)
+    plans = db.list_plans(telegram_id)
+    assert analytics.forecast_plans(budget_id, plans)[plans[0][0]]["eta"] is None
+    db.add_transactions_batch(telegram_id, [("income", 500, "salary", None)], "tester")
+    assert analytics.forecast_plans(budget_id, plans)[plans[0][0]]["eta"] is not None
@@ -0,0 +1,69 @@
+import gzip
+import json
+import os
+import sqlite3
+
+import pytest
+
+import backup
+import db
+
+pytestmark = pytest.mark.skipif(db.DB_KIND != "sqlite", reason="online backup is SQLite only")
+
+
+def _balance(path: str, budget_id: int) -> float:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            """
+            SELECT SUM(CASE WHEN t_type = 'income' THEN amount ELSE -amount END)
+            FROM transactions
+            WHERE budget_id = ?
+            """,
+            (budget_id,),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _budget_file(budget_id: int) -> str:
+    return db._shard_path(db._shard_for(budget_id=budget_id)) if db.SHARDED else db.DB_PATH
+
+
+def test_backup_restores_every_database_file(new_user, tmp_path):
+    telegram_id = new_user()
+    db.add_transactions_batch(
+        telegram_id, [("income", 40, "salary", None), ("expense", 15, "food", None)], "tester"
+    )
+    budget_id = db.get_active_budget_id(telegram_id)
+    target = backup.create_backup(str(tmp_path / "backups"), keep=2, pages=4, pause=0)
+    with open(os.path.join(target, backup.MANIFEST_NAME)) as handle:
+        manifest = json.load(handle)
+    assert sorted(entry["path"] for entry in manifest["files"]) == sorted(
+        os.path.abspath(path) for path in db.database_files()
+    )
+    db.add_transactions_batch(telegram_id, [("expense", 100, "after backup", None)], "tester")
+
+    restored = tmp_path / "restored"
+    restored.mkdir()
+    assert backup.restore_backup(target, str(restored), verify_only=True)
+    assert os.listdir(restored) == []
+    paths = backup.restore_backup(target, str(restored))
+    assert sorted(os.listdir(restored)) == sorted(entry["name"] for entry in manifest["files"])
+    name = os.path.basename(_budget_file(budget_id))
+    assert _balance(str(restored / name), budget_id) == 25
+    assert all(os.path.exists(path) for path in paths)
+
+
+def test_corrupted_backup_is_rejected(new_user, tmp_path):
+    db.add_transactions_batch(new_user(), [("expense", 1, "tea", None)], "tester")
+    target = backup.create_backup(str(tmp_path / "backups"), keep=2, pages=64, pause=0)
+    with open(os.path.join(target, backup.MANIFEST_NAME)) as handle:
+        name = json.load(handle)["files"][0]["name"]
+    with gzip.open(os.path.join(target, f"{name}.gz"), "ab") as handle:
+        handle.write(b"garbage")
+    restored = tmp_path / "restored"
+    restored.mkdir()
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        backup.restore_backup(target, str(restored))
+    assert os.listdir(restored) == []
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import db
+
+
+def _race(fn, args_list: list) -> list:
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+    errors = []
+
+    def run(index, args) -> None:
+        barrier.wait()
+        try:
+            results[index] = fn(*args)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [
+        threading.Thread(target=run, args=(index, args)) for index, args in enumerate(args_list)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return results
+
+
+def _budget_count(owner_id: int) -> int:
+    with db._connect() as conn:
+        return db._execute(
+            conn, "SELECT COUNT(*) FROM budgets WHERE owner_id = ?", (owner_id,)
+        ).fetchone()[0]
+
+
+def _user_row(telegram_id: int) -> tuple:
+    with db._connect() as conn:
+        return tuple(
+            db._execute(
+                conn,
+                """
+                SELECT budget_id, personal_budget_id, shared_budget_id
+                FROM users
+                WHERE telegram_id = ?
+                """,
+                (telegram_id,),
+            ).fetchone()
+        )
+
+
+def test_invite_code_is_used_once_under_contention(new_user):
+    owner = new_user()
+    code = db.create_invite(owner)
+    members = [new_user() for _ in range(16)]
+    results = _race(db.use_invite, [(member, code) for member in members])
+    assert results.count(True) == 1
+    winner = members[results.index(True)]
+    shared = _user_row(owner)[0]
+    assert _user_row(winner)[0] == shared
+    assert all(_user_row(member)[0] != shared for member in members if member != winner)
+
+
+def test_concurrent_switch_to_personal_creates_one_budget(new_user):
+    owner = new_user()
+    db.create_invite(owner)
+    assert _budget_count(owner) == 1
+    results = _race(db.switch_budget, [(owner, "personal")] * 8)
+    assert all(results)
+    budget_id, personal_budget_id, shared_budget_id = _user_row(owner)
+    assert budget_id == personal_budget_id != shared_budget_id
+    assert _budget_count(owner) == 2
+
+
+def test_concurrent_kick_removes_member_once(new_user):
+    owner = new_user()
+    member = new_user()
+    outsider = new_user()
+    assert db.use_invite(member, db.create_invite(owner))
+    before = _budget_count(outsider)
+    results = _race(
+        db.remove_user_from_budget, [(owner, member)] * 8 + [(outsider, member)] * 4
+    )
+    assert results[:8].count(True) == 1
+    assert not any(results[8:])
+    budget_id, personal_budget_id, shared_budget_id = _user_row(member)
+    assert budget_id == personal_budget_id and shared_budget_id is None
+    assert _budget_count(member) == 1
+    assert _budget_count(outsider) == before
+
+
+def test_rejected_kick_creates_no_budget(new_user):
+    owner = new_user()
+    stranger = new_user()
+    before = _budget_count(stranger)
+    assert not db.remove_user_from_budget(owner, stranger)
+    assert _budget_count(stranger) == before
+
+
+def test_each_invite_is_a_fresh_single_use_code(new_user):
+    owner = new_user()
+    first, second = new_user(), new_user()
+    codes = [db.create_invite(owner) for _ in range(2)]
+    assert codes[0] != codes[1]
+    assert db.use_invite(first, codes[0])
+    assert db.use_invite(second, codes[1])
+    assert _user_row(first)[0] == _user_row(second)[0] == _user_row(owner)[0]
+
+
+@pytest.mark.skipif(not db.SHARDED, reason="sharding is disabled")
+def test_move_in_another_process_is_seen(new_user):
+    telegram_id = new_user()
+    db.add_transactions_batch(telegram_id, [("expense", 5, "before", None)], "tester")
+    budget_id = db.get_active_budget_id(telegram_id)
+    source = db._shard_for(budget_id=budget_id)
+    assert [row[1] for row in db.load_transaction_columns(budget_id)] == [5]
+    target = (source + 1) % db.DB_SHARDS
+    subprocess.run(
+        [sys.executable, "-c", f"import db; db.move_budget({budget_id}, {target})"],
+        cwd=os.path.dirname(os.path.abspath(db.__file__)),
+        check=True,
+    )
+    assert [row[1] for row in db.load_transaction_columns(budget_id)] == [5]
+    assert db._shard_for(budget_id=budget_id) == target
+    db.add_transactions_batch(telegram_id, [("expense", 7, "after", None)], "tester")
+    assert [row[1] for row in db.load_transaction_columns(budget_id)] == [5, 7]
@@ -0,0 +1,25 @@
+import pytest
+
+import compression
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    (
+        ("gzip", "gzip"),
+        ("gzip;q=0", None),
+        ("gzip;q=0.0", None),
+        ("gzip; q=0.000, deflate", None),
+        ("gzip;q=abc", None),
+        ("gzip;q=0.001", "gzip"),
+        ("br; q=0.00, gzip;q=0.5", "gzip"),
+        ("", None),
+    ),
+)
+def test_choose_encoding_drops_zero_quality(header, expected):
+    assert compression._choose_encoding(header) == expected
+
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli is not installed")
+def test_choose_encoding_prefers_brotli():
+    assert compression._choose_encoding("gzip, br;q=0.8") == "br"
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime
+
+import db
+import digest
+
+NOW = datetime(2022, 1, 12, 9)
+LAST_WEEK = "2022-01-05T12:00:00"
+
+
+def _run(send) -> int:
+    return asyncio.run(digest.run_digest(send, "week", NOW))
+
+
+def test_run_digest_groups_totals_and_sends_once(new_user):
+    first, second = new_user(), new_user()
+    db.add_transactions_batch(
+        first,
+        [
+            ("income", 100, "salary", None),
+            ("expense", 30, "lunch", "Еда"),
+            ("expense", 20, "dinner", "Еда"),
+            ("expense", 5, "misc", None),
+        ],
+        "tester",
+        LAST_WEEK,
+    )
+    db.add_transactions_batch(
+        second, [("expense", 7, "bus", "Транспорт")], "tester", LAST_WEEK
+    )
+    db.add_transactions_batch(second, [("expense", 99, "today", None)], "tester", NOW.isoformat())
+    messages = {}
+    failing = {second}
+
+    async def send(telegram_id: int, text: str) -> None:
+        if telegram_id in failing:
+            raise RuntimeError("network down")
+        messages[telegram_id] = text
+
+    assert _run(send) == 1
+    assert set(messages) == {first}
+    lines = messages[first].split("\n")
+    assert lines[0] == "Итоги за неделю 03.01–09.01.2022"
+    assert lines[1:5] == [
+        "Доходы: 100.00",
+        "Расходы: 55.00",
+        "Разница: 45.00",
+        "Записей: 4",
+    ]
+    assert lines[6:] == ["1. Еда — 50.00", "2. Без категории — 5.00"]
+
+    failing.clear()
+    messages.clear()
+    assert _run(send) == 1
+    assert set(messages) == {second}
+    assert "Расходы: 7.00" in messages[second]
+
+    messages.clear()
+    assert _run(send) == 0
+    assert messages == {}
+
+
+def test_digest_opt_out_is_separate_from_mute(new_user):
+    muted, opted_out = new_user(), new_user()
+    for telegram_id in (muted, opted_out):
+        db.add_transactions_batch(
+            telegram_id, [("expense", 3, "tea", None)], "tester", "2022-02-09T12:00:00"
+        )
+    db.set_notify_muted(muted, True)
+    db.set_digest_muted(opted_out, True)
+    messages = {}
+
+    async def send(telegram_id: int, text: str) -> None:
+        messages[telegram_id] = text
+
+    assert asyncio.run(digest.run_digest(send, "week", datetime(2022, 2, 16, 9))) == 1
+    assert set(messages) == {muted}
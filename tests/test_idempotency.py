@@ -0,0 +1,108 @@
+import hashlib
+import hmac
+import json
+from urllib.parse import urlencode
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db
+import server
+
+BOT_TOKEN = "123:TEST"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "BOT_TOKEN", BOT_TOKEN)
+    return TestClient(server.app)
+
+
+def _init_data(telegram_id: int) -> str:
+    user = json.dumps({"id": telegram_id, "first_name": "T"})
+    data = {"auth_date": "1700000000", "user": user}
+    check = "\n".join(f"{key}={data[key]}" for key in sorted(data))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret, check.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def _post(client, telegram_id: int, key: str, amount: float, path: str = "/api/transaction"):
+    body = {"t_type": "expense", "amount": amount, "description": "coffee"}
+    if path == "/api/plan":
+        body = {"title": "Goal", "description": "", "target_amount": amount}
+    body["initData"] = _init_data(telegram_id)
+    return client.post(path, json=body, headers={"Idempotency-Key": key})
+
+
+def _count(telegram_id: int) -> int:
+    return len(db.list_transactions(telegram_id, "expense", None, None))
+
+
+def test_retry_returns_stored_response(client, new_user):
+    telegram_id = new_user()
+    first = _post(client, telegram_id, "retry", 25)
+    second = _post(client, telegram_id, "retry", 25)
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() == {"ok": True, "balance": -25.0, "alerts": []}
+    assert _count(telegram_id) == 1
+    assert _post(client, telegram_id, "other", 25).json()["balance"] == -50.0
+
+
+def test_reused_key_with_another_request_conflicts(client, new_user):
+    telegram_id = new_user()
+    assert _post(client, telegram_id, "reuse", 10).status_code == 200
+    for response in (
+        _post(client, telegram_id, "reuse", 11),
+        _post(client, telegram_id, "reuse", 10, "/api/plan"),
+    ):
+        assert response.status_code == 422
+        assert response.json()["detail"] == "Idempotency-Key reused with another request"
+    assert _count(telegram_id) == 1
+
+
+def test_keys_are_scoped_per_user(client, new_user):
+    first, second = new_user(), new_user()
+    assert _post(client, first, "shared", 5).json()["balance"] == -5.0
+    assert _post(client, second, "shared", 7).json()["balance"] == -7.0
+
+
+def test_in_progress_key_asks_to_retry(client, new_user):
+    telegram_id = new_user()
+    payload = server.TransactionPayload(
+        initData="", t_type="expense", amount=3, description="coffee"
+    )
+    fingerprint = hashlib.sha256(
+        server._dumps(payload.model_dump(exclude={"initData"}))
+    ).hexdigest()
+    assert db.reserve_idempotency_key(telegram_id, "busy", "transaction", fingerprint, 60) is None
+    response = _post(client, telegram_id, "busy", 3)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    assert _count(telegram_id) == 0
+
+
+def test_expired_lease_can_be_reclaimed(new_user):
+    telegram_id = new_user()
+    assert db.reserve_idempotency_key(telegram_id, "lease", "transaction", "f", 60) is None
+    assert db.reserve_idempotency_key(telegram_id, "lease", "transaction", "f", 60) == (
+        "transaction",
+        "f",
+        None,
+    )
+    assert db.reserve_idempotency_key(telegram_id, "lease", "transaction", "f", -1) is None
+
+
+def test_failed_request_releases_key(client, new_user, monkeypatch):
+    telegram_id = new_user()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(server, "add_transaction", fail)
+    with pytest.raises(RuntimeError):
+        _post(client, telegram_id, "release", 4)
+    monkeypatch.undo()
+    monkeypatch.setattr(server, "BOT_TOKEN", BOT_TOKEN)
+    assert _post(client, telegram_id, "release", 4).json()["balance"] == -4.0
+    assert _count(telegram_id) == 1
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import db
+
+
+def _spend(telegram_id: int, amount: float, category: str = "Еда") -> list[float]:
+    alerts = db.add_transaction(telegram_id, "expense", amount, "shop", "tester", category)
+    return [alert["threshold"] for alert in alerts]
+
+
+def test_alerts_fire_once_per_crossed_threshold(new_user):
+    telegram_id = new_user()
+    db.set_category_limit(telegram_id, "Еда", 100)
+    assert _spend(telegram_id, 70) == []
+    assert _spend(telegram_id, 10) == [0.8]
+    assert _spend(telegram_id, 5) == []
+    assert _spend(telegram_id, 15) == [1]
+    assert _spend(telegram_id, 50) == []
+    assert _spend(telegram_id, 500, "Транспорт") == []
+    assert db.list_category_limits(telegram_id) == [("Еда", 100.0, 150.0)]
+
+
+def test_jump_over_both_thresholds_reports_the_highest(new_user):
+    telegram_id = new_user()
+    db.set_category_limit(telegram_id, "Еда", 100)
+    alerts = db.add_transaction(telegram_id, "expense", 120, "party", "tester", "Еда")
+    assert [(alert["threshold"], alert["spent"], alert["limit"]) for alert in alerts] == [
+        (1, 120.0, 100.0)
+    ]
+    assert db.add_transaction(telegram_id, "income", 500, "salary", "tester", "Еда") == []
+
+
+def test_edit_moves_spent_and_can_cross_again(new_user):
+    telegram_id = new_user()
+    db.set_category_limit(telegram_id, "Еда", 100)
+    assert _spend(telegram_id, 90) == [0.8]
+    transaction_id = db.list_transactions(telegram_id, "expense", None, None)[0][0]
+    assert db.update_transaction(telegram_id, transaction_id, 50, "shop", "Еда")
+    assert db.list_category_limits(telegram_id) == [("Еда", 100.0, 50.0)]
+    assert _spend(telegram_id, 30) == [0.8]
+
+
+def test_limit_carries_into_next_month(new_user, monkeypatch):
+    telegram_id = new_user()
+    crossed = []
+    monkeypatch.setattr(db, "_LIMIT_LISTENERS", [lambda budget_id, alerts: crossed.extend(alerts)])
+    db.set_category_limit(telegram_id, "Еда", 100)
+    now = datetime.utcnow()
+    next_month = f"{now.year + now.month // 12:04d}-{now.month % 12 + 1:02d}"
+    db.add_transactions_batch(
+        telegram_id, [("expense", 80, "shop", "Еда")], "tester", f"{next_month}-02T12:00:00"
+    )
+    assert [(alert["month"], alert["threshold"]) for alert in crossed] == [(next_month, 0.8)]
+    assert db.list_category_limits(telegram_id, next_month) == [("Еда", 100.0, 80.0)]
+    assert db.list_category_limits(telegram_id) == [("Еда", 100.0, 0.0)]
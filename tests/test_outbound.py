@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+from outbound import MAX_MESSAGE_LENGTH, OutboundQueue
+
+
+class FakeBot:
+    def __init__(self, failures=()) -> None:
+        self.calls = []
+        self.failures = list(failures)
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        return self._call("send", chat_id, text)
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        return self._call("edit", chat_id, text)
+
+    def _call(self, kind, chat_id, text):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.calls.append((kind, chat_id, text))
+        return len(self.calls)
+
+
+def _run(bot, scenario):
+    async def main():
+        outbox = OutboundQueue(global_rate=1000, chat_interval=0, merge_delay=0.02, workers=2)
+        outbox.start(bot)
+        try:
+            return await scenario(outbox)
+        finally:
+            await outbox.stop()
+
+    return asyncio.run(main())
+
+
+def test_consecutive_sends_are_merged():
+    bot = FakeBot()
+
+    async def scenario(outbox):
+        futures = [outbox.send(1, f"line {index}") for index in range(3)]
+        futures.append(outbox.send(2, "other chat"))
+        results = await asyncio.gather(*futures)
+        return results, outbox.stats
+
+    results, stats = _run(bot, scenario)
+    assert sorted(bot.calls) == [
+        ("send", 1, "line 0\n\nline 1\n\nline 2"),
+        ("send", 2, "other chat"),
+    ]
+    assert len(set(results[:3])) == 1
+    assert stats["merged"] == 2 and stats["sent"] == 2
+
+
+def test_edits_keep_order_and_are_not_merged():
+    bot = FakeBot()
+
+    async def scenario(outbox):
+        await asyncio.gather(
+            outbox.send(1, "first"), outbox.edit(1, 10, "edited"), outbox.send(1, "last")
+        )
+
+    _run(bot, scenario)
+    assert bot.calls == [("send", 1, "first"), ("edit", 1, "edited"), ("send", 1, "last")]
+
+
+def test_merge_respects_message_length():
+    bot = FakeBot()
+    text = "x" * (MAX_MESSAGE_LENGTH // 2)
+
+    async def scenario(outbox):
+        await asyncio.gather(*(outbox.send(1, text) for _ in range(3)))
+
+    _run(bot, scenario)
+    assert [len(call[2]) for call in bot.calls] == [len(text)] * 3
+
+
+def test_retry_after_is_retried_and_bad_request_fails():
+    bot = FakeBot([RetryAfter(0)])
+
+    async def scenario(outbox):
+        sent = await outbox.send(1, "hello")
+        bot.failures.append(BadRequest("chat not found"))
+        with pytest.raises(BadRequest):
+            await outbox.send(1, "lost")
+        return sent, outbox.stats
+
+    sent, stats = _run(bot, scenario)
+    assert sent == 1 and bot.calls == [("send", 1, "hello")]
+    assert stats["retries"] == 1
@@ -0,0 +1,46 @@
+import pytest
+
+import db
+
+pytestmark = pytest.mark.skipif(not db._READ_POOLS, reason="no read pools configured")
+
+
+@pytest.fixture
+def primary_reads(monkeypatch):
+    calls = []
+    connect = db._connect
+
+    def spy(telegram_id=None, budget_id=None):
+        calls.append(telegram_id)
+        return connect(telegram_id, budget_id)
+
+    monkeypatch.setattr(db, "_connect", spy)
+    monkeypatch.setattr(db, "DB_READ_PIN_SECONDS", 60)
+    return calls
+
+
+def test_reads_after_write_are_pinned_to_primary(new_user, primary_reads):
+    telegram_id = new_user()
+    db._PINNED_UNTIL.pop(telegram_id, None)
+    primary_reads.clear()
+    db.get_budget_summary(telegram_id)
+    assert primary_reads == []
+
+    db.add_transactions_batch(telegram_id, [("income", 12, "salary", None)], "tester")
+    primary_reads.clear()
+    assert db.get_budget_summary(telegram_id) == 12
+    assert primary_reads == [telegram_id]
+
+    db._PINNED_UNTIL[telegram_id] = 0
+    primary_reads.clear()
+    assert db.get_budget_summary(telegram_id) == 12
+    assert primary_reads == []
+
+
+def test_pinning_is_per_user(new_user, primary_reads):
+    writer, reader = new_user(), new_user()
+    db._PINNED_UNTIL.pop(reader, None)
+    db.add_transactions_batch(writer, [("expense", 3, "tea", None)], "tester")
+    primary_reads.clear()
+    db.get_budget_summary(reader)
+    assert primary_reads == []
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import db
+
+FIRST_RUN = datetime(2021, 3, 1, 8)
+
+
+def _rule(telegram_id: int, period: str = "day") -> int:
+    return db.add_recurring(
+        telegram_id, "expense", 12, "rent", None, "tester", period, 1, FIRST_RUN.isoformat()
+    )
+
+
+def _claim(worker: str, now: datetime, rule_id: int, lease_seconds: float = 60) -> list:
+    rules = db.claim_due_recurring(worker, now, 1000, lease_seconds)
+    return [rule for rule in rules if rule[0] == rule_id]
+
+
+def _dates(telegram_id: int) -> list[str]:
+    return sorted(row[5] for row in db.list_transactions(telegram_id, "expense", None, None))
+
+
+def test_leased_rule_is_materialized_once(new_user):
+    telegram_id = new_user()
+    rule_id = _rule(telegram_id)
+    now = FIRST_RUN + timedelta(days=3, hours=1)
+    rules = _claim("first", now, rule_id)
+    assert len(rules) == 1
+    assert _claim("second", now, rule_id) == []
+    assert db.materialize_recurring("second", rules, now) == 0
+    assert db.materialize_recurring("first", rules, now) == 4
+    assert db.materialize_recurring("first", rules, now) == 0
+    assert _claim("first", now, rule_id) == []
+    assert _dates(telegram_id) == [
+        (FIRST_RUN + timedelta(days=day)).isoformat() for day in range(4)
+    ]
+    assert db.list_recurring(telegram_id)[0][7] == (FIRST_RUN + timedelta(days=4)).isoformat()
+
+
+def test_expired_lease_moves_to_another_worker(new_user):
+    telegram_id = new_user()
+    rule_id = _rule(telegram_id, "month")
+    now = FIRST_RUN + timedelta(days=1)
+    stale = _claim("first", now, rule_id, lease_seconds=30)
+    later = now + timedelta(minutes=1)
+    rules = _claim("second", later, rule_id)
+    assert len(rules) == 1
+    assert db.materialize_recurring("first", stale, later) == 0
+    assert db.materialize_recurring("second", rules, later) == 1
+    assert _dates(telegram_id) == [FIRST_RUN.isoformat()]
+
+
+def test_deleted_rule_is_not_claimed(new_user):
+    telegram_id = new_user()
+    rule_id = _rule(telegram_id)
+    assert db.delete_recurring(telegram_id, rule_id)
+    assert _claim("first", FIRST_RUN + timedelta(days=1), rule_id) == []
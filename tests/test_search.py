@@ -0,0 +1,38 @@
+import db
+
+
+def _search(telegram_id: int, text: str, **filters) -> list[str]:
+    return [row[3] for row in db.search_transactions(telegram_id, text, **filters)]
+
+
+def test_search_matches_prefixes_within_budget(new_user):
+    telegram_id, other = new_user(), new_user()
+    db.add_transactions_batch(
+        telegram_id,
+        [
+            ("expense", 3, "Кофе с молоком", "Еда"),
+            ("expense", 4, "кофейня у дома", None),
+            ("expense", 30, "такси домой", "Транспорт"),
+            ("income", 50, "возврат за такси", None),
+            ("expense", 15, "Ёлочные игрушки", None),
+        ],
+        "tester",
+    )
+    db.add_transactions_batch(other, [("expense", 2, "кофе", None)], "tester")
+    assert sorted(_search(telegram_id, "коф")) == ["Кофе с молоком", "кофейня у дома"]
+    assert _search(telegram_id, "кофе молок") == ["Кофе с молоком"]
+    assert _search(telegram_id, "трансп") == ["такси домой"]
+    assert _search(telegram_id, "такси", t_type="income") == ["возврат за такси"]
+    assert _search(telegram_id, "дом", category="Транспорт") == ["такси домой"]
+    assert _search(telegram_id, "елоч") == ["Ёлочные игрушки"]
+    assert _search(telegram_id, "") == []
+    assert _search(telegram_id, 'кофе" OR "такси') == []
+
+
+def test_search_follows_edits(new_user):
+    telegram_id = new_user()
+    db.add_transactions_batch(telegram_id, [("expense", 8, "пицца", None)], "tester")
+    transaction_id = db.list_transactions(telegram_id, "expense", None, None)[0][0]
+    assert db.update_transaction(telegram_id, transaction_id, 8, "суши", "")
+    assert _search(telegram_id, "пицца") == []
+    assert _search(telegram_id, "суши") == ["суши"]
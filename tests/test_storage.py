@@ -0,0 +1,181 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+
+ARCHIVE_BEFORE = "2025-01-01T00:00:00"
+WINDOWS = (
+    (None, None),
+    ("2023-06-01T00:00:00", "2023-12-31T23:59:59"),
+    ("2024-03-01T00:00:00", None),
+    ("2024-11-15T00:00:00", "2025-02-10T00:00:00"),
+)
+
+
+@pytest.fixture(scope="module")
+def seeded(new_user):
+    telegram_id = new_user()
+    rng = random.Random(7)
+    entries = []
+    day = datetime(2023, 1, 1, 9)
+    while day < datetime.utcnow() - timedelta(days=1):
+        t_type = "income" if rng.random() < 0.3 else "expense"
+        entries.append(
+            (
+                day.isoformat(timespec="seconds"),
+                t_type,
+                round(rng.uniform(1, 500), 2),
+                f"item {len(entries)}",
+                rng.choice(["Еда", "Транспорт", None]),
+            )
+        )
+        day += timedelta(days=rng.randint(1, 9), minutes=rng.randint(0, 600))
+    for created_at, t_type, amount, description, category in entries:
+        db.add_transactions_batch(
+            telegram_id, [(t_type, amount, description, category)], "tester", created_at
+        )
+    return telegram_id, entries
+
+
+def _matching(entries, t_type, start, end):
+    return [
+        entry
+        for entry in entries
+        if entry[1] == t_type
+        and (start is None or entry[0] >= start)
+        and (end is None or entry[0] <= end)
+    ]
+
+
+def _listed(entries):
+    return [
+        (amount, description, "tester", category or "", created_at)
+        for created_at, _, amount, description, category in reversed(entries)
+    ]
+
+
+def _totals(rows):
+    return sorted((key, round(value, 6)) for key, value in rows)
+
+
+def _snapshot(telegram_id):
+    state = {
+        "balance": round(db.get_budget_summary(telegram_id), 6),
+        "history": {
+            (resolution, start, end): _totals(
+                db.balance_history(telegram_id, resolution, start, end)
+            )
+            for resolution in db.BALANCE_RESOLUTIONS
+            for start, end in WINDOWS
+        },
+    }
+    for t_type in ("income", "expense"):
+        state[t_type, "recent"] = db.get_recent_transactions(telegram_id, t_type, 10)
+        for start, end in WINDOWS:
+            state[t_type, start, end] = (
+                db.list_transactions(telegram_id, t_type, start, end, limit=50),
+                _totals(db.category_summary(telegram_id, t_type, start, end)),
+            )
+    return state
+
+
+def _check_reference(telegram_id, entries):
+    balance = sum(
+        amount if t_type == "income" else -amount for _, t_type, amount, _, _ in entries
+    )
+    assert db.get_budget_summary(telegram_id) == pytest.approx(balance)
+    for t_type in ("income", "expense"):
+        recent = db.get_recent_transactions(telegram_id, t_type, 10)
+        expected = _listed(_matching(entries, t_type, None, None))[:10]
+        assert [tuple(row[1:]) for row in recent] == expected
+        for start, end in WINDOWS:
+            matching = _matching(entries, t_type, start, end)
+            rows = db.list_transactions(telegram_id, t_type, start, end, limit=50)
+            assert [tuple(row[1:]) for row in rows] == _listed(matching)[:50]
+            totals: dict[str, float] = {}
+            for _, _, amount, _, category in matching:
+                name = category or "Без категории"
+                totals[name] = totals.get(name, 0) + amount
+            summary = dict(db.category_summary(telegram_id, t_type, start, end))
+            assert summary == pytest.approx(totals)
+    for start, end in WINDOWS:
+        running = 0.0
+        expected = []
+        for month in sorted({entry[0][:7] for entry in entries}):
+            running += sum(
+                amount if t_type == "income" else -amount
+                for created_at, t_type, amount, _, _ in entries
+                if created_at[:7] == month
+            )
+            if (start is None or month >= start[:7]) and (end is None or month <= end[:7]):
+                expected.append((month, running))
+        history = db.balance_history(telegram_id, "month", start, end)
+        assert [period for period, _ in history] == [period for period, _ in expected]
+        assert [value for _, value in history] == pytest.approx([value for _, value in expected])
+
+
+def test_reads_match_reference(seeded):
+    _check_reference(*seeded)
+
+
+@pytest.mark.skipif(db.DB_KIND != "sqlite", reason="archives are SQLite only")
+def test_archived_reads_match_hot_reads(seeded):
+    telegram_id, entries = seeded
+    before = _snapshot(telegram_id)
+    assert db.archive_transactions(ARCHIVE_BEFORE) > 0
+    with db._connect(telegram_id) as conn:
+        hot = db._execute(conn, "SELECT MIN(created_at) FROM transactions").fetchone()[0]
+    assert hot >= ARCHIVE_BEFORE
+    assert _snapshot(telegram_id) == before
+    _check_reference(telegram_id, entries)
+
+
+@pytest.mark.skipif(db.DB_KIND != "sqlite", reason="archives are SQLite only")
+def test_backdated_archived_row_stays_recent(new_user):
+    telegram_id = new_user()
+    for index in range(12):
+        db.add_transactions_batch(telegram_id, [("expense", 10 + index, "fresh", None)], "tester")
+    db.add_transactions_batch(
+        telegram_id, [("expense", 99, "late", None)], "tester", "2023-03-01T00:00:00"
+    )
+    assert db.archive_transactions(ARCHIVE_BEFORE) == 1
+    recent = db.get_recent_transactions(telegram_id, "expense", 10)
+    assert [row[2] for row in recent] == ["late"] + ["fresh"] * 9
+
+
+def _rev(telegram_id):
+    with db._connect(telegram_id) as conn:
+        budget_id = db._get_budget_id(conn, telegram_id)
+        cur = db._execute(conn, "SELECT rev FROM budgets WHERE id = ?", (budget_id,))
+        return cur.fetchone()[0]
+
+
+def _ids(telegram_id):
+    return {row[2]: row[0] for row in db.list_transactions(telegram_id, "expense", None, None)}
+
+
+def test_update_missing_transaction_keeps_rev(new_user):
+    telegram_id = new_user()
+    db.add_transactions_batch(telegram_id, [("expense", 10, "hot", None)], "tester")
+    rev = _rev(telegram_id)
+    assert not db.update_transaction(telegram_id, 10**9, 5, "missing", "")
+    assert _rev(telegram_id) == rev
+    assert db.update_transaction(telegram_id, _ids(telegram_id)["hot"], 12, "hot", "Еда")
+    assert _rev(telegram_id) == rev + 1
+
+
+@pytest.mark.skipif(db.DB_KIND != "sqlite", reason="archives are SQLite only")
+def test_update_archived_transaction_is_rejected(new_user):
+    telegram_id = new_user()
+    db.add_transactions_batch(
+        telegram_id, [("expense", 10, "old", None)], "tester", "2023-05-01T00:00:00"
+    )
+    transaction_id = _ids(telegram_id)["old"]
+    db.archive_transactions(ARCHIVE_BEFORE)
+    rev = _rev(telegram_id)
+    with pytest.raises(ValueError):
+        db.update_transaction(telegram_id, transaction_id, 20, "edited", "")
+    assert _rev(telegram_id) == rev
+    assert db.get_budget_summary(telegram_id) == -10
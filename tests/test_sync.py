@@ -0,0 +1,58 @@
+import db
+
+WINDOW_START = "2000-01-01T00:00:00"
+
+
+def _sync(telegram_id: int, token: tuple[int, int] | None, limit: int = 100) -> dict:
+    return db.sync_changes(telegram_id, token, WINDOW_START, limit)
+
+
+def _token(changes: dict) -> tuple[int, int]:
+    return changes["budget_id"], changes["rev"]
+
+
+def _descriptions(changes: dict) -> list[str]:
+    return [row[3] for row in changes["transactions"]]
+
+
+def test_delta_sync_returns_only_new_revisions(new_user):
+    telegram_id = new_user()
+    db.add_transactions_batch(telegram_id, [("expense", 5, "first", None)], "tester")
+    full = _sync(telegram_id, None)
+    assert full["reset"] and _descriptions(full) == ["first"]
+    assert full["plans"] == [] and full["categories"] == []
+    assert _sync(telegram_id, _token(full)) == {
+        "budget_id": full["budget_id"],
+        "rev": full["rev"],
+        "reset": False,
+        "changed": False,
+    }
+
+    db.add_transactions_batch(telegram_id, [("income", 9, "second", "Зарплата")], "tester")
+    delta = _sync(telegram_id, _token(full))
+    assert not delta["reset"] and _descriptions(delta) == ["second"]
+    assert delta["balance"] == 4
+    assert delta["plans"] is None
+    assert [row[2] for row in delta["categories"]] == ["Зарплата"]
+
+    first_id = full["transactions"][0][0]
+    assert db.update_transaction(telegram_id, first_id, 6, "edited", "")
+    db.add_plan(telegram_id, "Goal", "", 100, "tester")
+    delta = _sync(telegram_id, _token(delta))
+    assert _descriptions(delta) == ["edited"]
+    assert [row[1] for row in delta["plans"]] == ["Goal"]
+    assert delta["categories"] is None
+
+
+def test_stale_or_foreign_tokens_reset(new_user):
+    telegram_id, other = new_user(), new_user()
+    db.add_transactions_batch(telegram_id, [("expense", 1, "one", None)], "tester")
+    current = _token(_sync(telegram_id, None))
+    foreign = _token(_sync(other, None))
+    assert _sync(telegram_id, foreign)["reset"]
+    assert _sync(telegram_id, (current[0], current[1] + 1))["reset"]
+    for index in range(3):
+        db.add_transactions_batch(telegram_id, [("expense", 1, f"more {index}", None)], "tester")
+    overflow = _sync(telegram_id, current, limit=2)
+    assert overflow["reset"]
+    assert _descriptions(overflow) == ["one", "more 0", "more 1", "more 2"]
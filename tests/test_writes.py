@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+
+import pytest
+
+import db
+
+
+def _batch(*telegram_ids: int) -> list:
+    return [
+        ((telegram_id, "expense", 10.0 + index, "batched", "tester", None, db._now()), Future())
+        for index, telegram_id in enumerate(telegram_ids)
+    ]
+
+
+def _count(telegram_id: int) -> int:
+    return len(db.list_transactions(telegram_id, "expense", None, None))
+
+
+def test_group_commit_resolves_every_future(new_user):
+    first, second = new_user(), new_user()
+    batch = _batch(first, second, first, 10**12)
+    db._GroupCommitWriter(10, 0)._commit(batch)
+    assert [future.result() for _, future in batch[:3]] == [[], [], []]
+    with pytest.raises(RuntimeError):
+        batch[3][1].result()
+    assert (_count(first), _count(second)) == (2, 1)
+
+
+def test_group_commit_failure_reaches_every_future(new_user, monkeypatch):
+    first, second = new_user(), new_user()
+    monkeypatch.setattr(db, "_INSERT_TRANSACTION", "INSERT INTO missing_table VALUES (?)")
+    batch = _batch(first, second, first)
+    db._GroupCommitWriter(10, 0)._commit(batch)
+    assert all(future.exception(timeout=0) is not None for _, future in batch)
+    monkeypatch.undo()
+    assert (_count(first), _count(second)) == (0, 0)
+
+
+def test_group_commit_routing_failure_reaches_every_future(new_user, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("directory unavailable")
+
+    monkeypatch.setattr(db, "_shard_for", fail)
+    monkeypatch.setattr(db._GroupCommitWriter, "_commit_shard", fail)
+    batch = _batch(new_user(), new_user())
+    db._GroupCommitWriter(10, 0)._commit(batch)
+    for _, future in batch:
+        with pytest.raises(RuntimeError, match="directory unavailable"):
+            future.result(timeout=0)
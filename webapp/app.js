@@ -28,10 +28,18 @@ let statsChart = null;
 let isOwner = false;
 let currentUserId = null;
 let currentDisplayName = null;
-let lastUpdateAt = null;
 let updateTimer = null;
 let incomeSubmitting = false;
 let expenseSubmitting = false;
+let cache = null;
+let syncing = null;
+let replaying = false;
+let replayNotBefore = 0;
+
+const CACHE_DB = "tgmoney";
+const REQUEST_TIMEOUT_MS = 8000;
+const REPLAY_DROP_STATUSES = new Set([400, 403, 404, 422]);
+const REPLAY_RETRY_MS = 5000;
 
 function showPanel(name) {
   Object.values(panels).forEach((panel) => panel.classList.add("hidden"));
@@ -49,16 +57,32 @@ function formatMoney(value) {
   return Number(value || 0).toFixed(2);
 }
 
-async function apiPost(path, body) {
-  const res = await fetch(`${API_BASE}${path}`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify(body),
-  });
+async function apiPost(path, body, headers = {}) {
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), REQUEST_TIMEOUT_MS);
+  let res;
+  try {
+    res = await fetch(`${API_BASE}${path}`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", ...headers },
+      body: JSON.stringify(body),
+      signal: controller.signal,
+    });
+  } catch (_err) {
+    const error = new Error("Нет соединения с сервером.");
+    error.offline = true;
+    throw error;
+  } finally {
+    clearTimeout(timer);
+  }
   if (!res.ok) {
     const data = await res.json().catch(() => ({}));
     const message = data.detail || "Ошибка запроса";
-    throw new Error(message);
+    const error = new Error(message);
+    error.status = res.status;
+    const retryAfter = Number(res.headers.get("Retry-After"));
+    error.retryAfter = Number.isFinite(retryAfter) && retryAfter > 0 ? retryAfter : null;
+    throw error;
   }
   return res.json();
 }
@@ -73,25 +97,212 @@ function ensureTelegram() {
   return true;
 }
 
+function openCacheDb() {
+  if (!window.indexedDB) return Promise.resolve(null);
+  if (!openCacheDb.promise) {
+    openCacheDb.promise = new Promise((resolve) => {
+      const req = indexedDB.open(CACHE_DB, 1);
+      req.onupgradeneeded = () => {
+        req.result.createObjectStore("state");
+        req.result.createObjectStore("outbox", { keyPath: "id", autoIncrement: true });
+      };
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => resolve(null);
+    });
+  }
+  return openCacheDb.promise;
+}
+
+async function idbRequest(storeName, mode, action) {
+  const db = await openCacheDb();
+  if (!db) return null;
+  return new Promise((resolve) => {
+    const tx = db.transaction(storeName, mode);
+    const req = action(tx.objectStore(storeName));
+    tx.oncomplete = () => resolve(req.result);
+    tx.onerror = () => resolve(null);
+    tx.onabort = () => resolve(null);
+  });
+}
+
+function cacheKey() {
+  const user = tg && tg.initDataUnsafe ? tg.initDataUnsafe.user : null;
+  return user ? String(user.id) : "anonymous";
+}
+
+async function loadCache() {
+  const stored = await idbRequest("state", "readonly", (store) =>
+    store.get(cacheKey())
+  );
+  cache = stored || {
+    token: null,
+    session: null,
+    transactions: {},
+    plans: [],
+    categories: [],
+  };
+}
+
+function saveCache() {
+  return idbRequest("state", "readwrite", (store) => store.put(cache, cacheKey()));
+}
+
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+async function submitWrite(path, body) {
+  const key = newIdempotencyKey();
+  try {
+    return await apiPost(
+      path,
+      { ...body, initData: tg.initData },
+      { "Idempotency-Key": key }
+    );
+  } catch (err) {
+    if (!err.offline) throw err;
+    const queued = await idbRequest("outbox", "readwrite", (store) =>
+      store.add({ user: cacheKey(), path, body, key, createdAt: Date.now() })
+    );
+    if (!queued) throw err;
+    return null;
+  }
+}
+
+async function replayOutbox() {
+  if (replaying || Date.now() < replayNotBefore) return;
+  replaying = true;
+  try {
+    const items = (await idbRequest("outbox", "readonly", (store) => store.getAll())) || [];
+    for (const item of items) {
+      if (item.user !== cacheKey()) continue;
+      try {
+        await apiPost(
+          item.path,
+          { ...item.body, initData: tg.initData },
+          { "Idempotency-Key": item.key }
+        );
+      } catch (err) {
+        if (!REPLAY_DROP_STATUSES.has(err.status)) {
+          replayNotBefore = Date.now() + (err.retryAfter ? err.retryAfter * 1000 : REPLAY_RETRY_MS);
+          break;
+        }
+      }
+      await idbRequest("outbox", "readwrite", (store) => store.delete(item.id));
+    }
+  } finally {
+    replaying = false;
+  }
+}
+
+function applySession(session) {
+  isOwner = session.is_owner;
+  currentUserId = session.telegram_id;
+  currentDisplayName = session.display_name;
+  currentMode = session.mode;
+  if (session.has_shared && currentMode === "shared") {
+    startUpdatePolling();
+  } else {
+    stopUpdatePolling();
+  }
+}
+
+function rowsToObjects(data) {
+  return data.items.map((row) =>
+    Object.fromEntries(data.fields.map((field, index) => [field, row[index]]))
+  );
+}
+
+function mergeSync(data) {
+  const fresh = [];
+  if (data.reset) cache.transactions = {};
+  rowsToObjects(data.transactions).forEach((item) => {
+    if (!data.reset && !cache.transactions[item.id]) fresh.push(item);
+    cache.transactions[item.id] = item;
+  });
+  Object.keys(cache.transactions).forEach((id) => {
+    if (cache.transactions[id].created_at < data.window_start) {
+      delete cache.transactions[id];
+    }
+  });
+  if (data.plans) cache.plans = rowsToObjects(data.plans);
+  if (data.categories) cache.categories = rowsToObjects(data.categories);
+  cache.balance = data.balance;
+  return fresh;
+}
+
+function renderCached() {
+  if (cache.balance !== undefined) balanceEl.textContent = formatMoney(cache.balance);
+  renderPlans();
+  renderTransactions("income");
+  renderTransactions("expense");
+  renderCategories("income");
+  renderCategories("expense");
+}
+
+function sync() {
+  if (!syncing) {
+    syncing = runSync().finally(() => {
+      syncing = null;
+    });
+  }
+  return syncing;
+}
+
+async function runSync() {
+  await replayOutbox();
+  const data = await apiPost("/api/sync", {
+    initData: tg.initData,
+    token: cache.token,
+  });
+  cache.session = {
+    telegram_id: data.telegram_id,
+    display_name: data.display_name,
+    is_owner: data.is_owner,
+    mode: data.mode,
+    has_shared: data.has_shared,
+  };
+  applySession(cache.session);
+  const fresh = data.changed ? mergeSync(data) : [];
+  cache.token = data.token;
+  await saveCache();
+  if (data.changed) renderCached();
+  return fresh;
+}
+
+async function revalidate() {
+  try {
+    await sync();
+  } catch (err) {
+    showToast(err.offline ? "Нет сети — показаны сохраненные данные." : err.message);
+  }
+}
+
 async function init() {
   if (!ensureTelegram()) return;
   tg.expand();
+  await loadCache();
+  if (cache.session) {
+    applySession(cache.session);
+    renderCached();
+  }
   try {
-    const data = await apiPost("/api/init", { initData: tg.initData });
-    balanceEl.textContent = formatMoney(data.balance);
-    isOwner = data.is_owner;
-    currentUserId = data.telegram_id;
-    currentDisplayName = data.display_name;
-    currentMode = data.mode;
-    lastUpdateAt = new Date().toISOString().slice(0, 19);
-    await loadPlans();
-    await loadUsers();
+    await sync();
   } catch (err) {
+    if (cache.session) {
+      showToast(err.offline ? "Нет сети — показаны сохраненные данные." : err.message);
+      return;
+    }
     errorMessage.textContent = err.message;
     showPanel("error");
   }
 }
 
+window.addEventListener("online", () => {
+  if (cache) revalidate();
+});
+
 document.querySelectorAll(".back").forEach((btn) => {
   btn.addEventListener("click", () => {
     showPanel("home");
@@ -141,21 +352,23 @@ document.getElementById("income-add").addEventListener("click", async () => {
   incomeBtn.disabled = true;
   incomeBtn.textContent = "Сохраняю...";
   try {
-    const data = await apiPost("/api/transaction", {
-      initData: tg.initData,
+    const data = await submitWrite("/api/transaction", {
       t_type: "income",
       amount,
       description,
       category,
     });
-    balanceEl.textContent = formatMoney(data.balance);
-    result.textContent = "Доход добавлен.";
+    if (data) {
+      balanceEl.textContent = formatMoney(data.balance);
+      result.textContent = "Доход добавлен.";
+    } else {
+      result.textContent = "Нет сети — запись будет отправлена позже.";
+    }
     document.getElementById("income-amount").value = "";
     document.getElementById("income-desc").value = "";
     document.getElementById("income-category").value = "";
     document.getElementById("income-category-select").value = "";
-    await loadCategories("income");
-    await loadTransactions("income");
+    if (data) await revalidate();
   } catch (err) {
     result.textContent = err.message;
   } finally {
@@ -185,21 +398,23 @@ document.getElementById("expense-add").addEventListener("click", async () => {
   expenseBtn.disabled = true;
   expenseBtn.textContent = "Сохраняю...";
   try {
-    const data = await apiPost("/api/transaction", {
-      initData: tg.initData,
+    const data = await submitWrite("/api/transaction", {
       t_type: "expense",
       amount,
       description,
       category,
     });
-    balanceEl.textContent = formatMoney(data.balance);
-    result.textContent = "Расход добавлен.";
+    if (data) {
+      balanceEl.textContent = formatMoney(data.balance);
+      result.textContent = "Расход добавлен.";
+    } else {
+      result.textContent = "Нет сети — запись будет отправлена позже.";
+    }
     document.getElementById("expense-amount").value = "";
     document.getElementById("expense-desc").value = "";
     document.getElementById("expense-category").value = "";
     document.getElementById("expense-category-select").value = "";
-    await loadCategories("expense");
-    await loadTransactions("expense");
+    if (data) await revalidate();
   } catch (err) {
     result.textContent = err.message;
   } finally {
@@ -234,6 +449,7 @@ document.getElementById("join-submit").addEventListener("click", async () => {
     out.textContent = "Бюджет объединен.";
     document.getElementById("join-code").value = "";
     await loadUsers();
+    await revalidate();
     startUpdatePolling();
   } catch (err) {
     out.textContent = err.message;
@@ -248,6 +464,7 @@ document.getElementById("leave-budget").addEventListener("click", async () => {
     balanceEl.textContent = formatMoney(data.balance);
     out.textContent = "Вы вышли из общего бюджета.";
     await loadUsers();
+    await revalidate();
     stopUpdatePolling();
   } catch (err) {
     out.textContent = err.message;
@@ -319,13 +536,14 @@ document.getElementById("plan-save").addEventListener("click", async () => {
     return;
   }
   try {
-    await apiPost("/api/plan", {
-      initData: tg.initData,
+    const data = await submitWrite("/api/plan", {
       title,
       description,
       target_amount: targetAmount,
     });
-    out.textContent = "План сохранен.";
+    out.textContent = data
+      ? "План сохранен."
+      : "Нет сети — план будет сохранен позже.";
     document.getElementById("plan-title").value = "";
     document.getElementById("plan-desc").value = "";
     document.getElementById("plan-amount").value = "";
@@ -382,15 +600,18 @@ document.getElementById("plan-deposit").addEventListener("click", async () => {
     return;
   }
   try {
-    await apiPost("/api/plan/deposit", {
-      initData: tg.initData,
+    const data = await submitWrite("/api/plan/deposit", {
       plan_id: currentPlanId,
       amount,
     });
-    out.textContent = "Баланс плана пополнен.";
     document.getElementById("plan-deposit-amount").value = "";
+    if (!data) {
+      out.textContent = "Нет сети — пополнение будет отправлено позже.";
+      return;
+    }
+    await revalidate();
     await loadPlanDetail(currentPlanId);
-    await loadPlans();
+    out.textContent = "Баланс плана пополнен.";
   } catch (err) {
     out.textContent = err.message;
   }
@@ -409,6 +630,7 @@ document.getElementById("switch-budget").addEventListener("click", async () => {
     balanceEl.textContent = formatMoney(data.balance);
     out.textContent = `Активен бюджет: ${currentMode}`;
     await loadUsers();
+    await revalidate();
   } catch (err) {
     out.textContent = err.message;
   }
@@ -464,42 +686,49 @@ document.querySelectorAll("[data-period]").forEach((btn) => {
 
 async function loadPlans() {
   if (!ensureTelegram()) return;
+  renderPlans();
+  await revalidate();
+}
+
+function renderPlans() {
   const list = document.getElementById("plans-list");
   list.innerHTML = "";
-  try {
-    const data = await apiPost("/api/plans", { initData: tg.initData });
-    if (!data.items.length) {
-      list.innerHTML = "<div class=\"result\">Планов пока нет.</div>";
-      return;
-    }
-    data.items.forEach((plan) => {
-      const card = document.createElement("div");
-      card.className = "plan-card";
-      card.dataset.planId = plan.id;
-      const progress = Math.min(
-        100,
-        plan.target_amount ? (plan.current_amount / plan.target_amount) * 100 : 0
-      );
-      const remaining = Math.max(plan.target_amount - plan.current_amount, 0);
-      card.innerHTML = `
-        <h4>${plan.title}</h4>
-        <div>${plan.description || ""}</div>
-        <div class="plan-meta">Цель: ${formatMoney(plan.target_amount)}</div>
-        <div class="plan-meta">Накоплено: ${formatMoney(
-          plan.current_amount
-        )} · Осталось: ${formatMoney(remaining)}</div>
-        <div class="plan-progress"><span style="width:${progress.toFixed(
-          1
-        )}%"></span></div>
-      `;
-      card.addEventListener("click", () => {
-        loadPlanDetail(plan.id);
-      });
-      list.appendChild(card);
-    });
-  } catch (err) {
-    list.innerHTML = `<div class="result">${err.message}</div>`;
+  if (!cache.plans.length) {
+    list.innerHTML = "<div class=\"result\">Планов пока нет.</div>";
+    return;
   }
+  cache.plans.forEach((plan) => {
+    const card = document.createElement("div");
+    card.className = "plan-card";
+    card.dataset.planId = plan.id;
+    const progress = Math.min(
+      100,
+      plan.target_amount ? (plan.current_amount / plan.target_amount) * 100 : 0
+    );
+    const remaining = Math.max(plan.target_amount - plan.current_amount, 0);
+    const forecast =
+      plan.forecast && plan.forecast.eta
+        ? `<div class="plan-meta">Прогноз: ${plan.forecast.eta} · ${formatMoney(
+            plan.forecast.monthly_pace
+          )} в месяц</div>`
+        : "";
+    card.innerHTML = `
+      <h4>${plan.title}</h4>
+      <div>${plan.description || ""}</div>
+      <div class="plan-meta">Цель: ${formatMoney(plan.target_amount)}</div>
+      <div class="plan-meta">Накоплено: ${formatMoney(
+        plan.current_amount
+      )} · Осталось: ${formatMoney(remaining)}</div>
+      ${forecast}
+      <div class="plan-progress"><span style="width:${progress.toFixed(
+        1
+      )}%"></span></div>
+    `;
+    card.addEventListener("click", () => {
+      loadPlanDetail(plan.id);
+    });
+    list.appendChild(card);
+  });
 }
 
 async function loadPlanDetail(planId) {
@@ -509,10 +738,12 @@ async function loadPlanDetail(planId) {
   const current = document.getElementById("plan-current");
   out.textContent = "";
   try {
-    const data = await apiPost("/api/plan/get", {
-      initData: tg.initData,
-      plan_id: planId,
-    });
+    const data =
+      cache.plans.find((plan) => plan.id === planId) ||
+      (await apiPost("/api/plan/get", {
+        initData: tg.initData,
+        plan_id: planId,
+      }));
     document.getElementById("plan-edit-title").value = data.title;
     document.getElementById("plan-edit-desc").value = data.description;
     document.getElementById("plan-edit-target").value = data.target_amount;
@@ -528,6 +759,11 @@ async function loadPlanDetail(planId) {
 
 async function loadTransactions(tType) {
   if (!ensureTelegram()) return;
+  renderTransactions(tType);
+  await revalidate();
+}
+
+function renderTransactions(tType) {
   const list = document.getElementById(
     tType === "income" ? "income-list" : "expense-list"
   );
@@ -538,40 +774,37 @@ async function loadTransactions(tType) {
   const dd = String(today.getDate()).padStart(2, "0");
   const start = `${yyyy}-${mm}-${dd}T00:00:00`;
   const end = `${yyyy}-${mm}-${dd}T23:59:59`;
-  try {
-    const data = await apiPost("/api/transactions/list", {
-      initData: tg.initData,
-      t_type: tType,
-      start,
-      end,
-    });
-    if (!data.items.length) {
-      list.innerHTML = "<div class=\"result\">Нет записей.</div>";
-      return;
-    }
-    data.items.forEach((item) => {
-      const row = document.createElement("div");
-      row.className = "list-item";
-      row.innerHTML = `
-        <span><strong>${formatMoney(item.amount)}</strong> · ${
-          item.description || "Без описания"
-        } · ${item.category || "Без категории"}</span>
-        <span>${item.added_by || "—"}</span>
-      `;
-      row.addEventListener("click", () => {
-        currentTxId = item.id;
-        currentTxType = tType;
-        document.getElementById("tx-edit-amount").value = item.amount;
-        document.getElementById("tx-edit-desc").value = item.description;
-        document.getElementById("tx-edit-category").value = item.category || "";
-        document.getElementById("tx-edit-result").textContent = "";
-        showPanel("transactionEdit");
-      });
-      list.appendChild(row);
-    });
-  } catch (err) {
-    list.innerHTML = `<div class="result">${err.message}</div>`;
+  const items = Object.values(cache.transactions)
+    .filter(
+      (item) =>
+        item.t_type === tType && item.created_at >= start && item.created_at <= end
+    )
+    .sort((a, b) => b.id - a.id)
+    .slice(0, 50);
+  if (!items.length) {
+    list.innerHTML = "<div class=\"result\">Нет записей.</div>";
+    return;
   }
+  items.forEach((item) => {
+    const row = document.createElement("div");
+    row.className = "list-item";
+    row.innerHTML = `
+      <span><strong>${formatMoney(item.amount)}</strong> · ${
+        item.description || "Без описания"
+      } · ${item.category || "Без категории"}</span>
+      <span>${item.added_by || "—"}</span>
+    `;
+    row.addEventListener("click", () => {
+      currentTxId = item.id;
+      currentTxType = tType;
+      document.getElementById("tx-edit-amount").value = item.amount;
+      document.getElementById("tx-edit-desc").value = item.description;
+      document.getElementById("tx-edit-category").value = item.category || "";
+      document.getElementById("tx-edit-result").textContent = "";
+      showPanel("transactionEdit");
+    });
+    list.appendChild(row);
+  });
 }
 
 async function loadUsers() {
@@ -643,20 +876,23 @@ async function loadUsers() {
 
 async function loadCategories(tType) {
   if (!ensureTelegram()) return;
+  renderCategories(tType);
+  await revalidate();
+}
+
+function renderCategories(tType) {
   const selectId =
     tType === "income" ? "income-category-select" : "expense-category-select";
   const listId =
     tType === "income" ? "income-categories-list" : "expense-categories-list";
   const select = document.getElementById(selectId);
   const list = document.getElementById(listId);
-  try {
-    const data = await apiPost("/api/categories/list", {
-      initData: tg.initData,
-      t_type: tType,
-    });
-    select.innerHTML = "<option value=\"\">Выбрать категорию</option>";
-    list.innerHTML = "";
-    data.items.forEach((item) => {
+  const selected = select.value;
+  select.innerHTML = "<option value=\"\">Выбрать категорию</option>";
+  list.innerHTML = "";
+  cache.categories
+    .filter((item) => item.t_type === tType)
+    .forEach((item) => {
       const opt = document.createElement("option");
       opt.value = item.name;
       opt.textContent = item.name;
@@ -690,9 +926,7 @@ async function loadCategories(tType) {
       row.appendChild(delBtn);
       list.appendChild(row);
     });
-  } catch (err) {
-    list.innerHTML = `<div class="result">${err.message}</div>`;
-  }
+  select.value = selected;
 }
 
 async function renderStats(period = null) {
@@ -764,8 +998,10 @@ function getPeriodRange(period) {
 }
 
 function drawStatsChart(data, canvas) {
-  const labels = data.items.map((item) => item.category);
-  const values = data.items.map((item) => item.total);
+  const categoryIndex = data.fields.indexOf("category");
+  const totalIndex = data.fields.indexOf("total");
+  const labels = data.items.map((row) => row[categoryIndex]);
+  const values = data.items.map((row) => row[totalIndex]);
   const colors = labels.map((_, idx) => {
     const hue = (idx * 47) % 360;
     return `hsl(${hue}, 55%, 60%)`;
@@ -789,22 +1025,16 @@ function startUpdatePolling() {
   updateTimer = setInterval(async () => {
     if (!ensureTelegram()) return;
     try {
-      const data = await apiPost("/api/updates", {
-        initData: tg.initData,
-        since: lastUpdateAt,
-      });
-      if (data.items.length) {
-        const last = data.items[data.items.length - 1];
-        lastUpdateAt = last.created_at;
-        if (last.added_by && last.added_by !== currentDisplayName) {
-          showToast(
-            `${last.added_by} добавил(а) ${
-              last.t_type === "income" ? "доход" : "расход"
-            } ${formatMoney(last.amount)}`
-          );
-          const fresh = await apiPost("/api/init", { initData: tg.initData });
-          balanceEl.textContent = formatMoney(fresh.balance);
-        }
+      const fresh = await sync();
+      const last = fresh
+        .filter((item) => item.added_by && item.added_by !== currentDisplayName)
+        .pop();
+      if (last) {
+        showToast(
+          `${last.added_by} добавил(а) ${
+            last.t_type === "income" ? "доход" : "расход"
+          } ${formatMoney(last.amount)}`
+        );
       }
     } catch (_err) {
       // ignore polling errors